@@ -1,11 +1,15 @@
-from typing import List
+from typing import List, Optional
 import logging
-from fastapi import Depends, APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi_versioning import version
 from sqlalchemy.orm import Session
 
-from db.database import SessionLocal, engine
 from db import schemas, crud, models
+from db.executor import run_in_session
+from api.pagination import decode_cursor, set_next_cursor
+from api.responses import FastJSONResponse, entity_dicts
+from services.cache_service import response_cache, entity_tag
+from config import FAST_SERIALIZATION
 
 # get root logger
 logger = logging.getLogger(__name__)
@@ -13,59 +17,76 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-# Dependency Injection
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.get("", response_model=List[schemas.Entity])
 @version(1, 0)
-def read_entities(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_entities(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """
-    Gets all entities in database paginated by skip and limit.
+    Gets all entities in database paginated by skip and limit, or by cursor.
 
     - :param skip: number of entity objects to skip
     - :param limit: max number of entity objects to return
-    - :param db: injected database
+    - :param cursor: X-Next-Cursor header of previous page, skip is ignored if provided
     - :return: list of entities
     """
-    entities = crud.get_entities(db, skip=skip, limit=limit)
+    if FAST_SERIALIZATION:
+        rows = await run_in_session(crud.get_entity_rows, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+        fast_response = FastJSONResponse(entity_dicts(rows))
+        set_next_cursor(fast_response, [row[0] for row in rows], limit)
+        return fast_response
+    entities = await run_in_session(crud.get_entities, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+    set_next_cursor(response, [entity.id for entity in entities], limit)
     return entities
 
 
 @router.get("/{entity_id}", response_model=schemas.Entity)
 @version(1, 0)
-def get_entity(entity_id: int, db: Session = Depends(get_db)):
+async def get_entity(entity_id: int, request: Request):
     """
-    Get entity object by id.
+    Get entity object by id. Responses are cached, and carry an ETag for conditional requests.
 
     - :param entity_id: ID of selected entity
-    - :param db: injected database
     - :return: list of sentences
     """
-    db_entity = crud.get_entity(db, entity_id=entity_id)
-    if not db_entity:
-        raise HTTPException(status_code=404, detail=f"Entity {entity_id} does not exist")
-    return db_entity
+    def respond(db: Session):
+        def compute(response: Response):
+            db_entity = crud.get_entity(db, entity_id=entity_id)
+            if not db_entity:
+                raise HTTPException(status_code=404, detail=f"Entity {entity_id} does not exist")
+            return schemas.Entity.from_orm(db_entity)
+
+        return response_cache.respond(request, key=f"entity:{entity_id}", tags=[entity_tag(entity_id)],
+                                      compute=compute)
+
+    return await run_in_session(respond)
 
 
 @router.get("/{entity_id}/sentences")
 @version(1, 0)
-def search_entity_sentences(entity_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def search_entity_sentences(entity_id: int, request: Request, skip: int = 0, limit: int = 100,
+                                  cursor: Optional[str] = None):
     """
-    Search for sentences by entity object by id.
+    Search for sentences by entity object by id. Responses are cached until sentences of the entity change,
+    and carry an ETag for conditional requests.
 
     - :param entity_id: ID of selected entity
     - :param skip: number of sentence objects to skip
     - :param limit: max number of sentence objects to return
+    - :param cursor: X-Next-Cursor header of previous page, skip is ignored if provided
     - :return: list of sentences
     """
-    db_entity = crud.get_entity(db, entity_id=entity_id)
-    if not db_entity:
-        raise HTTPException(status_code=404, detail=f"Entity {entity_id} does not exist")
-    db_entity_sents = crud.get_entity_sentences(db, db_entity=db_entity, skip=skip, limit=limit)
-    return db_entity_sents
+    after_id = decode_cursor(cursor)
+
+    def respond(db: Session):
+        def compute(response: Response):
+            db_entity = crud.get_entity(db, entity_id=entity_id)
+            if not db_entity:
+                raise HTTPException(status_code=404, detail=f"Entity {entity_id} does not exist")
+            db_entity_sents = crud.get_entity_sentences(db, db_entity=db_entity, skip=skip, limit=limit,
+                                                        after_id=after_id)
+            set_next_cursor(response, [sent.id for sent in db_entity_sents], limit)
+            return [[sent.text] for sent in db_entity_sents]
+
+        return response_cache.respond(request, key=f"entity_sentences:{entity_id}:{skip}:{limit}:{after_id}",
+                                      tags=[entity_tag(entity_id)], compute=compute)
+
+    return await run_in_session(respond)
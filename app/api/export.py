@@ -0,0 +1,30 @@
+from typing import Optional
+from fastapi import APIRouter
+from fastapi_versioning import version
+from starlette.responses import StreamingResponse
+
+from services.export_service import ExportDataset, export_dataset
+
+router = APIRouter()
+
+
+@router.get("/{dataset}", summary='Export a dataset as NDJSON')
+@version(1, 0)
+def export(dataset: ExportDataset, after_id: Optional[int] = None, compress: bool = False):
+    """
+    Stream all rows of dataset as newline-delimited JSON, read from the database in batches.
+
+    - :param dataset: entities ({id, name, ent_type}), sentences ({id, text, req_id})
+    or entity_sentences ({ent_id, sent_id})
+    - :param after_id: only export rows with id (ent_id for entity_sentences) greater than after_id,
+    e.g. to resume an interrupted export
+    - :param compress: gzip the stream
+    - :return: NDJSON stream, or gzip file of NDJSON if compressed
+    """
+    filename = f'{dataset.value}.ndjson'
+    media_type = 'application/x-ndjson'
+    if compress:
+        filename += '.gz'
+        media_type = 'application/gzip'
+    return StreamingResponse(export_dataset(dataset, after_id=after_id, compress=compress), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="{filename}"'})
@@ -0,0 +1,71 @@
+from fastapi import APIRouter
+from fastapi_versioning import version
+from starlette.responses import Response
+
+from db.database import SessionLocal
+from db import crud
+from services.cache_service import response_cache
+from services.metrics_service import registry, register_collector
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+def _queue_depth():
+    db = SessionLocal()
+    try:
+        return {(status,): count for status, count in crud.count_requests_by_status(db).items()}
+    finally:
+        db.close()
+
+
+def _cache_counter(name: str):
+    return lambda: {(): response_cache.stats()[name]}
+
+
+# Caches of entity IDs, by name and by normalized name, by label value of metrics
+ENTITY_CACHES = {'id': crud.entity_id_cache, 'norm': crud.entity_norm_cache}
+
+
+def _entity_cache_stat(name: str):
+    return lambda: {(cache,): entity_cache.stats()[name] for cache, entity_cache in ENTITY_CACHES.items()}
+
+
+register_collector('ner_requests', 'Requests in the database by status, e.g. queue depth.', ['status'], _queue_depth)
+register_collector('ner_response_cache_hits_total', 'Hits of the response cache of read endpoints.', [],
+                   _cache_counter('hits'), metric_type='counter')
+register_collector('ner_response_cache_misses_total', 'Misses of the response cache of read endpoints.', [],
+                   _cache_counter('misses'), metric_type='counter')
+register_collector('ner_response_cache_not_modified_total', '304 Not Modified responses of cached endpoints.', [],
+                   _cache_counter('not_modified'), metric_type='counter')
+register_collector('ner_entity_cache_hits_total',
+                   'Hits of the entity ID caches, by name (id) and normalized name (norm).', ['cache'],
+                   _entity_cache_stat('hits'), metric_type='counter')
+register_collector('ner_entity_cache_misses_total', 'Misses of the entity ID caches.', ['cache'],
+                   _entity_cache_stat('misses'), metric_type='counter')
+register_collector('ner_entity_cache_size', 'Entries of the entity ID caches.', ['cache'], _entity_cache_stat('size'))
+
+
+@router.get("", response_class=Response, summary='Prometheus metrics')
+@version(1, 0)
+def read_metrics():
+    """
+    Get metrics of this webservice process in the Prometheus text format: seconds spent in each
+    ingest stage (fetch, extract, ner, persist), model throughput, database statements, HTTP requests,
+    response cache and entity cache counters and number of requests by status.
+
+    - :return: text exposition format
+    """
+    return Response(content=registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@router.get("/cache")
+@version(1, 0)
+def read_cache_metrics():
+    """
+    Get counters of the response cache of read endpoints.
+
+    - :return: backend, hits, misses, hit_rate, not_modified (304 responses) and counters of backend
+    """
+    return response_cache.stats()
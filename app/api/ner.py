@@ -0,0 +1,48 @@
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException
+from fastapi_versioning import version
+
+from db import schemas
+from db.executor import run_in_writer_session
+from services.nlp_service import tag_text_async, store_tagged_text
+from config import NER_REQUEST_MAX_TEXTS, NER_REQUEST_MAX_CHARS
+
+# get root logger
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+async def _extract_document(text: str, persist: bool) -> schemas.NerDocument:
+    tagged_sentences = await tag_text_async(text)
+    req_id = None
+    if persist:
+        req_id = await run_in_writer_session(store_tagged_text, text, tagged_sentences)
+    return schemas.NerDocument(
+        sentences=[schemas.NerSentence(text=sent.text, start_char=sent.start_char, entities=sent.entities)
+                   for sent in tagged_sentences],
+        req_id=req_id)
+
+
+@router.post("", response_model=schemas.NerResponse, summary='Extract named entities of text')
+@version(1, 0)
+async def extract_entities(ner_request: schemas.NerRequest):
+    """
+    Extract named entities of raw text synchronously. Concurrent calls share NER batches.
+    Calls of more than NER_REQUEST_MAX_TEXTS texts or NER_REQUEST_MAX_CHARS characters in total
+    are rejected with status 413, submit large documents as requests instead.
+
+    - :param ner_request: text or list of texts, and whether to persist results
+    - :return: sentences with named entities of each text
+    """
+    texts = ([ner_request.text] if ner_request.text is not None else []) + ner_request.texts
+    if not texts:
+        raise HTTPException(status_code=422, detail="No text provided.")
+    if len(texts) > NER_REQUEST_MAX_TEXTS:
+        raise HTTPException(status_code=413, detail=f"Call exceeds {NER_REQUEST_MAX_TEXTS} texts.")
+    if sum(len(text) for text in texts) > NER_REQUEST_MAX_CHARS:
+        raise HTTPException(status_code=413, detail=f"Texts exceed {NER_REQUEST_MAX_CHARS} characters in total.")
+
+    documents = await asyncio.gather(*(_extract_document(text, ner_request.persist) for text in texts))
+    return schemas.NerResponse(documents=documents)
@@ -0,0 +1,48 @@
+import base64
+import binascii
+import json
+from typing import List, Optional
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(last_id: int) -> str:
+    """
+    Encode opaque cursor token pointing after last returned object.
+
+    :param last_id: ID of last returned object.
+    :return: cursor token.
+    """
+    return base64.urlsafe_b64encode(json.dumps({'id': last_id}).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """
+    Decode cursor token.
+
+    :param cursor: cursor token returned in X-Next-Cursor header, or None.
+    :return: ID of last returned object, or None if no cursor is provided.
+    """
+    if cursor is None:
+        return None
+    try:
+        after_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))['id']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if not isinstance(after_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    return after_id
+
+
+def set_next_cursor(response: Response, ids: List[int], limit: int) -> None:
+    """
+    Set X-Next-Cursor header to cursor of next page, if the page is full.
+
+    :param response: response of page.
+    :param ids: IDs of objects in page, in order.
+    :param limit: max number of objects per page.
+    """
+    if ids and len(ids) >= limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(ids[-1])
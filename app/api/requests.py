@@ -1,36 +1,44 @@
-from typing import List
+from typing import List, Optional, Tuple
+import json
 import logging
-from fastapi import Depends, APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Request, Response
 from fastapi_versioning import version
 from sqlalchemy.orm import Session
 
-from db.database import SessionLocal, engine
 from db import schemas, crud, models
+from db.executor import run_in_session, run_in_writer_session
+from api.pagination import decode_cursor, set_next_cursor
+from api.responses import FastJSONResponse, request_dicts, sentence_dicts
 
-from services.scraper_service import get_web_text, check_valid_url
+from services.scraper_service import check_valid_url, canonicalize_url, probe_url
+from services.scheduler_service import scheduler
+from services.fetch_service import FetchError
+from config import INGEST_MODE, VALIDATE_URL_PROBE, REQUEST_BATCH_MAX_SIZE, FAST_SERIALIZATION
 
 # get root logger
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+NDJSON_MEDIA_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq')
 
-# Dependency Injection
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Item status of batch submissions, by status of the existing request
+SUBMISSION_STATUSES = {
+    None: 'created',
+    models.Statuses.Error.name: 'requeued',
+    models.Statuses.Queued.name: 'queued',
+    models.Statuses.Processing.name: 'processing',
+    models.Statuses.Success.name: 'processed',
+}
 
 
 @router.post("/", response_model=schemas.Request, status_code=201, summary='Create a request')
 @version(1, 0)
-async def create_request(request: schemas.RequestCreate, background_tasks: BackgroundTasks,
-                         db: Session = Depends(get_db)):
+async def create_request(request: schemas.RequestCreate, background_tasks: BackgroundTasks):
     """
-    Create a request to perform Named Entity Recognition.
-    - :param request: Request object containing path
+    Create a request to perform Named Entity Recognition. URL paths are stored in canonical form.
+    Queued requests are processed by descending priority, then in order of submission.
+    - :param request: Request object containing path, and optionally priority (default 0)
     - :return: request object
     """
     request_type = None
@@ -41,48 +49,201 @@ async def create_request(request: schemas.RequestCreate, background_tasks: Backg
     if not request_type:
         raise HTTPException(status_code=422, detail="Unrecognized request path.")
 
-    db_request = crud.get_request_by_path(db, path=request.path)
+    if request_type == 'URL':
+        # Variants of the same URL, e.g. with tracking parameters, are the same request
+        request = schemas.RequestCreate(path=canonicalize_url(request.path), priority=request.priority)
+
+    db_request = await run_in_session(crud.get_request_by_path, path=request.path)
     if db_request:
-        if db_request.status == models.Statuses.Success:
+        if db_request.status == models.Statuses.Success.name:
             raise HTTPException(status_code=400, detail="Request has already been processed.")
-        elif db_request.status == models.Statuses.Processing:
+        elif db_request.status == models.Statuses.Processing.name:
             raise HTTPException(status_code=400, detail="Request is being processed.")
-    else:
-        db_request = crud.create_request(db=db, request=request)
 
-    if db_request:
+    page = None
+    if request_type == 'URL' and VALIDATE_URL_PROBE:
+        try:
+            page = await probe_url(request.path)
+        except FetchError as e:
+            raise HTTPException(status_code=422, detail=f"Unreachable request path: {e}")
+
+    def submit(db: Session):
+        if not db_request:
+            return schemas.Request.from_orm(crud.create_request(db=db, request=request))
+        existing = crud.get_request(db, req_id=db_request.id)
+        if existing.status == models.Statuses.Error.name:
+            existing = crud.requeue_request(db, existing, priority=request.priority)
+        return schemas.Request.from_orm(existing)
+
+    db_request = await run_in_writer_session(submit)
+
+    if db_request and INGEST_MODE == 'background':
+        # Otherwise, queued requests are processed by the NER worker (app/worker.py)
         if request_type == 'URL':
-            # Scrape web text
-            background_tasks.add_task(get_web_text, db_request.id)
+            # Scrape web text once the scheduler dispatches the request
+            background_tasks.add_task(scheduler.run, [(db_request.id, db_request.path, db_request.priority)],
+                                      {db_request.id: page} if page is not None else None)
         # Otherwise, handle differently
 
     return db_request
 
 
+def _batch_item(item) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Read path of item of batch submission, a path string or a request object.
+
+    :param item: Decoded JSON item.
+    :return: Tuple of (path, None), or (None, error detail) if item is not a path or request object.
+    """
+    if isinstance(item, dict):
+        item = item.get('path')
+    if isinstance(item, str):
+        return item, None
+    return None, "Expected path string or request object with path."
+
+
+def _check_batch_size(items: list) -> None:
+    if len(items) > REQUEST_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {REQUEST_BATCH_MAX_SIZE} requests.")
+
+
+async def _read_batch(http_request: Request) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Read items of batch submission from a JSON array, or from NDJSON lines as they are received.
+
+    :param http_request: HTTP request of batch submission.
+    :return: List of tuples of (path, error detail) of items.
+    """
+    media_type = http_request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if media_type not in NDJSON_MEDIA_TYPES:
+        try:
+            items = json.loads(await http_request.body())
+        except ValueError:
+            raise HTTPException(status_code=422, detail="Malformed JSON body.")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=422, detail="Expected JSON array of paths or request objects.")
+        _check_batch_size(items)
+        return [_batch_item(item) for item in items]
+
+    items, pending = [], b''
+    async for chunk in http_request.stream():
+        *lines, pending = (pending + chunk).split(b'\n')
+        for line in lines:
+            line = line.strip().lstrip(b'\x1e')  # record separator of application/json-seq
+            if not line:
+                continue
+            try:
+                items.append(_batch_item(json.loads(line)))
+            except ValueError:
+                items.append((None, "Malformed JSON line."))
+        _check_batch_size(items)
+    if pending.strip():
+        try:
+            items.append(_batch_item(json.loads(pending)))
+        except ValueError:
+            items.append((None, "Malformed JSON line."))
+        _check_batch_size(items)
+    return items
+
+
+@router.post("/batch", response_model=List[schemas.RequestSubmission], summary='Create requests in bulk')
+@version(1, 0)
+async def create_requests(http_request: Request, background_tasks: BackgroundTasks, priority: int = 0):
+    """
+    Create requests to perform Named Entity Recognition in bulk, e.g. of a crawl frontier.
+    The body is a JSON array, or NDJSON lines (Content-Type application/x-ndjson),
+    of paths or of request objects containing path.
+    New requests are created and failed requests are queued again in one transaction,
+    and queued requests are scheduled as one batch. URL paths are not probed, see VALIDATE_URL_PROBE.
+    - :param priority: priority of created and requeued requests, e.g. below 0 for bulk crawls
+    - :return: list of items in order of the body, with canonical path, request id and status:
+    created, requeued, queued, processing, processed, duplicate (of an earlier item of the batch) or invalid
+    """
+    items = await _read_batch(http_request)
+
+    paths, seen = [], set()
+    for i, (path, detail) in enumerate(items):
+        if detail is None and not check_valid_url(path):
+            detail = "Unrecognized request path."
+        if detail is not None:
+            items[i] = (path, detail)
+            continue
+        # Variants of the same URL, e.g. with tracking parameters, are the same request
+        path = canonicalize_url(path)
+        items[i] = (path, None)
+        if path not in seen:
+            seen.add(path)
+            paths.append(path)
+
+    submitted = await run_in_writer_session(crud.submit_requests, paths, priority=priority) if paths else {}
+
+    results, reported = [], set()
+    for path, detail in items:
+        if detail is not None:
+            results.append(schemas.RequestSubmission(path=path, status='invalid', detail=detail))
+            continue
+        req_id, previous_status = submitted[path]
+        status = 'duplicate' if path in reported else SUBMISSION_STATUSES.get(previous_status, 'queued')
+        reported.add(path)
+        results.append(schemas.RequestSubmission(path=path, status=status, id=req_id))
+
+    queued = [(submitted[path][0], path, priority) for path in paths
+              if submitted[path][1] in (None, models.Statuses.Error.name)]
+    if queued and INGEST_MODE == 'background':
+        # Otherwise, queued requests are processed by the NER worker (app/worker.py)
+        background_tasks.add_task(scheduler.run, queued)
+    logger.info(f"Submitted batch of {len(items)} requests, {len(queued)} queued")
+
+    return results
+
+
 @router.get("/", response_model=List[schemas.Request])
 @version(1, 0)
-def read_requests(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_requests(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None,
+                        summary: bool = False):
     """
-    Gets all requests in database paginated by skip and limit.
+    Gets all requests in database paginated by skip and limit, or by cursor.
 
     - :param skip: number of request objects to skip
     - :param limit: max number of request objects to return
+    - :param cursor: X-Next-Cursor header of previous page, skip is ignored if provided
+    - :param summary: leave out sentences of requests
     - :return: list of requests
     """
-    requests = crud.get_requests(db, skip=skip, limit=limit)
+    if FAST_SERIALIZATION:
+        def read(db: Session):
+            rows = crud.get_request_rows(db, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+            return request_dicts(db, rows, with_sentences=not summary)
+
+        requests = await run_in_session(read)
+        fast_response = FastJSONResponse(requests)
+        set_next_cursor(fast_response, [request['id'] for request in requests], limit)
+        return fast_response
+    requests = await run_in_session(crud.get_requests, skip=skip, limit=limit, with_sentences=not summary,
+                                    after_id=decode_cursor(cursor))
+    set_next_cursor(response, [request.id for request in requests], limit)
     return requests
 
 
 @router.get("/{req_id}", response_model=schemas.Request)
 @version(1, 0)
-def read_request(req_id: int, db: Session = Depends(get_db)):
+async def read_request(req_id: int, summary: bool = False):
     """
     Get request object by id.
 
     - :param req_id: ID of request
+    - :param summary: leave out sentences of request
     - :return: request object
     """
-    db_req = crud.get_request(db, req_id=req_id)
+    if FAST_SERIALIZATION:
+        def read(db: Session):
+            return request_dicts(db, crud.get_request_rows(db, req_id=req_id), with_sentences=not summary)
+
+        requests = await run_in_session(read)
+        if not requests:
+            raise HTTPException(status_code=404, detail="Request not found")
+        return FastJSONResponse(requests[0])
+    db_req = await run_in_session(crud.get_request, req_id=req_id, with_sentences=not summary)
     if db_req is None:
         raise HTTPException(status_code=404, detail="Request not found")
     return db_req
@@ -90,17 +251,29 @@ def read_request(req_id: int, db: Session = Depends(get_db)):
 
 @router.get("/{req_id}/sentences", response_model=List[schemas.Sentence])
 @version(1, 0)
-def read_request_sentences(req_id: int, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_request_sentences(req_id: int, response: Response, skip: int = 0, limit: int = 100,
+                                 cursor: Optional[str] = None):
     """
-    Get all sentences in request of request id paginated by skip and limit.
+    Get all sentences in request of request id paginated by skip and limit, or by cursor.
 
     - :param req_id: ID of request
     - :param skip: number of sentence objects to skip
     - :param limit: max number of sentence objects to return
+    - :param cursor: X-Next-Cursor header of previous page, skip is ignored if provided
     - :return: list of sentences
     """
-    db_req = crud.get_request(db, req_id=req_id)
-    if db_req is None:
-        raise HTTPException(status_code=400, detail="Request does not exist.")
-    db_req_sents = crud.get_request_sentences(db, req_id=req_id, skip=skip, limit=limit)
+    def read(db: Session):
+        if crud.get_request(db, req_id=req_id, with_sentences=False) is None:
+            raise HTTPException(status_code=400, detail="Request does not exist.")
+        if FAST_SERIALIZATION:
+            return sentence_dicts(db, crud.get_request_sentence_rows(db, req_id=req_id, skip=skip, limit=limit,
+                                                                     after_id=decode_cursor(cursor)))
+        return crud.get_request_sentences(db, req_id=req_id, skip=skip, limit=limit, after_id=decode_cursor(cursor))
+
+    db_req_sents = await run_in_session(read)
+    if FAST_SERIALIZATION:
+        fast_response = FastJSONResponse(db_req_sents)
+        set_next_cursor(fast_response, [sent['id'] for sent in db_req_sents], limit)
+        return fast_response
+    set_next_cursor(response, [sent.id for sent in db_req_sents], limit)
     return db_req_sents
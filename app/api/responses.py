@@ -0,0 +1,75 @@
+from collections import defaultdict
+from typing import Dict, List
+
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+from db import crud
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSON response of plain dicts and lists, encoded with orjson if it is installed, with json otherwise.
+    Content is not validated against the response_model of the route, which still documents the response.
+    """
+
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content)
+        return super().render(content)
+
+
+def entity_dicts(rows: List[tuple]) -> List[dict]:
+    """
+    Build Entity objects from rows.
+
+    :param rows: (id, name, ent_type) tuples.
+    :return: List of dicts of Entity schema.
+    """
+    return [{'name': name, 'ent_type': ent_type, 'id': ent_id} for ent_id, name, ent_type in rows]
+
+
+def sentence_dicts(db: Session, rows: List[tuple]) -> List[dict]:
+    """
+    Build Sentence objects from rows, with their entities selected in one query per page.
+
+    :param db: Session object.
+    :param rows: (id, text, req_id) tuples.
+    :return: List of dicts of Sentence schema.
+    """
+    entities = _sentences_entities(db, [row[0] for row in rows])
+    return [{'text': text, 'id': sent_id, 'req_id': req_id, 'entities': entities.get(sent_id, [])}
+            for sent_id, text, req_id in rows]
+
+
+def request_dicts(db: Session, rows: List[tuple], with_sentences: bool) -> List[dict]:
+    """
+    Build Request objects from rows, with their sentences and entities selected in one query each per page.
+
+    :param db: Session object.
+    :param rows: (id, path, status, content_hash, priority) tuples.
+    :param with_sentences: True to add sentences of requests, False to leave them empty.
+    :return: List of dicts of Request schema.
+    """
+    sentences = defaultdict(list)
+    if with_sentences and rows:
+        sentence_rows = crud.get_requests_sentence_rows(db, [row[0] for row in rows])
+        entities = _sentences_entities(db, sorted({row[1] for row in sentence_rows}))
+        for link_req_id, sent_id, text, req_id in sentence_rows:
+            sentences[link_req_id].append({'text': text, 'id': sent_id, 'req_id': req_id,
+                                           'entities': entities.get(sent_id, [])})
+    return [{'path': path, 'id': req_id, 'status': status, 'content_hash': content_hash, 'priority': priority,
+             'sentences': sentences.get(req_id, [])} for req_id, path, status, content_hash, priority in rows]
+
+
+def _sentences_entities(db: Session, sent_ids: List[int]) -> Dict[int, List[dict]]:
+    entities = defaultdict(list)
+    if sent_ids:
+        for sent_id, ent_id, name, ent_type in crud.get_sentences_entity_rows(db, sent_ids):
+            entities[sent_id].append({'name': name, 'ent_type': ent_type, 'id': ent_id})
+    return entities
@@ -0,0 +1,48 @@
+from typing import List
+import logging
+from fastapi import APIRouter, Query
+from fastapi_versioning import version
+
+from db import schemas, crud
+from db.executor import run_in_session
+from api.responses import FastJSONResponse
+from config import SEARCH_MAX_LIMIT, FAST_SERIALIZATION
+
+# get root logger
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.get("/sentences", response_model=List[schemas.SearchSentence])
+@version(1, 0)
+async def search_sentences(q: str = Query(..., min_length=1), skip: int = Query(0, ge=0),
+                           limit: int = Query(20, ge=1, le=SEARCH_MAX_LIMIT)):
+    """
+    Full-text search of extracted sentences, best match first. All words of the query have to match,
+    a word ending with * matches as a prefix, e.g. "obama singap*".
+
+    - :param q: search query
+    - :param skip: number of sentence objects to skip
+    - :param limit: max number of sentence objects to return
+    - :return: list of matching sentences with their relevance score
+    """
+    rows = await run_in_session(crud.search_sentences, query=q, skip=skip, limit=limit)
+    if FAST_SERIALIZATION:
+        return FastJSONResponse([{'text': text, 'id': sent_id, 'req_id': req_id, 'score': float(score)}
+                                 for sent_id, req_id, text, score in rows])
+    return rows
+
+
+@router.get("/entities", response_model=List[schemas.Entity])
+@version(1, 0)
+async def autocomplete_entities(prefix: str = Query(..., min_length=1),
+                                limit: int = Query(10, ge=1, le=SEARCH_MAX_LIMIT)):
+    """
+    Autocomplete entity names by case-insensitive prefix.
+
+    - :param prefix: prefix of entity name
+    - :param limit: max number of entity objects to return
+    - :return: list of entities in alphabetical order
+    """
+    return await run_in_session(crud.get_entities_by_prefix, prefix=prefix, limit=limit)
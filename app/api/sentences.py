@@ -1,10 +1,11 @@
 import logging
-from fastapi import Depends, APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
 from fastapi_versioning import version
 from sqlalchemy.orm import Session
 
-from db.database import SessionLocal, engine
 from db import schemas, crud, models
+from db.executor import run_in_session
+from services.cache_service import response_cache, entity_tag
 
 # get root logger
 logger = logging.getLogger(__name__)
@@ -12,30 +13,29 @@ logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-# Dependency Injection
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 @router.post("")
 @version(1, 0)
-def get_entity_sentences(entity_search: schemas.EntitySearch, skip: int = 0,
-                         limit: int = 100, db: Session = Depends(get_db)):
+async def get_entity_sentences(entity_search: schemas.EntitySearch, request: Request, skip: int = 0,
+                               limit: int = 100):
     """
-    Search for sentences by entity object by name.
+    Search for sentences by entity object by name. Responses are cached until sentences of the entity change,
+    and carry an ETag for conditional requests.
 
     - :param entity_name: ID of selected entity
     - :param skip: number of sentence objects to skip
     - :param limit: max number of sentence objects to return
     - :return: list of sentences
     """
-    db_entity = crud.get_entity_by_name(db, entity_name=entity_search.entity_name.strip())
-    if not db_entity:
-        raise HTTPException(status_code=404, detail=f"Entity {entity_search.entity_name} does not exist")
-    db_entity_sents = crud.get_entity_sentences(db, db_entity=db_entity, skip=skip, limit=limit)
-    print(db_entity_sents)
-    return db_entity_sents
+    def respond(db: Session):
+        db_entity = crud.get_entity_by_name(db, entity_name=entity_search.entity_name.strip())
+        if not db_entity:
+            raise HTTPException(status_code=404, detail=f"Entity {entity_search.entity_name} does not exist")
+
+        def compute(response: Response):
+            db_entity_sents = crud.get_entity_sentences(db, db_entity=db_entity, skip=skip, limit=limit)
+            return [[sent.text] for sent in db_entity_sents]
+
+        return response_cache.respond(request, key=f"sentences:{db_entity.id}:{skip}:{limit}",
+                                      tags=[entity_tag(db_entity.id)], compute=compute)
+
+    return await run_in_session(respond)
@@ -0,0 +1,124 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    """
+    Read boolean setting from environment variable.
+
+    :param name: Name of environment variable.
+    :param default: Value used when variable is unset.
+    :return: Boolean value of setting.
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_int(name: str, default: int) -> int:
+    """
+    Read integer setting from environment variable.
+
+    :param name: Name of environment variable.
+    :param default: Value used when variable is unset.
+    :return: Integer value of setting.
+    """
+    return int(os.getenv(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    """
+    Read float setting from environment variable.
+
+    :param name: Name of environment variable.
+    :param default: Value used when variable is unset.
+    :return: Float value of setting.
+    """
+    return float(os.getenv(name, default))
+
+
+# spaCy pipeline
+NLP_MODEL = os.getenv('NLP_MODEL', 'en_core_web_sm')
+NLP_PROFILE = os.getenv('NLP_PROFILE', 'ner')
+NLP_WARM_ON_STARTUP = _env_bool('NLP_WARM_ON_STARTUP', True)
+
+# NER batching
+NER_BATCH_SIZE = _env_int('NER_BATCH_SIZE', 32)
+NER_N_PROCESS = _env_int('NER_N_PROCESS', 1)
+NER_MAX_WAIT = _env_float('NER_MAX_WAIT', 0.05)
+NER_CHUNK_CHARS = _env_int('NER_CHUNK_CHARS', 100000)
+NER_CHUNK_WINDOW = _env_int('NER_CHUNK_WINDOW', 2)
+
+# Ingest jobs
+INGEST_MODE = os.getenv('INGEST_MODE', 'background')
+WORKER_PROCESSES = _env_int('WORKER_PROCESSES', os.cpu_count() or 1)
+WORKER_POLL_INTERVAL = _env_float('WORKER_POLL_INTERVAL', 1.0)
+JOB_LEASE_SECONDS = _env_int('JOB_LEASE_SECONDS', 600)
+JOB_MAX_ATTEMPTS = _env_int('JOB_MAX_ATTEMPTS', 3)
+
+# Scheduling of ingest jobs
+SCHEDULER_MAX_CONCURRENCY = _env_int('SCHEDULER_MAX_CONCURRENCY', 32)
+SCHEDULER_DOMAIN_RATE = _env_float('SCHEDULER_DOMAIN_RATE', 5.0)
+SCHEDULER_DOMAIN_BURST = _env_int('SCHEDULER_DOMAIN_BURST', 20)
+SCHEDULER_SCAN_LIMIT = _env_int('SCHEDULER_SCAN_LIMIT', 10000)
+
+# Database
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./ner_api.db')
+DB_POOL_SIZE = _env_int('DB_POOL_SIZE', 5)
+DB_MAX_OVERFLOW = _env_int('DB_MAX_OVERFLOW', 10)
+DB_POOL_TIMEOUT = _env_float('DB_POOL_TIMEOUT', 30.0)
+DB_POOL_RECYCLE = _env_int('DB_POOL_RECYCLE', -1)
+DB_POOL_PRE_PING = _env_bool('DB_POOL_PRE_PING', False)
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_CACHE_SIZE = _env_int('SQLITE_CACHE_SIZE', -64000)
+SQLITE_MMAP_SIZE = _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT = _env_int('SQLITE_BUSY_TIMEOUT', 5000)
+SQLITE_SERIALIZE_WRITES = _env_bool('SQLITE_SERIALIZE_WRITES', True)
+
+# Threadpools
+THREADPOOL_SIZE = _env_int('THREADPOOL_SIZE', 0)
+DB_EXECUTOR_THREADS = _env_int('DB_EXECUTOR_THREADS', DB_POOL_SIZE + DB_MAX_OVERFLOW)
+
+# Responses
+FAST_SERIALIZATION = _env_bool('FAST_SERIALIZATION', True)
+
+# Search
+SEARCH_TS_CONFIG = os.getenv('SEARCH_TS_CONFIG', 'english')
+SEARCH_MAX_LIMIT = _env_int('SEARCH_MAX_LIMIT', 100)
+
+# Metrics
+METRICS_DB_EVENTS = _env_bool('METRICS_DB_EVENTS', True)
+
+# Export
+EXPORT_BATCH_SIZE = _env_int('EXPORT_BATCH_SIZE', 10000)
+EXPORT_CHUNK_BYTES = _env_int('EXPORT_CHUNK_BYTES', 256 * 1024)
+EXPORT_GZIP_LEVEL = _env_int('EXPORT_GZIP_LEVEL', 6)
+
+# Caches
+ENTITY_CACHE_SIZE = _env_int('ENTITY_CACHE_SIZE', 100000)
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory')
+RESPONSE_CACHE_TTL = _env_float('RESPONSE_CACHE_TTL', 300.0)
+RESPONSE_CACHE_SIZE = _env_int('RESPONSE_CACHE_SIZE', 10000)
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+# Web fetching
+FETCH_MAX_CONNECTIONS = _env_int('FETCH_MAX_CONNECTIONS', 100)
+FETCH_MAX_PER_HOST = _env_int('FETCH_MAX_PER_HOST', 4)
+FETCH_CONNECT_TIMEOUT = _env_float('FETCH_CONNECT_TIMEOUT', 5.0)
+FETCH_READ_TIMEOUT = _env_float('FETCH_READ_TIMEOUT', 15.0)
+FETCH_TOTAL_TIMEOUT = _env_float('FETCH_TOTAL_TIMEOUT', 60.0)
+FETCH_MAX_BYTES = _env_int('FETCH_MAX_BYTES', 5 * 1024 * 1024)
+FETCH_CONTENT_TYPES = os.getenv('FETCH_CONTENT_TYPES', 'text/html,application/xhtml+xml,text/plain').split(',')
+
+# Text extraction
+HTML_BACKEND = os.getenv('HTML_BACKEND', 'lxml')
+
+# Request validation
+URL_TRACKING_PARAMS = os.getenv('URL_TRACKING_PARAMS', 'utm_*,fbclid,gclid,dclid,msclkid,yclid,mc_cid,mc_eid,igshid,'
+                                                       '_ga,_hsenc,_hsmi,ref_src').split(',')
+VALIDATE_URL_PROBE = _env_bool('VALIDATE_URL_PROBE', False)
+VALIDATE_URL_TIMEOUT = _env_float('VALIDATE_URL_TIMEOUT', 3.0)
+REQUEST_BATCH_MAX_SIZE = _env_int('REQUEST_BATCH_MAX_SIZE', 100000)
+NER_REQUEST_MAX_TEXTS = _env_int('NER_REQUEST_MAX_TEXTS', 100)
+NER_REQUEST_MAX_CHARS = _env_int('NER_REQUEST_MAX_CHARS', 1000000)
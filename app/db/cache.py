@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts least recently used entries and counts hits and misses.
+    """
+
+    def __init__(self, maxsize: int):
+        """
+        :param maxsize: max number of entries kept in cache.
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Get cached value of key.
+
+        :param key: Cache key.
+        :return: Cached value, or None on cache miss.
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """
+        Add or replace cached value of key.
+
+        :param key: Cache key.
+        :param value: Value to cache.
+        """
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[Tuple[Hashable, Any]]) -> None:
+        """
+        Add or replace cached values.
+
+        :param items: Iterable of (key, value) pairs.
+        """
+        with self._lock:
+            for key, value in items:
+                self._data[key] = value
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Remove all entries and reset counters.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get cache counters.
+
+        :return: Dict of size, maxsize, hits and misses.
+        """
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
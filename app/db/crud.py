@@ -1,18 +1,93 @@
-from typing import List
-from sqlalchemy import func
-from sqlalchemy.orm import Session
+import csv
+import io
+import re
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import and_, func, literal, or_, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, noload, selectinload
 
 from . import schemas, models
+from .cache import LRUCache
+from config import ENTITY_CACHE_SIZE, SEARCH_TS_CONFIG
 
+# Max number of bound parameters per IN clause, below SQLite's default limit of 999.
+MAX_IN_PARAMS = 500
 
-def get_request(db: Session, req_id: int):
+# Entity IDs never change once created, so resolved names are cached without invalidation.
+# entity_id_cache maps exact entity names (ingest), entity_norm_cache maps normalized names (search).
+entity_id_cache = LRUCache(ENTITY_CACHE_SIZE)
+entity_norm_cache = LRUCache(ENTITY_CACHE_SIZE)
+
+# Functions called with the set of IDs of entities whose sentence links changed, after commit
+entity_link_listeners: List[Callable[[Set[int]], None]] = []
+
+# Prefix of paths of requests of text processed inline, see nlp_service.store_tagged_text
+TEXT_PATH_PREFIX = 'text:'
+
+# Search query terms: words, with a trailing * for prefix matches
+SEARCH_TERM = re.compile(r'(\w+)(\*?)')
+
+# Whether the sentences_fts table exists, by database URL
+_sentences_fts = {}
+
+
+def add_entity_link_listener(listener: Callable[[Set[int]], None]) -> None:
+    """
+    Register function called with IDs of entities whose sentences were added or removed, e.g. to invalidate caches.
+    :param listener: Function taking a set of entity IDs.
+    """
+    entity_link_listeners.append(listener)
+
+
+def _notify_entity_links(entity_ids: Set[int]) -> None:
+    if entity_ids:
+        for listener in entity_link_listeners:
+            listener(entity_ids)
+
+
+def _paginate(query, id_column, skip: int, limit: int, after_id: Optional[int]):
+    """
+    Paginate query ordered by primary id. Keyset pagination by after_id costs the same on every page,
+    while skip costs O(skip) and is kept for compatibility.
+    :param query: Query to paginate.
+    :param id_column: Primary id column to order by.
+    :param skip: number of objects to skip, ignored if after_id is provided.
+    :param limit: max objects to return.
+    :param after_id: only return objects with id greater than after_id.
+    :return: Paginated query.
+    """
+    query = query.order_by(id_column)
+    if after_id is not None:
+        return query.filter(id_column > after_id).limit(limit)
+    return query.offset(skip).limit(limit)
+
+
+def _request_sentences_loader(with_sentences: bool):
+    """
+    Loader option of sentences of requests. Eager loading fetches sentences and their entities
+    of all requests with one query each, instead of one lazy load per request and per sentence.
+    :param with_sentences: True to eager load sentences and their entities, False to skip loading sentences.
+    :return: Loader option.
+    """
+    if with_sentences:
+        return selectinload(models.Request.sentences).selectinload(models.Sentence.entities)
+    return noload(models.Request.sentences)
+
+
+def get_request(db: Session, req_id: int, with_sentences: Optional[bool] = None):
     """
     Get request object by id.
     :param db: Session object.
     :param req_id: Request ID.
+    :param with_sentences: True to eager load sentences and their entities, False to skip loading sentences,
+    None to load them lazily.
     :return: Request model.
     """
-    return db.query(models.Request).filter(models.Request.id == req_id).first()
+    query = db.query(models.Request)
+    if with_sentences is not None:
+        query = query.options(_request_sentences_loader(with_sentences))
+    return query.filter(models.Request.id == req_id).first()
 
 
 def get_request_by_path(db: Session, path: str):
@@ -25,15 +100,30 @@ def get_request_by_path(db: Session, path: str):
     return db.query(models.Request).filter(models.Request.path == path).first()
 
 
-def get_requests(db: Session, skip: int = 0, limit: int = 100):
+def get_requests(db: Session, skip: int = 0, limit: int = 100, with_sentences: bool = True,
+                 after_id: Optional[int] = None):
     """
-    Get all requests from database paginated by skip and limit.
+    Get all requests from database paginated by skip and limit, or by after_id.
     :param db: Session object.
     :param skip: number of objects to skip.
     :param limit: max objects to return.
+    :param with_sentences: True to eager load sentences and their entities, False to skip loading sentences.
+    :param after_id: only return requests with id greater than after_id.
     :return: List of Request models.
     """
-    return db.query(models.Request).offset(skip).limit(limit).all()
+    query = db.query(models.Request).options(_request_sentences_loader(with_sentences))
+    return _paginate(query, models.Request.id, skip, limit, after_id).all()
+
+
+def count_requests_by_status(db: Session) -> Dict[str, int]:
+    """
+    Count requests of each status, e.g. the depth of the queue.
+    :param db: Session object.
+    :return: Dict of status name to number of requests, including statuses without requests.
+    """
+    counts = {status.name: 0 for status in models.Statuses}
+    counts.update(db.query(models.Request.status, func.count(models.Request.id)).group_by(models.Request.status))
+    return counts
 
 
 def create_request(db: Session, request: schemas.RequestCreate):
@@ -44,13 +134,28 @@ def create_request(db: Session, request: schemas.RequestCreate):
     :return: Created request model.
     """
     status = models.Statuses.Queued.name
-    db_request = models.Request(path=request.path, status=status)
+    db_request = models.Request(path=request.path, status=status, priority=request.priority)
     db.add(db_request)
     db.commit()
     db.refresh(db_request)
     return db_request
 
 
+def add_processed_request(db: Session, path: str, content_hash: str) -> models.Request:
+    """
+    Add request of a document processed inline, e.g. text submitted to the /ner endpoint, in "Success" status
+    so that it is never claimed. The request is flushed but not committed, to be committed with its sentences.
+    :param db: Session object.
+    :param path: path of request.
+    :param content_hash: Fingerprint of document text, see models.text_fingerprint.
+    :return: Added request model.
+    """
+    db_request = models.Request(path=path, status=models.Statuses.Success.name, content_hash=content_hash)
+    db.add(db_request)
+    db.flush()
+    return db_request
+
+
 def update_request_status(db: Session, status: models.Statuses, db_request: models.Request):
     """
     Update status of request.
@@ -66,46 +171,372 @@ def update_request_status(db: Session, status: models.Statuses, db_request: mode
     return db_request
 
 
+def _claimable(statuses: List[models.Statuses]):
+    """
+    Filter for requests that can be claimed for processing, i.e. requests of given statuses
+    or requests being processed whose lease has expired. Requests of text processed inline
+    (paths starting with "text:") have no page to fetch and are never claimed.
+    :param statuses: List of claimable statuses.
+    :return: SQLAlchemy filter expression.
+    """
+    return and_(or_(models.Request.status.in_([status.name for status in statuses]),
+                    and_(models.Request.status == models.Statuses.Processing.name,
+                         or_(models.Request.lease_expires.is_(None),
+                             models.Request.lease_expires < datetime.utcnow()))),
+                ~models.Request.path.like(TEXT_PATH_PREFIX + '%'))
+
+
+def claim_request(db: Session, req_id: int, lease_seconds: int) -> Optional[datetime]:
+    """
+    Atomically claim queued request for processing by setting it to "Processing" with a lease.
+    Requests being processed with an expired lease are claimed again.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param lease_seconds: Seconds before claim expires unless renewed.
+    :return: Expiry of the lease, which identifies the claim in renew_lease and release_request,
+    or None if request was not claimed.
+    """
+    lease = datetime.utcnow() + timedelta(seconds=lease_seconds)
+    claimed = db.query(models.Request).filter(models.Request.id == req_id,
+                                              _claimable([models.Statuses.Queued])).update(
+        {models.Request.status: models.Statuses.Processing.name,
+         models.Request.lease_expires: lease,
+         models.Request.attempts: func.coalesce(models.Request.attempts, 0) + 1},
+        synchronize_session=False)
+    db.commit()
+    return lease if claimed == 1 else None
+
+
+def get_claimable_requests(db: Session, limit: Optional[int] = None,
+                           after: Optional[Tuple[int, int]] = None) -> List[Tuple[int, str, int]]:
+    """
+    Get claimable queued requests in the order they are claimed: by descending priority, then by id.
+    :param db: Session object.
+    :param limit: max requests to return, None for all.
+    :param after: (priority, id) of last request of previous page, to get the next page.
+    :return: List of (id, path, priority) tuples.
+    """
+    query = db.query(models.Request.id, models.Request.path, models.Request.priority).filter(
+        _claimable([models.Statuses.Queued]))
+    if after is not None:
+        priority, req_id = after
+        query = query.filter(or_(models.Request.priority < priority,
+                                 and_(models.Request.priority == priority, models.Request.id > req_id)))
+    return query.order_by(models.Request.priority.desc(), models.Request.id).limit(limit).all()
+
+
+def _leased(req_id: int, lease: datetime):
+    """
+    Filter for request still claimed with lease, i.e. not claimed again by another worker since.
+    :param req_id: ID of request.
+    :param lease: Expiry of the lease of the claim.
+    :return: SQLAlchemy filter expression.
+    """
+    return and_(models.Request.id == req_id, models.Request.status == models.Statuses.Processing.name,
+                models.Request.lease_expires == lease)
+
+
+def renew_lease(db: Session, req_id: int, lease: datetime, lease_seconds: int) -> Optional[datetime]:
+    """
+    Extend lease of request being processed, if the caller still holds it.
+    :param db: Session object.
+    :param req_id: ID of request being processed.
+    :param lease: Expiry of the lease, as returned by claim_request or by the last renewal.
+    :param lease_seconds: Seconds before claim expires unless renewed again.
+    :return: New expiry of the lease, or None if the request was claimed again by another worker.
+    """
+    renewed_lease = datetime.utcnow() + timedelta(seconds=lease_seconds)
+    renewed = db.query(models.Request).filter(_leased(req_id, lease)).update(
+        {models.Request.lease_expires: renewed_lease}, synchronize_session=False)
+    db.commit()
+    return renewed_lease if renewed == 1 else None
+
+
+def release_request(db: Session, req_id: int, lease: datetime, status: models.Statuses) -> bool:
+    """
+    Release claim on request and set its status, if the caller still holds the lease.
+    :param db: Session object.
+    :param req_id: ID of request being processed.
+    :param lease: Expiry of the lease, as returned by claim_request or by the last renewal.
+    :param status: New status.
+    :return: True if request was released, False if it was claimed again by another worker.
+    """
+    released = db.query(models.Request).filter(_leased(req_id, lease)).update(
+        {models.Request.status: status.name, models.Request.lease_expires: None}, synchronize_session=False)
+    db.commit()
+    return released == 1
+
+
+def requeue_request(db: Session, db_request: models.Request, priority: Optional[int] = None) -> models.Request:
+    """
+    Queue request again for processing with a fresh retry budget.
+    :param db: Session object.
+    :param db_request: Request object to requeue.
+    :param priority: New priority of request, None to keep its priority.
+    :return: Updated request object.
+    """
+    db_request.attempts = 0
+    db_request.lease_expires = None
+    if priority is not None:
+        db_request.priority = priority
+    return update_request_status(db, models.Statuses.Queued, db_request)
+
+
+def get_request_statuses_by_paths(db: Session, paths: List[str]) -> Dict[str, Tuple[int, str]]:
+    """
+    Get IDs and statuses of requests by path, in chunks of MAX_IN_PARAMS.
+    :param db: Session object.
+    :param paths: paths of requests.
+    :return: Dict of path to tuple of (request ID, status), for requests that exist.
+    """
+    found = {}
+    for start in range(0, len(paths), MAX_IN_PARAMS):
+        chunk = paths[start:start + MAX_IN_PARAMS]
+        found.update((path, (req_id, status)) for path, req_id, status in db.query(
+            models.Request.path, models.Request.id, models.Request.status).filter(models.Request.path.in_(chunk)))
+    return found
+
+
+def submit_requests(db: Session, paths: List[str], priority: int = 0) -> Dict[str, Tuple[int, Optional[str]]]:
+    """
+    Queue requests of paths in one transaction. Requests that do not exist are created,
+    requests in "Error" status are queued again with a fresh retry budget, other requests are left as they are.
+    :param db: Session object.
+    :param paths: distinct paths of requests.
+    :param priority: priority of created and queued again requests.
+    :return: Dict of path to tuple of (request ID, status before submission, or None if the request was created).
+    """
+    submitted = {path: (req_id, status) for path, (req_id, status) in
+                 get_request_statuses_by_paths(db, paths).items()}
+    new_paths = [path for path in paths if path not in submitted]
+    if new_paths:
+        # Requests created concurrently by another submission are skipped here and reported as existing below
+        db.execute(_insert_ignore(db, models.Request.__table__),
+                   [{'path': path, 'status': models.Statuses.Queued.name, 'attempts': 0, 'priority': priority}
+                    for path in new_paths])
+    for path, (req_id, status) in get_request_statuses_by_paths(db, new_paths).items():
+        submitted[path] = (req_id, None if status == models.Statuses.Queued.name else status)
+
+    error_ids = [req_id for req_id, status in submitted.values() if status == models.Statuses.Error.name]
+    for start in range(0, len(error_ids), MAX_IN_PARAMS):
+        db.query(models.Request).filter(
+            models.Request.id.in_(error_ids[start:start + MAX_IN_PARAMS]),
+            models.Request.status == models.Statuses.Error.name,
+        ).update({models.Request.status: models.Statuses.Queued.name, models.Request.attempts: 0,
+                  models.Request.lease_expires: None, models.Request.priority: priority}, synchronize_session=False)
+    db.commit()
+    return submitted
+
+
+def delete_request_sentences(db: Session, req_id: int) -> int:
+    """
+    Unlink sentences of request, e.g. left over by an interrupted attempt. Sentences no longer linked
+    to any request are deleted with their entity associations.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :return: Number of unlinked sentences.
+    """
+    links = models.request_sentences_table
+    sent_ids = [sent_id for sent_id, in db.query(links.c.sent_id).filter(links.c.req_id == req_id)]
+    if not sent_ids:
+        return 0
+    db.execute(links.delete().where(links.c.req_id == req_id))
+
+    entity_ids = set()
+    for start in range(0, len(sent_ids), MAX_IN_PARAMS):
+        chunk = sent_ids[start:start + MAX_IN_PARAMS]
+        still_linked = db.query(links.c.sent_id).filter(links.c.sent_id == models.Sentence.id)
+        orphans = [sent_id for sent_id, in db.query(models.Sentence.id).filter(
+            models.Sentence.id.in_(chunk), ~still_linked.exists())]
+        if not orphans:
+            continue
+        orphan_links = models.association_table.c.sent_id.in_(orphans)
+        entity_ids.update(ent_id for ent_id, in db.query(models.association_table.c.ent_id).filter(
+            orphan_links).distinct())
+        db.execute(models.association_table.delete().where(orphan_links))
+        db.query(models.Sentence).filter(models.Sentence.id.in_(orphans)).delete(synchronize_session=False)
+    db.commit()
+    _notify_entity_links(entity_ids)
+    return len(sent_ids)
+
+
+def _link_sentence(db: Session, req_id: int, text: str) -> models.Sentence:
+    """
+    Get sentence of text, or add it, and link it to request with req_id.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param text: Sentence text.
+    :return: Sentence model.
+    """
+    db_sent = db.query(models.Sentence).filter(models.Sentence.text_hash == models.text_fingerprint(text)).first()
+    if db_sent is None:
+        db_sent = models.Sentence(req_id=req_id, text=text)
+        db.add(db_sent)
+        db.flush()
+    db.execute(_insert_ignore(db, models.request_sentences_table), {'req_id': req_id, 'sent_id': db_sent.id})
+    return db_sent
+
+
 def create_sentences(db: Session, req_id: int, sentences: List[schemas.SentenceCreate]):
     """
-    Bulk add sentences of request with req_id to database.
+    Bulk add sentences of request with req_id to database, without entities, with create_tagged_sentences.
+    Sentences already stored are linked to the request.
     :param db: Session object.
     :param req_id: ID of request.
     :param sentences: List of sentences to add.
     :return: Number of sentences tagged to request.
     """
-    for sent in sentences:
-        db_sent = models.Sentence(req_id=req_id, text=sent.text)
-        db.add(db_sent)
-    db.commit()
-    return db.query(models.Sentence).filter(models.Request.id == req_id).count()
+    create_tagged_sentences(db, req_id=req_id, sentences=[schemas.TaggedSentence(text=sent.text, entities=[])
+                                                          for sent in sentences])
+    return db.query(models.request_sentences_table).filter(models.request_sentences_table.c.req_id == req_id).count()
 
 
 def create_sentence(db: Session, req_id: int, sentence: str):
     """
-    Add sentence of request with req_id to database.
+    Add sentence of request with req_id to database. A sentence already stored is linked to the request.
     :param db: Session object.
     :param req_id: ID of request.
     :param sentence: Sentence object to add.
     :return: Created sentence model.
     """
-    db_sent = models.Sentence(req_id=req_id, text=sentence)
-    db.add(db_sent)
+    db_sent = _link_sentence(db, req_id, sentence)
     db.commit()
     db.refresh(db_sent)
     return db_sent
 
 
-def get_request_sentences(db: Session, req_id: int, skip: int = 0, limit: int = 100):
+def link_request_sentences(db: Session, req_id: int, source_req_id: int) -> int:
+    """
+    Link request to sentences of another request of the same content, instead of tagging its document again.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param source_req_id: ID of request of the same content.
+    :return: Number of sentences linked to request.
+    """
+    links = models.request_sentences_table
+    sent_ids = [sent_id for sent_id, in db.query(links.c.sent_id).filter(links.c.req_id == source_req_id)]
+    if sent_ids:
+        db.execute(_insert_ignore(db, links), [{'req_id': req_id, 'sent_id': sent_id} for sent_id in sent_ids])
+    db.commit()
+    return len(sent_ids)
+
+
+def get_request_by_content_hash(db: Session, content_hash: str, exclude_id: Optional[int] = None):
+    """
+    Get oldest successfully processed request whose document has content hash.
+    :param db: Session object.
+    :param content_hash: Fingerprint of document text, see models.text_fingerprint.
+    :param exclude_id: ID of request to leave out, e.g. the request being processed.
+    :return: Request object, or None.
+    """
+    query = db.query(models.Request).options(noload(models.Request.sentences)).filter(
+        models.Request.content_hash == content_hash, models.Request.status == models.Statuses.Success.name)
+    if exclude_id is not None:
+        query = query.filter(models.Request.id != exclude_id)
+    return query.order_by(models.Request.id).first()
+
+
+def set_request_content_hash(db: Session, db_request: models.Request, content_hash: str) -> models.Request:
     """
-    Get sentences of request with req_id paginated by skip and limit.
+    Store fingerprint of document text of request.
+    :param db: Session object.
+    :param db_request: Request object.
+    :param content_hash: Fingerprint of document text, see models.text_fingerprint.
+    :return: Updated request object.
+    """
+    db_request.content_hash = content_hash
+    db.commit()
+    return db_request
+
+
+def get_request_sentences(db: Session, req_id: int, skip: int = 0, limit: int = 100,
+                          after_id: Optional[int] = None):
+    """
+    Get sentences of request with req_id paginated by skip and limit, or by after_id.
     :param db: Session object.
     :param req_id: ID of request.
     :param skip: number of objects to skip.
     :param limit: max objects to return.
+    :param after_id: only return sentences with id greater than after_id.
     :return: List of Sentence models.
     """
-    return db.query(models.Sentence).filter(models.Sentence.req_id == req_id).offset(skip).limit(limit).all()
+    # Filtering and ordering on the link table walks its (req_id, sent_id) primary key
+    links = models.request_sentences_table
+    query = db.query(models.Sentence).options(selectinload(models.Sentence.entities)).select_from(links).join(
+        models.Sentence, models.Sentence.id == links.c.sent_id).filter(links.c.req_id == req_id)
+    return _paginate(query, links.c.sent_id, skip, limit, after_id).all()
+
+
+def get_request_rows(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None,
+                     req_id: Optional[int] = None) -> List[tuple]:
+    """
+    Get columns of requests paginated by skip and limit, or by after_id, without loading request models.
+    :param db: Session object.
+    :param skip: number of objects to skip.
+    :param limit: max objects to return.
+    :param after_id: only return requests with id greater than after_id.
+    :param req_id: only return the request with req_id.
+    :return: List of (id, path, status, content_hash, priority) tuples in order of id.
+    """
+    query = db.query(models.Request.id, models.Request.path, models.Request.status, models.Request.content_hash,
+                     models.Request.priority)
+    if req_id is not None:
+        query = query.filter(models.Request.id == req_id)
+    return _paginate(query, models.Request.id, skip, limit, after_id).all()
+
+
+def get_requests_sentence_rows(db: Session, req_ids: List[int]) -> List[tuple]:
+    """
+    Get columns of all sentences of requests, without loading sentence models.
+    :param db: Session object.
+    :param req_ids: IDs of requests.
+    :return: List of (link req_id, id, text, req_id) tuples in order of link req_id and sentence id,
+    where req_id is the request the sentence was first extracted from.
+    """
+    links = models.request_sentences_table
+    sentence = models.Sentence.__table__
+    rows = []
+    for i in range(0, len(req_ids), MAX_IN_PARAMS):
+        rows.extend(db.query(links.c.req_id, sentence.c.id, sentence.c.text, sentence.c.req_id).select_from(
+            links).join(sentence, sentence.c.id == links.c.sent_id).filter(
+            links.c.req_id.in_(req_ids[i:i + MAX_IN_PARAMS])).order_by(links.c.req_id, links.c.sent_id).all())
+    return rows
+
+
+def get_request_sentence_rows(db: Session, req_id: int, skip: int = 0, limit: int = 100,
+                              after_id: Optional[int] = None) -> List[tuple]:
+    """
+    Get columns of sentences of request with req_id paginated by skip and limit, or by after_id,
+    without loading sentence models.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param skip: number of objects to skip.
+    :param limit: max objects to return.
+    :param after_id: only return sentences with id greater than after_id.
+    :return: List of (id, text, req_id) tuples in order of id.
+    """
+    links = models.request_sentences_table
+    sentence = models.Sentence.__table__
+    query = db.query(sentence.c.id, sentence.c.text, sentence.c.req_id).select_from(links).join(
+        sentence, sentence.c.id == links.c.sent_id).filter(links.c.req_id == req_id)
+    return _paginate(query, links.c.sent_id, skip, limit, after_id).all()
+
+
+def get_sentences_entity_rows(db: Session, sent_ids: List[int]) -> List[tuple]:
+    """
+    Get columns of entities of sentences, without loading entity models.
+    :param db: Session object.
+    :param sent_ids: IDs of sentences.
+    :return: List of (sent_id, id, name, ent_type) tuples in order of sentence and entity id.
+    """
+    links = models.association_table
+    entity = models.Entity.__table__
+    rows = []
+    for i in range(0, len(sent_ids), MAX_IN_PARAMS):
+        rows.extend(db.query(links.c.sent_id, entity.c.id, entity.c.name, entity.c.ent_type).select_from(
+            links).join(entity, entity.c.id == links.c.ent_id).filter(
+            links.c.sent_id.in_(sent_ids[i:i + MAX_IN_PARAMS])).order_by(links.c.sent_id, links.c.ent_id).all())
+    return rows
 
 
 def get_sentence(db: Session, sent_id: int):
@@ -130,6 +561,7 @@ def create_entities(db: Session, db_sent: models.Sentence, entities: List[schema
     :return: Count of created entities.
     """
     ctr = 0
+    linked = []
     for entity in entities:
 
         db_entity = db.query(models.Entity).filter(models.Entity.name == entity.name).first()
@@ -141,21 +573,218 @@ def create_entities(db: Session, db_sent: models.Sentence, entities: List[schema
 
         db_entity.sentences.append(db_sent)
         db.add(db_entity)
+        linked.append(db_entity)
 
         ctr += 1
+    db.flush()
+    entity_ids = {db_entity.id for db_entity in linked}
     db.commit()
+    _notify_entity_links(entity_ids)
     return ctr
 
 
-def get_entities(db: Session, skip: int = 0, limit: int = 100):
+def _query_entity_ids(db: Session, names: List[str]) -> Dict[str, int]:
+    """
+    Resolve entity names to IDs with set-based lookups in database.
+    :param db: Session object.
+    :param names: Entity names to look for.
+    :return: Dict of entity name to ID for names that exist in database.
+    """
+    entity_ids = {}
+    for i in range(0, len(names), MAX_IN_PARAMS):
+        entity_ids.update(db.query(models.Entity.name, models.Entity.id).filter(
+            models.Entity.name.in_(names[i:i + MAX_IN_PARAMS])))
+    return entity_ids
+
+
+def get_entity_ids(db: Session, names: Iterable[str]) -> Dict[str, int]:
+    """
+    Resolve entity names to IDs, looking up names missing from entity_id_cache in database.
+    :param db: Session object.
+    :param names: Entity names to look for.
+    :return: Dict of entity name to ID for names that exist in database.
+    """
+    entity_ids = {}
+    missing = []
+    for name in names:
+        ent_id = entity_id_cache.get(name)
+        if ent_id is None:
+            missing.append(name)
+        else:
+            entity_ids[name] = ent_id
+    if missing:
+        found = _query_entity_ids(db, missing)
+        entity_id_cache.put_many(found.items())
+        entity_ids.update(found)
+    return entity_ids
+
+
+def _insert_ignore(db: Session, table):
+    """
+    Insert statement that skips rows violating unique constraints, e.g. entities inserted concurrently.
+    :param db: Session object.
+    :param table: Table to insert into.
+    :return: Insert statement.
+    """
+    if db.bind.dialect.name == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if db.bind.dialect.name == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return table.insert()
+
+
+def _copy_rows(db: Session, table, columns: List[str], rows: List[tuple]) -> None:
+    """
+    Bulk load rows into PostgreSQL table with COPY, within the transaction of the session.
+    Rows are copied into a temporary staging table first, so rows violating unique constraints are skipped.
+    :param db: Session object bound to a psycopg2 engine.
+    :param table: Table to load into.
+    :param columns: Names of columns of rows.
+    :param rows: List of tuples of str and int values.
+    """
+    stage = f'stage_{table.name}'
+    column_list = ', '.join(columns)
+    db.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {stage} (LIKE {table.name}) ON COMMIT DELETE ROWS')
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {stage} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+    db.execute(f'INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {stage} ON CONFLICT DO NOTHING')
+    db.execute(f'TRUNCATE {stage}')
+
+
+def _insert_ignore_rows(db: Session, table, rows: List[dict]) -> None:
+    """
+    Bulk insert rows, skipping rows violating unique constraints. Uses COPY on PostgreSQL.
+    :param db: Session object.
+    :param table: Table to insert into.
+    :param rows: List of dicts of column values, with the same keys.
+    """
+    if not rows:
+        return
+    if db.bind.dialect.driver == 'psycopg2':
+        columns = list(rows[0])
+        _copy_rows(db, table, columns, [tuple(row[column] for column in columns) for row in rows])
+    else:
+        db.execute(_insert_ignore(db, table), rows)
+
+
+def _query_sentence_ids(db: Session, text_hashes: List[str]) -> Dict[str, int]:
+    """
+    Query IDs of sentences by text fingerprint, in chunks of MAX_IN_PARAMS.
+    :param db: Session object.
+    :param text_hashes: Fingerprints of sentence texts.
+    :return: Dict of fingerprint to sentence ID, for sentences that exist.
+    """
+    sent_ids = {}
+    for start in range(0, len(text_hashes), MAX_IN_PARAMS):
+        chunk = text_hashes[start:start + MAX_IN_PARAMS]
+        sent_ids.update(db.query(models.Sentence.text_hash, models.Sentence.id).filter(
+            models.Sentence.text_hash.in_(chunk)))
+    return sent_ids
+
+
+def _insert_sentences(db: Session, req_id: int, sentences: Dict[str, schemas.TaggedSentence]) -> Dict[str, int]:
+    """
+    Insert sentences of request, skipping sentences inserted concurrently by another request.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param sentences: Dict of text fingerprint to tagged sentence to add.
+    :return: Dict of text fingerprint to sentence ID.
+    """
+    rows = [{'req_id': req_id, 'text': sent.text, 'start_char': sent.start_char, 'text_hash': text_hash}
+            for text_hash, sent in sentences.items()]
+    if db.bind.dialect.driver == 'psycopg2':
+        # Reserve IDs from the sequence so sentences can be loaded with COPY
+        reserved = db.execute(
+            text("SELECT nextval(pg_get_serial_sequence('sentences', 'id')) FROM generate_series(1, :n)"),
+            {'n': len(rows)})
+        for row, (sent_id,) in zip(rows, reserved):
+            row['id'] = sent_id
+    _insert_ignore_rows(db, models.Sentence.__table__, rows)
+    return _query_sentence_ids(db, list(sentences))
+
+
+def create_tagged_sentences(db: Session, req_id: int, sentences: List[schemas.TaggedSentence]) -> int:
     """
-    Get all entities in database paginated by skip and limit.
+    Bulk add tagged sentences of request, their new entities and associations in a single transaction.
+    Sentences already stored, e.g. by requests of mirrored or republished pages, are only linked to the request.
+    Sentences and entity names are resolved with set-based lookups and rows are written with executemany inserts,
+    or COPY on PostgreSQL, so cost depends on the number of sentences rather than the size of the database.
+    :param db: Session object.
+    :param req_id: ID of request.
+    :param sentences: List of tagged sentences to add.
+    :return: Number of distinct sentences linked to request.
+    """
+    if not sentences:
+        return 0
+
+    by_hash = {}
+    for sent in sentences:
+        by_hash.setdefault(models.text_fingerprint(sent.text), sent)
+    sent_ids = _query_sentence_ids(db, list(by_hash))
+    new_sentences = {text_hash: sent for text_hash, sent in by_hash.items() if text_hash not in sent_ids}
+
+    entity_types = {}
+    for sent in new_sentences.values():
+        for entity in sent.entities:
+            entity_types.setdefault(entity.name, entity.ent_type)
+
+    entity_ids = get_entity_ids(db, entity_types)
+    new_entities = [{'name': name, 'ent_type': ent_type} for name, ent_type in entity_types.items()
+                    if name not in entity_ids]
+    new_entity_ids = {}
+    if new_entities:
+        db.execute(_insert_ignore(db, models.Entity.__table__), new_entities)
+        new_entity_ids = _query_entity_ids(db, [entity['name'] for entity in new_entities])
+        entity_ids.update(new_entity_ids)
+
+    associations = []
+    if new_sentences:
+        new_sent_ids = _insert_sentences(db, req_id, new_sentences)
+        sent_ids.update(new_sent_ids)
+        for text_hash, sent in new_sentences.items():
+            for ent_id in {entity_ids[entity.name] for entity in sent.entities}:
+                associations.append({'sent_id': new_sent_ids[text_hash], 'ent_id': ent_id})
+        _insert_ignore_rows(db, models.association_table, associations)
+
+    _insert_ignore_rows(db, models.request_sentences_table,
+                        [{'req_id': req_id, 'sent_id': sent_id} for sent_id in sent_ids.values()])
+
+    db.commit()
+    # Only cache IDs of new entities once they are committed
+    entity_id_cache.put_many(new_entity_ids.items())
+    _notify_entity_links({row['ent_id'] for row in associations})
+    return len(sent_ids)
+
+
+def get_entities(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None):
+    """
+    Get all entities in database paginated by skip and limit, or by after_id.
     :param db: Session object.
     :param skip: number of objects to skip.
     :param limit: max objects to return.
+    :param after_id: only return entities with id greater than after_id.
     :return: List of entity models.
     """
-    return db.query(models.Entity).offset(skip).limit(limit).all()
+    return _paginate(db.query(models.Entity), models.Entity.id, skip, limit, after_id).all()
+
+
+def get_entity_rows(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None) -> List[tuple]:
+    """
+    Get columns of entities paginated by skip and limit, or by after_id, without loading entity models.
+    :param db: Session object.
+    :param skip: number of objects to skip.
+    :param limit: max objects to return.
+    :param after_id: only return entities with id greater than after_id.
+    :return: List of (id, name, ent_type) tuples in order of id.
+    """
+    query = db.query(models.Entity.id, models.Entity.name, models.Entity.ent_type)
+    return _paginate(query, models.Entity.id, skip, limit, after_id).all()
 
 
 def get_entity(db: Session, entity_id: int):
@@ -170,27 +799,172 @@ def get_entity(db: Session, entity_id: int):
 
 def get_entity_by_name(db: Session, entity_name: str):
     """
-    Get entity by name.
+    Get entity by case-insensitive name.
     :param db: Session object.
     :param entity_name: Name of entity to look for.
     :return: Entity object.
     """
-    # db.query(models.Entity).filter(models.Entity.name.ilike(f'%{entity_name}%')).first()
-    return db.query(models.Entity).filter(func.lower(models.Entity.name) == func.lower(entity_name)).first()
+    name_norm = models.normalize_entity_name(entity_name)
+    ent_id = entity_norm_cache.get(name_norm)
+    if ent_id is not None:
+        return get_entity(db, entity_id=ent_id)
+
+    db_entity = db.query(models.Entity).filter(models.Entity.name_norm == name_norm).order_by(
+        models.Entity.id).first()
+    if db_entity:
+        entity_norm_cache.put(name_norm, db_entity.id)
+    return db_entity
 
 
-def get_entity_sentences(db: Session, db_entity: models.Entity, skip: int = 0, limit: int = 100):
+def get_entity_sentences(db: Session, db_entity: models.Entity, skip: int = 0, limit: int = 100,
+                         after_id: Optional[int] = None):
     """
-    Get sentences associated with entity object paginated by skip and limit.
+    Get sentences associated with entity object paginated by skip and limit, or by after_id.
     :param db: Session object.
     :param db_entity: Entity object.
     :param skip: number of objects to skip.
     :param limit: max objects to return.
-    :return: List of sentences associated to entity.
+    :param after_id: only return sentences with id greater than after_id.
+    :return: List of (id, text) rows of sentences associated to entity.
+    """
+    # Filtering and ordering on the association table walks its (ent_id, sent_id) primary key
+    sent_id = models.association_table.c.sent_id
+    query = db.query(sent_id.label('id'), models.Sentence.text).select_from(models.association_table).join(
+        models.Sentence, models.Sentence.id == sent_id).filter(models.association_table.c.ent_id == db_entity.id)
+    return _paginate(query, sent_id, skip, limit, after_id).all()
+
+
+def parse_search_query(query: str) -> List[Tuple[str, bool]]:
+    """
+    Parse full-text search query into terms that all have to match. Other characters are ignored,
+    so queries cannot inject FTS5 or tsquery syntax.
+    :param query: Search query, e.g. "obama singap*".
+    :return: List of (lowercase term, True if term is a prefix).
+    """
+    return [(term.lower(), bool(star)) for term, star in SEARCH_TERM.findall(query)]
+
+
+def _has_sentences_fts(db: Session) -> bool:
+    key = str(db.bind.url)
+    if key not in _sentences_fts:
+        _sentences_fts[key] = db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentences_fts'").first() is not None
+    return _sentences_fts[key]
+
+
+def search_sentences(db: Session, query: str, skip: int = 0, limit: int = 20):
+    """
+    Full-text search of sentences, ranked by relevance: bm25 of the FTS5 index on SQLite,
+    ts_rank of the tsvector index on PostgreSQL. Falls back to LIKE queries in order of id otherwise.
+    :param db: Session object.
+    :param query: Search query, see parse_search_query.
+    :param skip: number of objects to skip.
+    :param limit: max objects to return.
+    :return: List of (id, req_id, text, score) rows of matching sentences, best match first.
+    """
+    terms = parse_search_query(query)
+    if not terms:
+        return []
+    params = {'skip': skip, 'limit': limit}
+
+    if db.bind.dialect.name == 'postgresql':
+        params['tsquery'] = ' & '.join(term + (':*' if prefix else '') for term, prefix in terms)
+        return db.execute(text(
+            f"SELECT id, req_id, text, ts_rank(to_tsvector('{SEARCH_TS_CONFIG}', text), query) AS score "
+            f"FROM sentences, to_tsquery('{SEARCH_TS_CONFIG}', :tsquery) AS query "
+            f"WHERE to_tsvector('{SEARCH_TS_CONFIG}', text) @@ query "
+            f"ORDER BY score DESC, id LIMIT :limit OFFSET :skip"), params).fetchall()
+
+    if db.bind.dialect.name == 'sqlite' and _has_sentences_fts(db):
+        params['match'] = ' '.join(f'"{term}"' + ('*' if prefix else '') for term, prefix in terms)
+        # Rank in the FTS5 table before joining, so that only one page of sentences is read.
+        # bm25 is lower for better matches, it is negated into a score.
+        return db.execute(text(
+            "SELECT s.id, s.req_id, s.text, -f.rank AS score "
+            "FROM (SELECT rowid, rank FROM sentences_fts WHERE sentences_fts MATCH :match "
+            "ORDER BY rank LIMIT :limit OFFSET :skip) AS f "
+            "JOIN sentences AS s ON s.id = f.rowid ORDER BY f.rank"), params).fetchall()
+
+    sentence = models.Sentence.__table__
+    return db.query(sentence.c.id, sentence.c.req_id, sentence.c.text, literal(0.0).label('score')).filter(
+        *[func.lower(sentence.c.text).like(f"%{term}%") for term, _ in terms]).order_by(
+        sentence.c.id).offset(skip).limit(limit).all()
+
+
+def get_entities_by_prefix(db: Session, prefix: str, limit: int = 10):
+    """
+    Autocomplete entity names, matching case-insensitive prefix with a range scan of the name_norm index.
+    :param db: Session object.
+    :param prefix: Prefix of entity name.
+    :param limit: max objects to return.
+    :return: List of entity objects in order of normalized name.
+    """
+    prefix_norm = models.normalize_entity_name(prefix)
+    if not prefix_norm:
+        return []
+    name_norm = models.Entity.name_norm
+    if db.bind.dialect.name == 'postgresql':
+        # Uses the text_pattern_ops index, ranges of the default index follow the collation
+        escaped = prefix_norm.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condition = name_norm.like(escaped + '%')
+    else:
+        condition = and_(name_norm >= prefix_norm, name_norm < prefix_norm[:-1] + chr(ord(prefix_norm[-1]) + 1))
+    return db.query(models.Entity).filter(condition).order_by(name_norm, models.Entity.id).limit(limit).all()
+
+
+def _iter_rows(query, id_column, after_id: Optional[int], batch_size: int) -> Iterator[tuple]:
+    """
+    Iterate over rows of query in order of id_column, fetching batch_size rows at a time.
+    Rows are streamed from a server-side cursor on PostgreSQL, so memory does not grow with the table.
+    :param query: Query of columns.
+    :param id_column: Column to order by.
+    :param after_id: only return rows with id_column greater than after_id, e.g. to resume an export.
+    :param batch_size: number of rows fetched at a time.
+    :return: Iterator of row tuples.
+    """
+    if after_id is not None:
+        query = query.filter(id_column > after_id)
+    return query.order_by(id_column).yield_per(batch_size)
+
+
+def iter_entities(db: Session, after_id: Optional[int] = None, batch_size: int = 10000) -> Iterator[tuple]:
+    """
+    Iterate over all entities, without loading entity models.
+    :param db: Session object.
+    :param after_id: only return entities with id greater than after_id.
+    :param batch_size: number of rows fetched at a time.
+    :return: Iterator of (id, name, ent_type) tuples in order of id.
+    """
+    return _iter_rows(db.query(models.Entity.id, models.Entity.name, models.Entity.ent_type),
+                      models.Entity.id, after_id, batch_size)
+
+
+def iter_sentences(db: Session, after_id: Optional[int] = None, batch_size: int = 10000) -> Iterator[tuple]:
+    """
+    Iterate over all sentences, without loading sentence models.
+    :param db: Session object.
+    :param after_id: only return sentences with id greater than after_id.
+    :param batch_size: number of rows fetched at a time.
+    :return: Iterator of (id, text, req_id) tuples in order of id.
+    """
+    return _iter_rows(db.query(models.Sentence.id, models.Sentence.text, models.Sentence.req_id),
+                      models.Sentence.id, after_id, batch_size)
+
+
+def iter_entity_sentence_links(db: Session, after_id: Optional[int] = None,
+                               batch_size: int = 10000) -> Iterator[tuple]:
+    """
+    Iterate over all links of entities to sentences, in order of the (ent_id, sent_id) primary key.
+    :param db: Session object.
+    :param after_id: only return links of entities with id greater than after_id.
+    :param batch_size: number of rows fetched at a time.
+    :return: Iterator of (ent_id, sent_id) tuples.
     """
-    return db.query(models.Sentence.text).filter((models.Sentence.id == models.association_table.c.sent_id) &
-                                                 (models.association_table.c.ent_id == db_entity.id)).offset(
-        skip).limit(limit).all()
+    links = models.association_table
+    query = db.query(links.c.ent_id, links.c.sent_id)
+    if after_id is not None:
+        query = query.filter(links.c.ent_id > after_id)
+    return query.order_by(links.c.ent_id, links.c.sent_id).yield_per(batch_size)
 
 
 def update_requests_status(db: Session, original_statuses: List[models.Statuses], new_status: models.Statuses):
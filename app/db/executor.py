@@ -0,0 +1,75 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from sqlalchemy.orm import sessionmaker
+
+from .database import SessionLocal, WriterSessionLocal, engine, writer_engine
+from config import DB_EXECUTOR_THREADS
+
+
+class DBExecutor:
+    """
+    Bounded thread pool running the database work of async route handlers, so that blocking SQLAlchemy calls
+    never run on the event loop, and do not compete with other blocking work for the Starlette threadpool.
+    With as many threads as pooled connections, database calls never wait for a connection while holding a thread.
+    """
+
+    def __init__(self, max_workers: int = DB_EXECUTOR_THREADS, session_factory: sessionmaker = SessionLocal,
+                 thread_name_prefix: str = 'db'):
+        """
+        :param max_workers: number of threads, i.e. max number of concurrent database calls.
+        :param session_factory: factory of sessions of database calls.
+        :param thread_name_prefix: prefix of thread names.
+        """
+        self.max_workers = max_workers
+        self.session_factory = session_factory
+        self.thread_name_prefix = thread_name_prefix
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created on first use, so that processes forked before that do not share it
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.thread_name_prefix)
+            return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Run fn(db, *args, **kwargs) with a new session in the executor, and close the session afterwards.
+        fn should return values that do not lazy load attributes once the session is closed,
+        e.g. schemas, or models whose relationships are eager loaded.
+
+        :param fn: Function taking a Session object as first argument.
+        :return: Return value of fn.
+        """
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._get_executor(),
+                                          functools.partial(self._call_with_session, fn, args, kwargs))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+    def _call_with_session(self, fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        db = self.session_factory()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+
+
+db_executor = DBExecutor()
+run_in_session = db_executor.run
+# Writes of async route handlers, e.g. request submissions. With serialized SQLite writes, the single writer
+# connection is shared with ingest jobs, so one thread is enough and writers queue instead of hitting the lock.
+writer_db_executor = DBExecutor(max_workers=1 if writer_engine is not engine else DB_EXECUTOR_THREADS,
+                                session_factory=WriterSessionLocal, thread_name_prefix='db-writer')
+run_in_writer_session = writer_db_executor.run
@@ -0,0 +1,238 @@
+import logging
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+from .models import association_table, normalize_entity_name, text_fingerprint
+from config import SEARCH_TS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Columns added to existing tables after their first release, as (table, column, DDL type and default).
+ADDED_COLUMNS = [
+    ('requests', 'attempts', 'INTEGER NOT NULL DEFAULT 0'),
+    ('requests', 'lease_expires', 'TIMESTAMP'),
+    ('entities', 'name_norm', 'VARCHAR'),
+    ('sentences', 'start_char', 'INTEGER'),
+    ('requests', 'content_hash', 'VARCHAR'),
+    ('sentences', 'text_hash', 'VARCHAR'),
+    ('requests', 'priority', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Indexes of added columns, as (index name, table, columns, unique).
+ADDED_INDEXES = [
+    ('ix_entities_name_norm', 'entities', 'name_norm', False),
+    ('ix_requests_content_hash', 'requests', 'content_hash', False),
+    ('ix_sentences_text_hash', 'sentences', 'text_hash', True),
+    ('ix_requests_status_priority', 'requests', 'status, priority, id', False),
+]
+
+
+def _add_missing_columns(engine: Engine) -> int:
+    """
+    Add columns of ADDED_COLUMNS that are missing from existing tables.
+
+    :param engine: Database engine.
+    :return: Number of columns added.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    added = 0
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table not in existing_tables:
+                continue
+            if column in {col['name'] for col in inspector.get_columns(table)}:
+                continue
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}')
+            logger.info(f"Added column {table}.{column}")
+            added += 1
+    return added
+
+
+def _add_missing_indexes(engine: Engine) -> None:
+    """
+    Create indexes of ADDED_INDEXES that are missing.
+
+    :param engine: Database engine.
+    """
+    with engine.begin() as conn:
+        for index, table, columns, unique in ADDED_INDEXES:
+            conn.execute(f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS {index} ON {table} ({columns})')
+
+
+def _backfill_entity_name_norm(engine: Engine) -> int:
+    """
+    Fill normalized names of entities created before the name_norm column existed.
+
+    :param engine: Database engine.
+    :return: Number of updated entities.
+    """
+    with engine.begin() as conn:
+        rows = conn.execute('SELECT id, name FROM entities WHERE name_norm IS NULL').fetchall()
+        if rows:
+            conn.execute(text('UPDATE entities SET name_norm = :name_norm WHERE id = :id'),
+                         [{'id': ent_id, 'name_norm': normalize_entity_name(name)} for ent_id, name in rows])
+            logger.info(f"Backfilled normalized names of {len(rows)} entities")
+    return len(rows)
+
+
+def _insert_ignore_sql(engine: Engine, table: str, columns: str, select: str) -> str:
+    if engine.dialect.name == 'sqlite':
+        return f'INSERT OR IGNORE INTO {table} ({columns}) {select}'
+    return f'INSERT INTO {table} ({columns}) {select} ON CONFLICT DO NOTHING'
+
+
+def _backfill_request_sentences(engine: Engine) -> int:
+    """
+    Link sentences created before the request_sentences table existed to the request they were extracted from.
+
+    :param engine: Database engine.
+    :return: Number of links created.
+    """
+    with engine.begin() as conn:
+        if conn.execute('SELECT 1 FROM request_sentences LIMIT 1').first() is not None:
+            return 0
+        linked = conn.execute('INSERT INTO request_sentences (req_id, sent_id) '
+                              'SELECT req_id, id FROM sentences WHERE req_id IS NOT NULL').rowcount
+    if linked:
+        logger.info(f"Linked {linked} sentences to their requests")
+    return linked
+
+
+def _backfill_sentence_text_hash(engine: Engine, batch_size: int = 10000) -> int:
+    """
+    Fill text fingerprints of sentences created before the text_hash column existed. Duplicate sentences
+    are merged into the oldest one, moving their request links and entity associations.
+
+    :param engine: Database engine.
+    :param batch_size: Number of sentences read per batch.
+    :return: Number of merged duplicate sentences.
+    """
+    merged = 0
+    last_id = 0
+    move_links = text(_insert_ignore_sql(engine, 'request_sentences', 'req_id, sent_id',
+                                         'SELECT req_id, :keep_id FROM request_sentences WHERE sent_id = :dup_id'))
+    move_associations = text(_insert_ignore_sql(engine, 'association', 'ent_id, sent_id',
+                                                'SELECT ent_id, :keep_id FROM association WHERE sent_id = :dup_id'))
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(text('SELECT id, text FROM sentences WHERE text_hash IS NULL AND id > :last_id '
+                                     'ORDER BY id LIMIT :limit'), {'last_id': last_id, 'limit': batch_size}).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            hashes = {}
+            for sent_id, sent_text in rows:
+                hashes.setdefault(text_fingerprint(sent_text or ''), []).append(sent_id)
+            existing = dict(conn.execute(text('SELECT text_hash, id FROM sentences WHERE text_hash IN :hashes')
+                                         .bindparams(bindparam('hashes', expanding=True)),
+                                         {'hashes': list(hashes)}).fetchall())
+            updates, duplicates = [], []
+            for text_hash, sent_ids in hashes.items():
+                keep_id = existing.get(text_hash)
+                if keep_id is None:
+                    keep_id = sent_ids.pop(0)
+                    updates.append({'id': keep_id, 'text_hash': text_hash})
+                duplicates.extend({'keep_id': keep_id, 'dup_id': dup_id} for dup_id in sent_ids)
+            if updates:
+                conn.execute(text('UPDATE sentences SET text_hash = :text_hash WHERE id = :id'), updates)
+            if duplicates:
+                conn.execute(move_links, duplicates)
+                conn.execute(move_associations, duplicates)
+                conn.execute(text('DELETE FROM request_sentences WHERE sent_id = :dup_id'), duplicates)
+                conn.execute(text('DELETE FROM association WHERE sent_id = :dup_id'), duplicates)
+                conn.execute(text('DELETE FROM sentences WHERE id = :dup_id'), duplicates)
+                merged += len(duplicates)
+    if merged:
+        logger.info(f"Merged {merged} duplicate sentences")
+    return merged
+
+
+def _rebuild_association_table(engine: Engine) -> bool:
+    """
+    Rebuild association table created without primary key, dropping duplicate links,
+    and drop the unused index on sentence text.
+
+    :param engine: Database engine.
+    :return: True if association table was rebuilt.
+    """
+    inspector = inspect(engine)
+    if 'association' not in inspector.get_table_names():
+        return False
+    if inspector.get_pk_constraint('association').get('constrained_columns'):
+        return False
+
+    with engine.begin() as conn:
+        conn.execute('ALTER TABLE association RENAME TO association_old')
+        association_table.create(conn)
+        conn.execute('INSERT INTO association (ent_id, sent_id) SELECT DISTINCT ent_id, sent_id FROM association_old '
+                     'WHERE ent_id IS NOT NULL AND sent_id IS NOT NULL')
+        conn.execute('DROP TABLE association_old')
+        conn.execute('DROP INDEX IF EXISTS ix_sentences_text')
+    logger.info("Rebuilt association table with primary key (ent_id, sent_id)")
+    return True
+
+
+# SQLite FTS5 index of sentence text. External content table reading text from sentences,
+# kept in sync by triggers, with prefix indexes for short prefix queries.
+SQLITE_SENTENCES_FTS = "CREATE VIRTUAL TABLE sentences_fts USING fts5(text, content='sentences', content_rowid='id', " \
+                       "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+SQLITE_SENTENCES_FTS_TRIGGERS = [
+    "CREATE TRIGGER IF NOT EXISTS sentences_fts_insert AFTER INSERT ON sentences BEGIN "
+    "INSERT INTO sentences_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS sentences_fts_delete AFTER DELETE ON sentences BEGIN "
+    "INSERT INTO sentences_fts (sentences_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER IF NOT EXISTS sentences_fts_update AFTER UPDATE OF text ON sentences BEGIN "
+    "INSERT INTO sentences_fts (sentences_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO sentences_fts (rowid, text) VALUES (new.id, new.text); END",
+]
+
+
+def _create_search_indexes(engine: Engine) -> bool:
+    """
+    Create full-text index of sentence text, a FTS5 table on SQLite or a GIN index of tsvector on PostgreSQL,
+    and the index for prefix search of entity names on PostgreSQL. Sentences stored before the FTS5 table
+    existed are indexed when it is created.
+
+    :param engine: Database engine.
+    :return: True if full-text index of sentences is available.
+    """
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as conn:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS ix_sentences_text_tsv ON sentences "
+                         f"USING GIN (to_tsvector('{SEARCH_TS_CONFIG}', text))")
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entities_name_norm_prefix ON entities '
+                         '(name_norm text_pattern_ops)')
+        return True
+    if engine.dialect.name != 'sqlite':
+        return False
+
+    with engine.begin() as conn:
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentences_fts'").first() is None:
+            try:
+                conn.execute(SQLITE_SENTENCES_FTS)
+            except OperationalError:
+                logger.warning("SQLite is built without FTS5, sentence search falls back to LIKE queries")
+                return False
+            conn.execute("INSERT INTO sentences_fts (sentences_fts) VALUES ('rebuild')")
+            logger.info("Created full-text index of sentences")
+        for trigger in SQLITE_SENTENCES_FTS_TRIGGERS:
+            conn.execute(trigger)
+    return True
+
+
+def upgrade(engine: Engine) -> None:
+    """
+    Upgrade schema of existing database in place. Safe to run on every startup.
+
+    :param engine: Database engine.
+    """
+    _add_missing_columns(engine)
+    _backfill_entity_name_norm(engine)
+    _rebuild_association_table(engine)
+    _backfill_request_sentences(engine)
+    _backfill_sentence_text_hash(engine)
+    _add_missing_indexes(engine)
+    _create_search_indexes(engine)
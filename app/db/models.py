@@ -1,10 +1,39 @@
+import hashlib
 from enum import Enum
-from sqlalchemy import Column, ForeignKey, Integer, String, Table
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table
 from sqlalchemy.orm import relationship
 
 from .database import Base
 
 
+def normalize_entity_name(name: str) -> str:
+    """
+    Normalize entity name for case-insensitive lookups.
+
+    :param name: Entity name.
+    :return: Lower-cased name with collapsed whitespace.
+    """
+    return ' '.join(name.split()).lower()
+
+
+def _default_name_norm(context) -> str:
+    return normalize_entity_name(context.get_current_parameters()['name'])
+
+
+def text_fingerprint(text: str) -> str:
+    """
+    Fingerprint of text for deduplication of documents and sentences, ignoring differences in whitespace.
+
+    :param text: Text of document or sentence.
+    :return: Hex SHA-256 digest of text with collapsed whitespace.
+    """
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+
+def _default_text_hash(context) -> str:
+    return text_fingerprint(context.get_current_parameters()['text'])
+
+
 class Statuses(Enum):
     Queued = 1
     Processing = 2
@@ -18,24 +47,44 @@ class Request(Base):
     id = Column(Integer, primary_key=True, index=True)
     path = Column(String, unique=True, index=True)
     status = Column(String, index=True)
+    attempts = Column(Integer, default=0, server_default='0', nullable=False)
+    lease_expires = Column(DateTime, nullable=True)
+    content_hash = Column(String, index=True, nullable=True)
+    # Queued requests are processed in order of descending priority, then of id
+    priority = Column(Integer, default=0, server_default='0', nullable=False)
 
-    sentences = relationship("Sentence", back_populates="request")
+    # Sentences are shared by requests of the same content, or requests of documents sharing sentences
+    sentences = relationship("Sentence", secondary=lambda: request_sentences_table, order_by="Sentence.id",
+                             viewonly=True)
 
 
+# Primary key (ent_id, sent_id) serves sentences of entity lookups and prevents duplicate links,
+# index on sent_id serves entities of sentence lookups.
 association_table = Table('association', Base.metadata,
-                          Column('sent_id', Integer, ForeignKey('sentences.id')),
-                          Column('ent_id', Integer, ForeignKey('entities.id'))
+                          Column('ent_id', Integer, ForeignKey('entities.id'), primary_key=True),
+                          Column('sent_id', Integer, ForeignKey('sentences.id'), primary_key=True, index=True)
                           )
 
 
+# Sentences of requests. Primary key (req_id, sent_id) serves sentences of request lookups,
+# index on sent_id serves lookups of requests still linked to a sentence.
+request_sentences_table = Table('request_sentences', Base.metadata,
+                                Column('req_id', Integer, ForeignKey('requests.id'), primary_key=True),
+                                Column('sent_id', Integer, ForeignKey('sentences.id'), primary_key=True, index=True)
+                                )
+
+
 class Sentence(Base):
     __tablename__ = "sentences"
 
     id = Column(Integer, primary_key=True, index=True)
-    text = Column(String, index=True)
+    text = Column(String)
+    text_hash = Column(String, unique=True, index=True, default=_default_text_hash)
+    start_char = Column(Integer, nullable=True)
+    # Request the sentence was first extracted from, start_char is its offset in that document
     req_id = Column(Integer, ForeignKey("requests.id"))
 
-    request = relationship("Request", back_populates="sentences")
+    request = relationship("Request")
     entities = relationship("Entity",
                             secondary=association_table,
                             back_populates="sentences")
@@ -46,6 +95,7 @@ class Entity(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True)
+    name_norm = Column(String, index=True, default=_default_name_norm)
     ent_type = Column(String, index=True)
     # sent_id = Column(Integer, ForeignKey("sentences.id"))
 
@@ -1,4 +1,4 @@
-from typing import List
+from typing import List, NamedTuple, Optional
 
 from pydantic import BaseModel
 from pydantic.main import ForwardRef
@@ -33,6 +33,15 @@ class SentenceCreate(SentenceBase):
     pass
 
 
+class TaggedSentence(NamedTuple):
+    """
+    Sentence tagged by the NLP service with its named entities. Plain tuple to keep bulk inserts cheap.
+    """
+    text: str
+    entities: List[EntityCreate]
+    start_char: int = 0
+
+
 class Sentence(SentenceBase):
     id: int
     req_id: int
@@ -49,18 +58,27 @@ class RequestBase(BaseModel):
 
 
 class RequestCreate(RequestBase):
-    pass
+    priority: int = 0
 
 
 class Request(RequestBase):
     id: int
     status: str
+    content_hash: Optional[str] = None
+    priority: int = 0
     sentences: List[Sentence] = []
 
     class Config:
         orm_mode = True
 
 
+class RequestSubmission(BaseModel):
+    path: Optional[str] = None
+    status: str
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
 class Association(BaseModel):
     sent_id: int
     ent_id: int
@@ -71,3 +89,33 @@ class Association(BaseModel):
 
 class EntitySearch(BaseModel):
     entity_name: str
+
+
+class SearchSentence(SentenceBase):
+    id: int
+    req_id: int
+    score: float
+
+    class Config:
+        orm_mode = True
+
+
+class NerRequest(BaseModel):
+    text: Optional[str] = None
+    texts: List[str] = []
+    persist: bool = False
+
+
+class NerSentence(BaseModel):
+    text: str
+    start_char: int
+    entities: List[EntityBase] = []
+
+
+class NerDocument(BaseModel):
+    sentences: List[NerSentence] = []
+    req_id: Optional[int] = None
+
+
+class NerResponse(BaseModel):
+    documents: List[NerDocument] = []
@@ -1,7 +1,9 @@
+import asyncio
 import string
 import random
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from os import path
 
 import uvicorn
@@ -10,9 +12,16 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi_versioning import VersionedFastAPI
 from starlette.responses import RedirectResponse
 
-from db.database import SessionLocal, engine
-from db import schemas, crud, models
-from api import ping, requests, sentences, entities
+from db.database import SessionLocal, WriterSessionLocal, engine
+from db import schemas, crud, models, migrations
+from db.executor import db_executor, writer_db_executor
+from api import ping, requests, sentences, entities, ner, search, metrics, export
+from services import nlp_service
+from services.scheduler_service import scheduler
+from services.fetch_service import fetcher
+from services.metrics_service import HTTP_REQUEST_SECONDS
+from services.cache_service import register_invalidation
+from config import NLP_WARM_ON_STARTUP, INGEST_MODE, THREADPOOL_SIZE
 
 # setup loggers
 log_file_path = path.join(path.dirname(path.abspath(__file__)), 'logging.conf')
@@ -23,6 +32,8 @@ logger = logging.getLogger(__name__)  # the __name__ resolve to "main" since we
 
 # create database engine
 models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
+register_invalidation()
 
 app = FastAPI(title='NER Service')
 
@@ -50,6 +61,10 @@ app.include_router(ping.router)
 app.include_router(requests.router, prefix="/requests", tags=["requests"])
 app.include_router(entities.router, prefix="/entities", tags=["entities"])
 app.include_router(sentences.router, prefix='/sentences', tags=['sentences'])
+app.include_router(ner.router, prefix='/ner', tags=['ner'])
+app.include_router(search.router, prefix='/search', tags=['search'])
+app.include_router(metrics.router, prefix='/metrics', tags=['metrics'])
+app.include_router(export.router, prefix='/export', tags=['export'])
 
 app = VersionedFastAPI(app)
 
@@ -69,22 +84,65 @@ async def log_requests(request: Request, call_next):
     formatted_process_time = '{0:.2f}'.format(process_time)
     logger.info(f"rid={idem} completed_in={formatted_process_time}ms status_code={response.status_code}")
     response.headers["X-Process-Time"] = str(process_time)
+    HTTP_REQUEST_SECONDS.observe(process_time / 1000, request.method, str(response.status_code))
     return response
 
 
+@app.on_event("startup")
+async def configure_threadpool():
+    """
+    Startup event to size the threadpool running sync routes, background tasks and other blocking calls.
+    Database calls of async routes run on the separate executor of db.executor.
+    """
+    if THREADPOOL_SIZE > 0:
+        asyncio.get_event_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=THREADPOOL_SIZE, thread_name_prefix='threadpool'))
+
+
 @app.on_event("startup")
 async def startup_event():
     """
-    Startup event to "abruptly stopped" Requests to Error status.
+    Startup event to resume "abruptly stopped" Requests.
+    In worker mode, the workers pick up queued and expired requests by themselves.
     """
-    db = SessionLocal()
+    if INGEST_MODE != 'background':
+        return
+    db = WriterSessionLocal()
     try:
-        err_count = crud.update_requests_status(db, [models.Statuses.Queued, models.Statuses.Processing],
-                                                models.Statuses.Error)
-        logger.info(f"Updated {err_count} requests to Error state.")
+        requeued = crud.update_requests_status(db, [models.Statuses.Processing], models.Statuses.Queued)
+        logger.info(f"Updated {requeued} requests to Queued state.")
+        queued = crud.get_claimable_requests(db)
     finally:
         db.close()
 
+    if queued:
+        asyncio.get_event_loop().run_in_executor(None, scheduler.run, queued)
+    logger.info(f"Resumed {len(queued)} queued requests.")
+
+
+@app.on_event("startup")
+async def warm_nlp_model():
+    """
+    Startup event to load NLP model before serving requests, instead of on first use.
+    """
+    if not NLP_WARM_ON_STARTUP:
+        return
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, nlp_service.get_nlp)
+    except Exception:
+        logger.exception("Failed to warm NLP model, it will be loaded on first use.")
+
+
+@app.on_event("shutdown")
+def shutdown_event():
+    """
+    Shutdown event to close pooled HTTP connections of web fetcher and the database executors.
+    """
+    fetcher.close()
+    db_executor.shutdown()
+    writer_db_executor.shutdown()
+
 
 @app.get("/")
 def main():
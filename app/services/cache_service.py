@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from db import crud
+from db.cache import LRUCache
+from config import RESPONSE_CACHE_BACKEND, RESPONSE_CACHE_TTL, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_REDIS_URL
+
+logger = logging.getLogger(__name__)
+
+
+class CachedResponse(NamedTuple):
+    """
+    Rendered JSON response, with the versions of its tags when it was rendered.
+    """
+    body: bytes
+    etag: str
+    headers: Dict[str, str]
+    tag_versions: Tuple[int, ...]
+
+
+class MemoryBackend:
+    """
+    In-process cache backend with LRU eviction and TTL expiry.
+    Tags are invalidated by bumping their version, entries rendered with an older version are misses.
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE):
+        """
+        :param maxsize: max number of cached responses.
+        """
+        self._entries = LRUCache(maxsize)
+        self._tag_versions = {}
+        self._lock = threading.Lock()
+
+    def set(self, key: str, value: CachedResponse, ttl: float) -> None:
+        self._entries.put(key, (value, time.monotonic() + ttl))
+
+    def get_tag_versions(self, tags: List[str]) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._tag_versions.get(tag, 0) for tag in tags)
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        with self._lock:
+            for tag in tags:
+                self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+
+    def lookup(self, key: str, tags: List[str]) -> Optional[CachedResponse]:
+        """
+        Get cached response of key, if it has not expired and its tags were not invalidated since.
+
+        :param key: Cache key.
+        :param tags: Tags of cached response.
+        :return: Cached response, or None on cache miss.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires < time.monotonic() or value.tag_versions != self.get_tag_versions(tags):
+            return None
+        return value
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._entries.stats()
+
+
+class RedisBackend:
+    """
+    Cache backend shared by API nodes and NER workers through Redis, so that invalidations of one process
+    reach all of them. Requires the redis package.
+    """
+
+    def __init__(self, url: str = RESPONSE_CACHE_REDIS_URL, prefix: str = 'ner:cache:'):
+        """
+        :param url: Redis URL.
+        :param prefix: Prefix of Redis keys.
+        """
+        import redis
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get_tag_versions(self, tags: List[str]) -> Tuple[int, ...]:
+        if not tags:
+            return ()
+        return tuple(int(version or 0) for version in self._redis.mget([self.prefix + 'tag:' + tag for tag in tags]))
+
+    def invalidate_tags(self, tags: Iterable[str]) -> None:
+        pipe = self._redis.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(self.prefix + 'tag:' + tag)
+        pipe.execute()
+
+    def lookup(self, key: str, tags: List[str]) -> Optional[CachedResponse]:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(self.prefix + key)
+        for tag in tags:
+            pipe.get(self.prefix + 'tag:' + tag)
+        raw, *versions = pipe.execute()
+        if raw is None:
+            return None
+        value = CachedResponse(*pickle.loads(raw))
+        if value.tag_versions != tuple(int(version or 0) for version in versions):
+            return None
+        return value
+
+    def set(self, key: str, value: CachedResponse, ttl: float) -> None:
+        self._redis.set(self.prefix + key, pickle.dumps(tuple(value)), px=int(ttl * 1000))
+
+    def clear(self) -> None:
+        keys = list(self._redis.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self._redis.delete(*keys)
+
+    def stats(self) -> Dict[str, int]:
+        return {}
+
+
+class ResponseCache:
+    """
+    Cache of rendered JSON responses of read endpoints, tagged by the entities they depend on
+    and invalidated when sentences are linked to or unlinked from those entities.
+    Supports conditional requests with ETag and If-None-Match.
+    """
+
+    def __init__(self, backend=None, ttl: float = RESPONSE_CACHE_TTL):
+        """
+        :param backend: MemoryBackend or RedisBackend, responses are not cached if None.
+        :param ttl: Seconds responses are cached for.
+        """
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def respond(self, request: Request, key: str, tags: List[str], compute: Callable[[Response], Any]) -> Response:
+        """
+        Respond with cached response of key, or render and cache response computed by compute.
+
+        :param request: Request, whose If-None-Match header is checked against the ETag of the response.
+        :param key: Cache key identifying the response, e.g. route and query parameters.
+        :param tags: Tags of response, e.g. "entity:1".
+        :param compute: Function computing JSON content of response, may set headers of the Response passed to it.
+        :return: Response, or empty "304 Not Modified" response if the client has the current version.
+        """
+        cached = None
+        if self.backend is not None:
+            try:
+                cached = self.backend.lookup(key, tags)
+            except Exception:
+                logger.exception(f"Failed to read response cache key {key}")
+        self._count('hits' if cached is not None else 'misses')
+
+        if cached is None:
+            tag_versions = None
+            if self.backend is not None:
+                try:
+                    # Read before computing, so that invalidations while computing make the entry stale
+                    tag_versions = self.backend.get_tag_versions(tags)
+                except Exception:
+                    logger.exception(f"Failed to read response cache tags {tags}")
+            headers = Response()
+            content = compute(headers)
+            body = json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                              separators=(',', ':')).encode('utf-8')
+            cached = CachedResponse(body=body, etag='"' + hashlib.sha1(body).hexdigest() + '"',
+                                    headers={name: value for name, value in headers.headers.items()
+                                             if name not in ('content-length', 'content-type')},
+                                    tag_versions=tag_versions or ())
+            if tag_versions is not None:
+                try:
+                    self.backend.set(key, cached, self.ttl)
+                except Exception:
+                    logger.exception(f"Failed to write response cache key {key}")
+
+        headers = dict(cached.headers, ETag=cached.etag)
+        if _etag_matches(cached.etag, request.headers.get('if-none-match', '')):
+            self._count('not_modified')
+            return Response(status_code=304, headers=headers)
+        return Response(content=cached.body, media_type='application/json', headers=headers)
+
+    def invalidate_entities(self, entity_ids: Iterable[int]) -> None:
+        """
+        Invalidate cached responses tagged with entities.
+
+        :param entity_ids: IDs of entities.
+        """
+        if self.backend is None:
+            return
+        try:
+            self.backend.invalidate_tags([entity_tag(ent_id) for ent_id in entity_ids])
+        except Exception:
+            logger.exception("Failed to invalidate response cache")
+
+    def clear(self) -> None:
+        """
+        Remove all cached responses and reset counters.
+        """
+        if self.backend is not None:
+            self.backend.clear()
+        with self._lock:
+            self.hits = self.misses = self.not_modified = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get cache counters.
+
+        :return: Dict of backend, hits, misses, hit_rate, not_modified and counters of backend.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            stats = {'backend': type(self.backend).__name__ if self.backend is not None else None,
+                     'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / total if total else 0.0,
+                     'not_modified': self.not_modified}
+        if self.backend is not None:
+            stats.update({f'backend_{name}': value for name, value in self.backend.stats().items()})
+        return stats
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+def entity_tag(entity_id: int) -> str:
+    """
+    Tag of responses depending on the sentences of entity.
+
+    :param entity_id: ID of entity.
+    :return: Tag string.
+    """
+    return f'entity:{entity_id}'
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in (etag, '*'):
+            return True
+    return False
+
+
+def create_backend(name: str = RESPONSE_CACHE_BACKEND):
+    """
+    Create response cache backend.
+
+    :param name: 'memory', 'redis' or 'none'.
+    :return: Backend object, or None if caching is disabled.
+    """
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'redis':
+        return RedisBackend()
+    if name == 'none':
+        return None
+    raise ValueError(f"Unknown response cache backend '{name}', expected one of ['memory', 'redis', 'none']")
+
+
+def register_invalidation() -> None:
+    """
+    Invalidate cached responses when sentences of entities are linked or unlinked by this process.
+    Called at startup of webservice and worker processes, since both write entity links.
+    """
+    if response_cache.invalidate_entities not in crud.entity_link_listeners:
+        crud.add_entity_link_listener(response_cache.invalidate_entities)
+
+
+response_cache = ResponseCache(create_backend())
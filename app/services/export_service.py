@@ -0,0 +1,91 @@
+import json
+import logging
+import zlib
+from enum import Enum
+from typing import Iterable, Iterator, Optional, Tuple
+
+from db import crud
+from db.database import SessionLocal
+from config import EXPORT_BATCH_SIZE, EXPORT_CHUNK_BYTES, EXPORT_GZIP_LEVEL
+
+logger = logging.getLogger(__name__)
+
+_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+class ExportDataset(str, Enum):
+    entities = 'entities'
+    sentences = 'sentences'
+    entity_sentences = 'entity_sentences'
+
+
+# Row iterator of crud and field names of rows, by dataset
+DATASETS = {
+    ExportDataset.entities: (crud.iter_entities, ('id', 'name', 'ent_type')),
+    ExportDataset.sentences: (crud.iter_sentences, ('id', 'text', 'req_id')),
+    ExportDataset.entity_sentences: (crud.iter_entity_sentence_links, ('ent_id', 'sent_id')),
+}
+
+
+def ndjson_chunks(rows: Iterable[tuple], fields: Tuple[str, ...],
+                  chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """
+    Encode rows as NDJSON objects, joined into chunks of about chunk_bytes.
+
+    :param rows: Row tuples.
+    :param fields: Field names of row values.
+    :param chunk_bytes: Min size of chunks, except the last one.
+    :return: Iterator of encoded chunks.
+    """
+    lines, size = [], 0
+    for row in rows:
+        line = _encoder.encode(dict(zip(fields, row)))
+        lines.append(line)
+        size += len(line) + 1
+        if size >= chunk_bytes:
+            lines.append('')
+            yield '\n'.join(lines).encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        lines.append('')
+        yield '\n'.join(lines).encode('utf-8')
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = EXPORT_GZIP_LEVEL) -> Iterator[bytes]:
+    """
+    Compress chunks as one gzip stream.
+
+    :param chunks: Uncompressed chunks.
+    :param level: Compression level, 1 (fastest) to 9 (smallest).
+    :return: Iterator of compressed chunks.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_dataset(dataset: ExportDataset, after_id: Optional[int] = None, compress: bool = False,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Stream all rows of dataset as NDJSON. The rows are read with a session of the generator,
+    which is open until the stream is consumed or closed, rather than the session of the request.
+
+    :param dataset: Dataset to export.
+    :param after_id: only export rows after id, e.g. the last id of an interrupted export.
+    :param compress: gzip the stream.
+    :param batch_size: number of rows fetched from the database at a time.
+    :return: Iterator of chunks of the response body.
+    """
+    iter_rows, fields = DATASETS[dataset]
+
+    def generate():
+        db = SessionLocal()
+        try:
+            yield from ndjson_chunks(iter_rows(db, after_id=after_id, batch_size=batch_size), fields)
+        finally:
+            db.close()
+
+    return gzip_chunks(generate()) if compress else generate()
@@ -0,0 +1,193 @@
+import codecs
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional
+
+from bs4 import BeautifulSoup, Comment, Declaration, Doctype, ProcessingInstruction
+
+try:
+    import lxml.html
+except ImportError:  # pragma: no cover
+    lxml = None
+
+from config import HTML_BACKEND
+
+BLACKLIST = [
+    '[document]',
+    'noscript',
+    'header',
+    'html',
+    'meta',
+    'head',
+    'input',
+    'script',
+    'style',
+    'link',
+    # 'a',
+]
+
+_BLACKLIST = frozenset(BLACKLIST)
+
+# Elements without end tags, which never contain text
+_VOID_ELEMENTS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                            'source', 'track', 'wbr'])
+
+
+def _join(parts: List[str]) -> str:
+    return ' '.join(parts)
+
+
+def _known_encoding(encoding: Optional[str]) -> Optional[str]:
+    """
+    Encoding name if Python knows it, None otherwise, e.g. for a misspelled charset of a Content-Type header.
+    """
+    if not encoding:
+        return None
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return None
+
+
+def extract_text_bs4(html: bytes, encoding: str = None) -> str:
+    """
+    Extract text of web page with BeautifulSoup4 and the pure-Python html.parser.
+
+    :param html: web page content
+    :param encoding: charset of the Content-Type header, detected by BeautifulSoup if None
+    :return extracted document string
+    """
+    soup = BeautifulSoup(html, 'html.parser', from_encoding=_known_encoding(encoding))
+    parts = []
+    for t in soup.find_all(text=True):
+        if isinstance(t, (Comment, Declaration, Doctype, ProcessingInstruction)):
+            continue
+        if t.parent.name not in _BLACKLIST:
+            nt = t.strip()
+            if nt:
+                parts.append(nt)
+    return _join(parts)
+
+
+def _lxml_encoding(html: bytes, encoding: Optional[str]) -> Optional[str]:
+    """
+    Encoding of web page for lxml, which falls back to Latin-1 for pages without meta charset.
+    Pages without charset in the Content-Type header are decoded as UTF-8 if they are valid UTF-8,
+    like BeautifulSoup does, and left to the meta charset detection of lxml otherwise.
+    """
+    encoding = _known_encoding(encoding)
+    if encoding is not None:
+        return encoding
+    try:
+        html.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return None
+
+
+def extract_text_lxml(html: bytes, encoding: str = None) -> str:
+    """
+    Extract text of web page with the libxml2-based lxml parser.
+
+    :param html: web page content
+    :param encoding: charset of the Content-Type header, detected from the page if None
+    :return extracted document string
+    """
+    if not html.strip():
+        return ''
+    try:
+        root = lxml.html.fromstring(html, parser=lxml.html.HTMLParser(encoding=_lxml_encoding(html, encoding)))
+    except lxml.etree.ParserError:
+        return ''
+    parts = []
+    # Text of element belongs to element and comes before its children,
+    # tail text belongs to its parent and comes after its children
+    stack = [(root, False)]
+    while stack:
+        el, visited = stack.pop()
+        if visited:
+            if el.tail and el.getparent() is not None and el.getparent().tag not in _BLACKLIST:
+                nt = el.tail.strip()
+                if nt:
+                    parts.append(nt)
+            continue
+        # Skip text of comments and processing instructions, whose tag is not a string
+        if el.text and isinstance(el.tag, str) and el.tag not in _BLACKLIST:
+            nt = el.text.strip()
+            if nt:
+                parts.append(nt)
+        stack.append((el, True))
+        stack.extend((child, False) for child in reversed(el))
+    return _join(parts)
+
+
+class _TextCollector(HTMLParser):
+    """
+    Streaming tokenizer that keeps a stack of open tags instead of building a tree,
+    and drops text whose parent tag is blacklisted.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack = []
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag not in _VOID_ELEMENTS:
+            self.stack.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        pass
+
+    def handle_endtag(self, tag):
+        # Close unclosed children of tag, ignore stray end tags
+        if tag in self.stack:
+            while self.stack.pop() != tag:
+                pass
+
+    def handle_data(self, data):
+        parent = self.stack[-1] if self.stack else '[document]'
+        if parent not in _BLACKLIST:
+            nt = data.strip()
+            if nt:
+                self.parts.append(nt)
+
+
+def extract_text_stream(html: bytes, encoding: str = None) -> str:
+    """
+    Extract text of web page with a streaming tokenizer, without building a document tree.
+
+    :param html: web page content
+    :param encoding: charset of the Content-Type header, UTF-8 if None
+    :return extracted document string
+    """
+    collector = _TextCollector()
+    if isinstance(html, bytes):
+        html = html.decode(_known_encoding(encoding) or 'utf-8', errors='replace')
+    collector.feed(html)
+    collector.close()
+    return _join(collector.parts)
+
+
+BACKENDS: Dict[str, Callable[..., str]] = {
+    'bs4': extract_text_bs4,
+    'stream': extract_text_stream,
+}
+if lxml is not None:
+    BACKENDS['lxml'] = extract_text_lxml
+
+
+def extract_text(html: bytes, backend: str = None, encoding: str = None) -> str:
+    """
+    Extract text body of web page, skipping text of blacklisted tag parents.
+
+    :param html: web page content
+    :param backend: name of extraction backend, defaults to HTML_BACKEND, or 'stream' if lxml is not installed
+    :param encoding: charset of the Content-Type header of web page, detected from the page if None
+    :return extracted document string
+    """
+    backend = backend or HTML_BACKEND
+    if backend == 'lxml' and 'lxml' not in BACKENDS:
+        backend = 'stream'
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown HTML backend '{backend}', expected one of {list(BACKENDS)}")
+    return BACKENDS[backend](html, encoding=encoding)
@@ -0,0 +1,262 @@
+import asyncio
+import contextlib
+import logging
+import os
+import threading
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Union
+from urllib.parse import urlsplit
+
+import httpx
+
+from services.metrics_service import FETCHES, FETCH_BYTES, observe_stage
+from config import (FETCH_MAX_CONNECTIONS, FETCH_MAX_PER_HOST, FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT,
+                    FETCH_TOTAL_TIMEOUT, FETCH_MAX_BYTES, FETCH_CONTENT_TYPES)
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Fast-NER-WebService/1.0'
+
+
+class FetchError(Exception):
+    """
+    Raised when a web page cannot be fetched.
+    """
+
+
+class ContentTypeError(FetchError):
+    """
+    Raised when a web page has a content type that is not accepted.
+    """
+
+
+class BodyTooLargeError(FetchError):
+    """
+    Raised when a web page body exceeds the size cap.
+    """
+
+
+class FetchResult(NamedTuple):
+    url: str
+    status_code: int
+    content_type: str
+    content: bytes
+
+    @property
+    def charset(self) -> Optional[str]:
+        """
+        Charset parameter of the Content-Type header, None if there is none.
+        """
+        for param in self.content_type.split(';')[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'charset':
+                return value.strip().strip('"\'') or None
+        return None
+
+
+class _HostLimit:
+    """
+    Semaphore limiting concurrent fetches of a host, with the number of fetches holding or waiting on it.
+    """
+
+    def __init__(self, max_per_host: int):
+        self.semaphore = asyncio.Semaphore(max_per_host)
+        self.users = 0
+
+
+class Fetcher:
+    """
+    Async HTTP fetch layer with a shared pooled client, per-host concurrency limits, timeouts,
+    a streaming body size cap and content type filtering.
+    The client lives on an event loop in a daemon thread, so synchronous callers such as background tasks
+    share its connection pool through fetch_sync.
+    """
+
+    def __init__(self, max_connections: int = FETCH_MAX_CONNECTIONS, max_per_host: int = FETCH_MAX_PER_HOST,
+                 connect_timeout: float = FETCH_CONNECT_TIMEOUT, read_timeout: float = FETCH_READ_TIMEOUT,
+                 total_timeout: float = FETCH_TOTAL_TIMEOUT, max_bytes: int = FETCH_MAX_BYTES,
+                 content_types: List[str] = FETCH_CONTENT_TYPES):
+        """
+        :param max_connections: max number of open connections of client.
+        :param max_per_host: max number of concurrent fetches per host.
+        :param connect_timeout: seconds to wait for connection.
+        :param read_timeout: seconds to wait for each chunk of the response.
+        :param total_timeout: seconds to wait for the whole response.
+        :param max_bytes: max size of response body.
+        :param content_types: accepted content types, all content types are accepted if empty.
+        """
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.total_timeout = total_timeout
+        self.max_bytes = max_bytes
+        self.content_types = [content_type.strip().lower() for content_type in content_types if content_type.strip()]
+        self._client = None
+        # Limits of hosts being fetched, dropped once no fetch holds or waits on them
+        self._host_limits: Dict[str, _HostLimit] = {}
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self._client = httpx.AsyncClient(timeout=self.timeout, limits=limits,
+                                             headers={'User-Agent': USER_AGENT})
+        return self._client
+
+    @contextlib.asynccontextmanager
+    async def _host_limit(self, url: str) -> AsyncIterator[None]:
+        # Only used on the fetcher loop, so no lock is needed
+        host = urlsplit(url).netloc.lower()
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = _HostLimit(self.max_per_host)
+        limit.users += 1
+        try:
+            async with limit.semaphore:
+                yield
+        finally:
+            limit.users -= 1
+            if limit.users == 0 and self._host_limits.get(host) is limit:
+                del self._host_limits[host]
+
+    def _check_content_type(self, url: str, content_type: str) -> None:
+        media_type = content_type.split(';')[0].strip().lower()
+        if self.content_types and media_type not in self.content_types:
+            raise ContentTypeError(f"Unsupported content type '{media_type}' of {url}")
+
+    async def _read_capped(self, url: str, response: httpx.Response) -> bytes:
+        content_length = response.headers.get('content-length')
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            raise BodyTooLargeError(f"Body of {url} is {content_length} bytes, above cap of {self.max_bytes}")
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes():
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise BodyTooLargeError(f"Body of {url} exceeds cap of {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def _fetch(self, method: str, url: str) -> FetchResult:
+        async with self._host_limit(url):
+            async with self._get_client().stream(method, url) as response:
+                response.raise_for_status()
+                content_type = response.headers.get('content-type', '')
+                self._check_content_type(url, content_type)
+                content = await self._read_capped(url, response) if method == 'GET' else b''
+                return FetchResult(url=str(response.url), status_code=response.status_code,
+                                   content_type=content_type, content=content)
+
+    async def fetch(self, url: str, method: str = 'GET', timeout: float = None) -> FetchResult:
+        """
+        Fetch web page. Must be awaited on the fetcher loop, see fetch_async and fetch_sync.
+
+        :param url: web page link
+        :param method: HTTP method, GET or HEAD
+        :param timeout: seconds to wait for the whole response, total_timeout if not provided
+        :return FetchResult: fetched response
+        """
+        timeout = timeout or self.total_timeout
+        with observe_stage('fetch'):
+            try:
+                page = await asyncio.wait_for(self._fetch(method, url), timeout=timeout)
+            except asyncio.TimeoutError:
+                FETCHES.inc('timeout')
+                raise FetchError(f"Fetching {url} took longer than {timeout} seconds")
+            except httpx.HTTPError as e:
+                FETCHES.inc('error')
+                raise FetchError(f"Failed to fetch {url}: {e!r}") from e
+            except FetchError:
+                FETCHES.inc('rejected')
+                raise
+        FETCHES.inc('ok')
+        FETCH_BYTES.inc(amount=len(page.content))
+        return page
+
+    async def probe(self, url: str, timeout: float) -> FetchResult:
+        """
+        Check web page is reachable with a HEAD request. Falls back to a GET request
+        for servers that do not allow HEAD, in which case the result contains the page body.
+        Must be awaited on the fetcher loop.
+
+        :param url: web page link
+        :param timeout: seconds to wait for the whole response
+        :return FetchResult: fetched response
+        """
+        try:
+            return await self.fetch(url, method='HEAD', timeout=timeout)
+        except FetchError as e:
+            if isinstance(e.__cause__, httpx.HTTPStatusError) and e.__cause__.response.status_code in (405, 501):
+                return await self.fetch(url, method='GET', timeout=timeout)
+            raise
+
+    async def fetch_many(self, urls: List[str]) -> List[Union[FetchResult, Exception]]:
+        """
+        Fetch web pages concurrently. Must be awaited on the fetcher loop.
+
+        :param urls: web page links
+        :return: FetchResult or raised exception of each URL, in order of urls
+        """
+        return await asyncio.gather(*(self.fetch(url) for url in urls), return_exceptions=True)
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # Forked worker processes get their own loop and client
+            if self._loop is None or self._pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._pid = os.getpid()
+                self._client = None
+                self._host_limits = {}
+                threading.Thread(target=self._loop.run_forever, name='fetcher', daemon=True).start()
+            return self._loop
+
+    def submit(self, coro):
+        """
+        Schedule coroutine of fetcher on its loop.
+
+        :param coro: Coroutine of fetch or fetch_many.
+        :return: concurrent.futures.Future of coroutine result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    async def fetch_async(self, url: str, method: str = 'GET') -> FetchResult:
+        """
+        Fetch web page from any event loop.
+        """
+        return await asyncio.wrap_future(self.submit(self.fetch(url, method)))
+
+    async def probe_async(self, url: str, timeout: float) -> FetchResult:
+        """
+        Check web page is reachable from any event loop, see probe.
+        """
+        return await asyncio.wrap_future(self.submit(self.probe(url, timeout)))
+
+    def fetch_sync(self, url: str, method: str = 'GET') -> FetchResult:
+        """
+        Fetch web page from synchronous code.
+        """
+        return self.submit(self.fetch(url, method)).result()
+
+    def fetch_many_sync(self, urls: List[str]) -> List[Union[FetchResult, Exception]]:
+        """
+        Fetch web pages concurrently from synchronous code.
+        """
+        return self.submit(self.fetch_many(urls)).result()
+
+    def close(self) -> None:
+        """
+        Close pooled client and stop fetcher loop.
+        """
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop, self._client = None, None
+        if loop is None or self._pid != os.getpid():
+            return
+        if client is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+
+fetcher = Fetcher()
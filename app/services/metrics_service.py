@@ -0,0 +1,274 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from config import METRICS_DB_EVENTS
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of histogram buckets, from fast DB queries to slow web pages
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonic counter, by label values.
+    """
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        """
+        :param name: Metric name.
+        :param documentation: Help text.
+        :param labelnames: Names of labels.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Counters without labels are exported from zero
+        self._values = {} if self.labelnames else {(): 0}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self._values.get(labelvalues, 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in values]
+
+
+class Histogram:
+    """
+    Histogram of observed values with cumulative buckets, by label values.
+    Observing costs a bisect and a few additions under a lock.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param name: Metric name.
+        :param documentation: Help text.
+        :param labelnames: Names of labels.
+        :param buckets: Sorted upper bounds of buckets, the +Inf bucket is added.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Label values to [count of each bucket (non-cumulative, last is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labelvalues)
+            if series is None:
+                series = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labelvalues: str):
+        """
+        Observe seconds spent in the with block, also when it raises.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labelvalues)
+
+    def count(self, *labelvalues: str) -> int:
+        with self._lock:
+            series = self._values.get(labelvalues)
+            return sum(series[0]) if series else 0
+
+    def total(self, *labelvalues: str) -> float:
+        with self._lock:
+            series = self._values.get(labelvalues)
+            return series[1] if series else 0.0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = []
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}')
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f'{self.name}_sum{label_str} {_format_value(total)}')
+            lines.append(f'{self.name}_count{label_str} {cumulative}')
+        return lines
+
+
+class Collector:
+    """
+    Metric whose values are read by a function when metrics are rendered, e.g. from the database.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str],
+                 collect: Callable[[], Dict[Tuple[str, ...], float]], metric_type: str = 'gauge'):
+        """
+        :param name: Metric name.
+        :param documentation: Help text.
+        :param labelnames: Names of labels.
+        :param collect: Function returning dict of label values to value.
+        :param metric_type: 'gauge', or 'counter' for values only growing, e.g. counters kept elsewhere.
+        """
+        self.type = metric_type
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        return [f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+                for labels, value in sorted(self.collect().items())]
+
+
+class Registry:
+    """
+    Metrics of this process, rendered in the Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render all metrics. Metrics whose collection fails are left out.
+
+        :return: Text exposition format, version 0.0.4.
+        """
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                logger.exception(f"Failed to collect metric {metric.name}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'ner_stage_seconds', 'Seconds spent in each stage of the ingest pipeline: fetch, extract, ner and persist.',
+    ['stage']))
+FETCHES = registry.register(Counter('ner_fetches_total', 'Web pages fetched, by outcome.', ['outcome']))
+FETCH_BYTES = registry.register(Counter('ner_fetch_bytes_total', 'Bytes of web pages fetched.'))
+NER_DOCUMENTS = registry.register(Counter('ner_model_documents_total', 'Documents (text chunks) tagged by the model.'))
+NER_CHARACTERS = registry.register(Counter('ner_model_characters_total', 'Characters tagged by the model.'))
+NER_SENTENCES = registry.register(Counter('ner_model_sentences_total', 'Sentences with entities found by the model.'))
+NER_BATCH_DOCUMENTS = registry.register(Histogram(
+    'ner_model_batch_documents', 'Documents tagged per nlp.pipe batch.', buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)))
+DB_QUERY_SECONDS = registry.register(Histogram(
+    'ner_db_query_seconds', 'Seconds spent executing database statements, by statement type.', ['statement']))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    'ner_http_request_seconds', 'Seconds spent handling HTTP requests, by method and status code.',
+    ['method', 'status_code']))
+
+
+def observe_stage(stage: str):
+    """
+    Time the with block as a stage of the ingest pipeline.
+
+    :param stage: fetch, extract, ner or persist.
+    """
+    return STAGE_SECONDS.time(stage)
+
+
+def _statement_type(statement: str) -> str:
+    verb = statement.lstrip()[:8].split(None, 1)
+    verb = verb[0].upper() if verb else ''
+    return verb if verb in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'PRAGMA', 'COPY') else 'OTHER'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append((context, time.perf_counter()))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if starts:
+        DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop()[1], _statement_type(statement))
+
+
+def _handle_error(exception_context):
+    # Drop start time of statement that raised, which after_cursor_execute is not called for.
+    # Errors raised before the statement was sent, e.g. when connecting, have no start time.
+    conn = exception_context.connection
+    starts = conn.info.get('query_start') if conn is not None else None
+    if starts and starts[-1][0] is exception_context.execution_context:
+        starts.pop()
+
+
+def instrument_engines() -> None:
+    """
+    Time statements of all engines with SQLAlchemy cursor events. Statements that raise are not counted.
+    """
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+
+
+def register_collector(name: str, documentation: str, labelnames: Iterable[str],
+                       collect: Callable[[], Dict[Tuple[str, ...], float]], metric_type: str = 'gauge') -> Collector:
+    """
+    Register metric collected when metrics are rendered.
+
+    :param name: Metric name.
+    :param documentation: Help text.
+    :param labelnames: Names of labels.
+    :param collect: Function returning dict of label values to value.
+    :param metric_type: 'gauge' or 'counter'.
+    :return: Collector object.
+    """
+    return registry.register(Collector(name, documentation, labelnames, collect, metric_type))
+
+
+if METRICS_DB_EVENTS:
+    instrument_engines()
@@ -1,10 +1,39 @@
-from db.database import SessionLocal
-from db import crud
-from db.schemas import EntityCreate
+import asyncio
+import hashlib
+import queue
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Iterator, List, Tuple
 
-import spacy
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 
-nlp = spacy.load('en_core_web_sm')
+from db.database import WriterSessionLocal
+from db import crud, models
+from db.schemas import EntityCreate, TaggedSentence
+from services.metrics_service import (NER_BATCH_DOCUMENTS, NER_CHARACTERS, NER_DOCUMENTS, NER_SENTENCES,
+                                      observe_stage)
+from config import (NLP_MODEL, NLP_PROFILE, NER_BATCH_SIZE, NER_N_PROCESS, NER_MAX_WAIT, NER_CHUNK_CHARS,
+                    NER_CHUNK_WINDOW)
+
+logger = logging.getLogger(__name__)
+
+# Pipeline components disabled per profile. The 'ner' profile only keeps the entity recognizer and
+# replaces the dependency parser with a rule-based sentencizer for doc.sents.
+PIPELINE_PROFILES = {
+    'full': {'disable': [], 'sentencizer': False},
+    'ner': {'disable': ['tagger', 'parser'], 'sentencizer': True},
+}
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+# End of sentence: terminal punctuation, optional closing quotes or brackets, then whitespace
+SENTENCE_END = re.compile(r'[.!?]["\')\]]*\s+')
 
 NAMED_ENTITY_LABELS = [
         'PERSON',
@@ -17,24 +46,251 @@ NAMED_ENTITY_LABELS = [
         'NORP'
     ]
 
-def extract_and_store_entities(req_id: int, text: str) -> None:
-    db = SessionLocal()
 
-    try:
-        docs = nlp(text)
-        sentences = list(docs.sents)
+def load_model(model: str = NLP_MODEL, profile: str = NLP_PROFILE):
+    """
+    Load spaCy model with components of pipeline profile.
+
+    :param model: Name or path of spaCy model.
+    :param profile: Key of PIPELINE_PROFILES.
+    :return: spaCy Language object.
+    """
+    import spacy
+
+    if profile not in PIPELINE_PROFILES:
+        raise ValueError(f"Unknown NLP profile '{profile}', expected one of {list(PIPELINE_PROFILES)}")
+    settings = PIPELINE_PROFILES[profile]
+
+    start_time = time.time()
+    nlp = spacy.load(model, disable=settings['disable'])
+    if settings['sentencizer'] and 'sentencizer' not in nlp.pipe_names:
+        nlp.add_pipe(nlp.create_pipe('sentencizer'), first=True)
+    logger.info(f"Loaded {model} with profile={profile} pipeline={nlp.pipe_names} "
+                f"in {(time.time() - start_time) * 1000:.2f}ms")
+    return nlp
+
+
+def get_nlp():
+    """
+    Get shared spaCy model, loading it on first use.
+
+    :return: spaCy Language object.
+    """
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                _nlp = load_model()
+    return _nlp
+
+
+def iter_text_chunks(text: str, max_chars: int = NER_CHUNK_CHARS) -> Iterator[Tuple[int, str]]:
+    """
+    Cut text into chunks of at most max_chars characters at sentence-safe boundaries.
+    Chunks end after the last sentence end in their window, or the last whitespace if there is none.
+
+    :param text: Document text.
+    :param max_chars: Max number of characters per chunk.
+    :return: Iterator of (offset of chunk in text, chunk text).
+    """
+    start = 0
+    while len(text) - start > max_chars:
+        window_end = start + max_chars
+        end = None
+        for match in SENTENCE_END.finditer(text, start + max_chars // 2, window_end):
+            end = match.end()
+        if end is None:
+            end = text.rfind(' ', start + 1, window_end) + 1 or window_end
+        yield start, text[start:end]
+        start = end
+    if start < len(text):
+        yield start, text[start:]
+
+
+def extract_sentence_entities(doc, offset: int = 0) -> List[TaggedSentence]:
+    """
+    Collects named entities of a tagged document by sentence.
+    Sentences without named entities of interest are dropped.
+
+    :param doc: spaCy Doc object.
+    :param offset: Offset of document in the text it was cut from.
+    :return: List of tagged sentences.
+    """
+    tagged = []
+    for sent in doc.sents:
+        sent_entities = {}
+        for ent in sent.ents:
+            if ent.label_ in NAMED_ENTITY_LABELS:
+                ent_text = ent.text.strip()
+                if ent_text not in sent_entities:
+                    sent_entities[ent_text] = EntityCreate(name=ent_text, ent_type=ent.label_)
+
+        if sent_entities:
+            tagged.append(TaggedSentence(text=sent.text, entities=list(sent_entities.values()),
+                                         start_char=offset + sent.start_char))
+    return tagged
+
 
-        for sent in sentences:
-            sent_entities = {}
-            for ent in sent.ents:
-                if ent.label_ in NAMED_ENTITY_LABELS:
-                    ent_text = ent.text.strip()
-                    if ent_text not in sent_entities:
-                        sent_entities[ent_text] = EntityCreate(name=ent_text, ent_type=ent.label_)
+class NerBatcher:
+    """
+    Collects pending documents submitted from many requests and tags them together using nlp.pipe.
+    A single daemon thread owns the spaCy model, so callers never share it across threads.
+    """
 
-            if sent_entities:
-                db_sent = crud.create_sentence(db, req_id=req_id, sentence=sent.text)
-                count = crud.create_entities(db, db_sent=db_sent, entities=list(sent_entities.values()))
+    def __init__(self, batch_size: int = NER_BATCH_SIZE, n_process: int = NER_N_PROCESS,
+                 max_wait: float = NER_MAX_WAIT):
+        """
+        :param batch_size: max number of documents to tag per nlp.pipe call.
+        :param n_process: number of processes used by nlp.pipe.
+        :param max_wait: seconds to wait for more documents before tagging a partial batch.
+        """
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
 
+    def submit(self, text: str, offset: int = 0) -> Future:
+        """
+        Queue document for tagging.
+
+        :param text: Document text.
+        :param offset: Offset of document in the text it was cut from.
+        :return: Future resolving to list of tagged sentences.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((text, offset, future))
+        return future
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ner-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._process(batch)
+
+    def _process(self, batch) -> None:
+        batch = [(text, offset, future) for text, offset, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        try:
+            with observe_stage('ner'):
+                docs = get_nlp().pipe([text for text, _, _ in batch], batch_size=self.batch_size,
+                                      n_process=self.n_process)
+                results = [extract_sentence_entities(doc, offset=offset) for (_, offset, _), doc in zip(batch, docs)]
+            NER_BATCH_DOCUMENTS.observe(len(batch))
+            NER_DOCUMENTS.inc(amount=len(batch))
+            NER_CHARACTERS.inc(amount=sum(len(text) for text, _, _ in batch))
+            NER_SENTENCES.inc(amount=sum(len(sentences) for sentences in results))
+            for (_, _, future), sentences in zip(batch, results):
+                future.set_result(sentences)
+        except Exception as e:
+            logger.exception(f"NER batch of {len(batch)} documents failed")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+
+ner_batcher = NerBatcher()
+
+
+def iter_tagged_chunks(text: str, max_chars: int = NER_CHUNK_CHARS,
+                       window: int = NER_CHUNK_WINDOW) -> Iterator[List[TaggedSentence]]:
+    """
+    Tag text chunk by chunk through the shared NER batcher, keeping at most window chunks in flight.
+
+    :param text: Document text.
+    :param max_chars: Max number of characters per chunk.
+    :param window: Max number of chunks queued for tagging at once.
+    :return: Iterator of tagged sentences of each chunk, in order of text.
+    """
+    pending = deque()
+    for offset, chunk in iter_text_chunks(text, max_chars=max_chars):
+        pending.append(ner_batcher.submit(chunk, offset=offset))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def extract_and_store_entities(req_id: int, text: str, renew_lease: Callable[[], None] = None) -> None:
+    """
+    Tags document through the shared NER batcher and stores sentences with named entities,
+    one chunk at a time so memory stays bounded for large documents.
+
+    :param req_id: ID of request the document belongs to.
+    :param text: Document text.
+    :param renew_lease: Function renewing the lease of the request, called after each chunk is stored,
+    when this session does not hold the writer connection.
+    """
+    db = WriterSessionLocal()
+    try:
+        for tagged_sentences in iter_tagged_chunks(text):
+            with observe_stage('persist'):
+                crud.create_tagged_sentences(db, req_id=req_id, sentences=tagged_sentences)
+            if renew_lease is not None:
+                # Commit also when the chunk had no sentences, releasing the writer connection
+                db.commit()
+                renew_lease()
     finally:
         db.close()
+
+
+async def tag_text_async(text: str, max_chars: int = NER_CHUNK_CHARS) -> List[TaggedSentence]:
+    """
+    Tag text through the shared NER batcher without blocking the event loop.
+
+    :param text: Document text.
+    :param max_chars: Max number of characters per chunk.
+    :return: List of tagged sentences.
+    """
+    futures = [asyncio.wrap_future(ner_batcher.submit(chunk, offset=offset))
+               for offset, chunk in iter_text_chunks(text, max_chars=max_chars)]
+    return [sent for chunk in await asyncio.gather(*futures) for sent in chunk]
+
+
+def store_tagged_text(db: Session, text: str, tagged_sentences: List[TaggedSentence]) -> int:
+    """
+    Store text tagged inline as a request with path "text:<sha256 of text>", so identical texts are stored once.
+
+    :param db: Session object, of the writer engine.
+    :param text: Document text.
+    :param tagged_sentences: Tagged sentences of text.
+    :return: ID of request of text.
+    """
+    path = crud.TEXT_PATH_PREFIX + hashlib.sha256(text.encode('utf-8')).hexdigest()
+    db_request = crud.get_request_by_path(db, path=path)
+    if db_request is None:
+        try:
+            # Added as processed and committed with its sentences, so it is never seen unprocessed
+            req_id = crud.add_processed_request(db, path=path, content_hash=models.text_fingerprint(text)).id
+        except IntegrityError:
+            # Same text stored concurrently
+            db.rollback()
+            return crud.get_request_by_path(db, path=path).id
+        with observe_stage('persist'):
+            crud.create_tagged_sentences(db, req_id=req_id, sentences=tagged_sentences)
+        db.commit()
+        return req_id
+    if db_request.status != models.Statuses.Success.name:
+        with observe_stage('persist'):
+            crud.delete_request_sentences(db, req_id=db_request.id)
+            crud.create_tagged_sentences(db, req_id=db_request.id, sentences=tagged_sentences)
+        crud.set_request_content_hash(db, db_request, models.text_fingerprint(text))
+        crud.update_request_status(db, models.Statuses.Success, db_request)
+    return db_request.id
@@ -0,0 +1,319 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from sqlalchemy.orm import Session
+
+from db.database import WriterSessionLocal
+from db import crud
+from services.fetch_service import FetchResult
+from services.scraper_service import process_claimed_request
+from config import (JOB_LEASE_SECONDS, SCHEDULER_MAX_CONCURRENCY, SCHEDULER_DOMAIN_RATE, SCHEDULER_DOMAIN_BURST,
+                    SCHEDULER_SCAN_LIMIT)
+
+logger = logging.getLogger(__name__)
+
+# Number of queued requests read per query when looking for a request to claim
+SCAN_PAGE_SIZE = 1000
+# Max seconds to sleep while all scheduled requests wait for tokens of their domain
+MAX_THROTTLE_SLEEP = 1.0
+# Number of token buckets kept before full buckets, i.e. of domains not requested lately, are dropped
+MIN_PRUNE_BUCKETS = 1024
+
+
+def domain_of(path: str) -> str:
+    """
+    Domain that requests of path are rate limited by.
+
+    :param path: URL of request.
+    :return: Lower-cased host name, or empty string if path has none.
+    """
+    try:
+        return urlsplit(path).hostname or ''
+    except ValueError:
+        return ''
+
+
+class TokenBucket:
+    """
+    Bucket of up to burst tokens, refilled at rate tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: int, now: float = None):
+        """
+        :param rate: Tokens added per second.
+        :param burst: Max number of tokens.
+        :param now: time.monotonic() of creation, when the bucket is full.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now if now is not None else time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, now: float) -> bool:
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self, now: float) -> float:
+        """
+        Seconds until a token is available.
+        """
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class DomainRateLimiter:
+    """
+    Token buckets by domain, so that requests of a large crawl of one host are spread out
+    and do not flood it. Full buckets are dropped, so memory is bounded by the domains requested lately.
+    """
+
+    def __init__(self, rate: float = SCHEDULER_DOMAIN_RATE, burst: int = SCHEDULER_DOMAIN_BURST):
+        """
+        :param rate: Requests per second to each domain, 0 to disable rate limiting.
+        :param burst: Requests to a domain allowed at once after it has been idle.
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._prune_at = MIN_PRUNE_BUCKETS
+        self._lock = threading.Lock()
+
+    def try_acquire(self, domain: str) -> bool:
+        """
+        Take a token of domain.
+
+        :param domain: Domain of request.
+        :return: True if the request may be sent now, False if the domain is out of tokens.
+        """
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(domain)
+            if bucket is None:
+                if len(self._buckets) >= self._prune_at:
+                    self._prune(now)
+                bucket = self._buckets[domain] = TokenBucket(self.rate, self.burst, now)
+            return bucket.try_take(now)
+
+    def wait_time(self, domains: Iterable[str]) -> float:
+        """
+        Seconds until a token of any of domains is available.
+
+        :param domains: Domains out of tokens.
+        :return: Seconds to wait.
+        """
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            return min((self._buckets[domain].wait_time(now) for domain in domains if domain in self._buckets),
+                       default=0.0)
+
+    def _prune(self, now: float) -> None:
+        self._buckets = {domain: bucket for domain, bucket in self._buckets.items() if not bucket.is_full(now)}
+        self._prune_at = max(MIN_PRUNE_BUCKETS, 2 * len(self._buckets))
+
+
+def claim_next_request(db: Session, limiter: DomainRateLimiter, scan_limit: int = SCHEDULER_SCAN_LIMIT,
+                       lease_seconds: int = JOB_LEASE_SECONDS) -> Optional[Tuple[int, datetime]]:
+    """
+    Claim queued request of highest priority, the oldest one of equal priority, whose domain has a token.
+    Requests of domains out of tokens are skipped and stay queued.
+
+    :param db: Session object.
+    :param limiter: Token buckets by domain.
+    :param scan_limit: Max number of queued requests looked at.
+    :param lease_seconds: Seconds before claim expires unless renewed.
+    :return: Tuple of (ID of claimed request, expiry of its lease), or None if no request is claimable.
+    """
+    throttled = set()
+    after, scanned = None, 0
+    while scanned < scan_limit:
+        candidates = crud.get_claimable_requests(db, limit=min(SCAN_PAGE_SIZE, scan_limit - scanned), after=after)
+        for req_id, path, priority in candidates:
+            domain = domain_of(path)
+            if domain in throttled:
+                continue
+            if not limiter.try_acquire(domain):
+                throttled.add(domain)
+                continue
+            lease = crud.claim_request(db, req_id=req_id, lease_seconds=lease_seconds)
+            if lease is not None:
+                return req_id, lease
+        if len(candidates) < SCAN_PAGE_SIZE:
+            break
+        scanned += len(candidates)
+        after = (candidates[-1].priority, candidates[-1].id)
+    return None
+
+
+class Scheduler:
+    """
+    Scheduler of requests submitted to this process in background mode. Requests are dispatched by
+    descending priority, then in order of submission, to a pool of max_concurrency threads that claim,
+    fetch and process one request each. A request is dispatched whenever a thread is free, so requests
+    submitted meanwhile with a higher priority go ahead of scheduled ones. Requests of domains out of tokens
+    wait until their domain has a token, so a large crawl of one domain neither floods it nor holds back
+    other requests.
+    """
+
+    def __init__(self, max_concurrency: int = SCHEDULER_MAX_CONCURRENCY, limiter: DomainRateLimiter = None):
+        """
+        :param max_concurrency: Max number of requests processed at once.
+        :param limiter: Token buckets by domain, a DomainRateLimiter with the configured rate if None.
+        """
+        self.max_concurrency = max(max_concurrency, 1)
+        self.limiter = limiter if limiter is not None else DomainRateLimiter()
+        # Heap of (-priority, request id, path)
+        self._queue: List[Tuple[int, int, str]] = []
+        self._pages: Dict[int, FetchResult] = {}
+        self._lock = threading.Lock()
+        self._dispatching = False
+        self._pending = False
+        self._executor = None
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Created on first use, so that processes forked before that do not share it
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='scheduler')
+            return self._executor
+
+    def submit(self, requests: Iterable[Tuple[int, str, int]], pages: Dict[int, FetchResult] = None) -> None:
+        """
+        Schedule queued requests.
+
+        :param requests: (id, path, priority) tuples of requests.
+        :param pages: web pages already fetched when requests were submitted, by request id.
+        """
+        with self._lock:
+            for req_id, path, priority in requests:
+                heapq.heappush(self._queue, (-priority, req_id, path))
+            self._pages.update(pages or {})
+            self._pending = True
+
+    def run(self, requests: Iterable[Tuple[int, str, int]] = (), pages: Dict[int, FetchResult] = None) -> None:
+        """
+        Schedule queued requests and process scheduled requests until none is left, e.g. as a background task.
+        Only one thread dispatches at a time: other threads schedule their requests and return at once.
+
+        :param requests: (id, path, priority) tuples of requests.
+        :param pages: web pages already fetched when requests were submitted, by request id.
+        """
+        self.submit(requests, pages)
+        with self._lock:
+            if self._dispatching:
+                return
+            self._dispatching = True
+        try:
+            while True:
+                with self._lock:
+                    # Checked under the lock, so requests submitted while this thread stops start a new dispatcher
+                    if not self._pending:
+                        self._dispatching = False
+                        return
+                    self._pending = False
+                self._drain()
+        except BaseException:
+            with self._lock:
+                self._dispatching = False
+            raise
+
+    def _drain(self) -> None:
+        """
+        Dispatch requests to the pool until no request is scheduled or in flight.
+        Requests queued again for retry are scheduled again.
+        """
+        executor = self._get_executor()
+        in_flight: Dict[Future, Tuple[int, str, int]] = {}
+        while True:
+            batch, throttled = self._next_requests(self.max_concurrency - len(in_flight))
+            for req_id, path, priority, page in batch:
+                in_flight[executor.submit(self._process, req_id, page)] = (req_id, path, priority)
+            if not in_flight:
+                if not throttled:
+                    return
+                time.sleep(min(self.limiter.wait_time(throttled), MAX_THROTTLE_SLEEP))
+                continue
+            # Wake up to dispatch requests submitted meanwhile, or whose domain has a token again, to free threads
+            timeout = MAX_THROTTLE_SLEEP if len(in_flight) < self.max_concurrency else None
+            if throttled:
+                timeout = min(self.limiter.wait_time(throttled), MAX_THROTTLE_SLEEP)
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            retries = []
+            for future in done:
+                request = in_flight.pop(future)
+                try:
+                    if not future.result():
+                        retries.append(request)
+                except Exception:
+                    logger.exception(f"Failed to process request {request[0]}.")
+            if retries:
+                self.submit(retries)
+                logger.info(f"Queued {len(retries)} requests for retry.")
+
+    @staticmethod
+    def _process(req_id: int, page: Optional[FetchResult]) -> bool:
+        """
+        Claim request, fetch its page unless it was already fetched, and process it.
+
+        :return: False if request was queued again for retry, True otherwise, e.g. if it is not claimable
+        because it was processed since it was scheduled.
+        """
+        db = WriterSessionLocal()
+        try:
+            lease = crud.claim_request(db, req_id=req_id, lease_seconds=JOB_LEASE_SECONDS)
+            if lease is None:
+                return True
+            return process_claimed_request(req_id, db=db, page=page, lease=lease)
+        finally:
+            db.close()
+
+    def _next_requests(self, limit: int) -> Tuple[List[Tuple[int, str, int, Optional[FetchResult]]], Set[str]]:
+        """
+        Pop up to limit requests, by priority, skipping requests of domains out of tokens.
+
+        :param limit: Max number of requests.
+        :return: Tuple of (list of (id, path, priority, page or None) of requests, domains out of tokens).
+        """
+        batch, skipped, throttled = [], [], set()
+        with self._lock:
+            while self._queue and len(batch) < limit:
+                entry = heapq.heappop(self._queue)
+                domain = domain_of(entry[2])
+                if domain in throttled or not self.limiter.try_acquire(domain):
+                    throttled.add(domain)
+                    skipped.append(entry)
+                    continue
+                batch.append((entry[1], entry[2], -entry[0], self._pages.pop(entry[1], None)))
+            for entry in skipped:
+                heapq.heappush(self._queue, entry)
+        return batch, throttled
+
+    def pending(self) -> int:
+        """
+        Number of scheduled requests waiting for a free thread.
+        """
+        with self._lock:
+            return len(self._queue)
+
+
+scheduler = Scheduler()
@@ -1,92 +1,178 @@
 import traceback
 import logging
-import requests
-from bs4 import BeautifulSoup
+from datetime import datetime
+from typing import Optional, Union
+from urllib.parse import unquote_plus, urlsplit, urlunsplit
 
-from db.models import Statuses
-from db.database import SessionLocal
+from sqlalchemy.orm import Session
+
+from db.database import WriterSessionLocal
 from db import crud, models
 from services.nlp_service import extract_and_store_entities
+from services.fetch_service import fetcher, FetchResult
+from services.extract_service import extract_text
+from services.metrics_service import observe_stage
+from config import JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS, VALIDATE_URL_TIMEOUT, URL_TRACKING_PARAMS
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
 
-BLACKLIST = [
-    '[document]',
-    'noscript',
-    'header',
-    'html',
-    'meta',
-    'head',
-    'input',
-    'script',
-    'style',
-    'link',
-    # 'a',
-]
+class LeaseLostError(Exception):
+    """
+    Request was claimed again by another worker, e.g. after its lease expired while it was processed.
+    """
 
 
 def check_valid_url(path: str) -> bool:
     """
-    Helper function to check if request path is a valid URL.
+    Helper function to check if request path is a syntactically valid http(s) URL.
+    Does not perform any network I/O, see probe_url.
 
     :param path: String path to check if is valid URL.
     :return bool: Returns True if path is valid URL, else False.
     """
     try:
-        requests.get(path)
-        return True
-    except requests.ConnectionError:
-        return False
-    except:
+        parts = urlsplit(path)
+        return (parts.scheme in ('http', 'https') and bool(parts.hostname)
+                and not any(c.isspace() for c in path) and parts.port != 0)
+    except ValueError:
         return False
 
 
-def get_web_text(req_id: int) -> None:
+def canonicalize_url(path: str) -> str:
+    """
+    Helper function to canonicalize URL, so that variants of the same page are stored as one request.
+    Lower-cases scheme and host, drops default ports, fragments and tracking query parameters,
+    and sorts the remaining query parameters. Parameters are kept as they are sent, without decoding
+    and encoding them again, so that e.g. "?a" and "?a=", or "%20" and "+", stay distinct.
+
+    :param path: Valid URL, see check_valid_url.
+    :return str: Canonical URL.
+    """
+    parts = urlsplit(path)
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname
+    if ':' in netloc:
+        netloc = f'[{netloc}]'
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = f'{netloc}:{parts.port}'
+    if parts.username is not None:
+        userinfo = parts.username + (f':{parts.password}' if parts.password is not None else '')
+        netloc = f'{userinfo}@{netloc}'
+    params = [param for param in parts.query.split('&')
+              if param and not _is_tracking_param(unquote_plus(param.split('=', 1)[0]))]
+    query = '&'.join(sorted(params, key=lambda param: param.partition('=')[::2]))
+    return urlunsplit((scheme, netloc, parts.path or '/', query, ''))
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return any(name.startswith(param[:-1]) if param.endswith('*') else name == param
+               for param in URL_TRACKING_PARAMS)
+
+
+async def probe_url(path: str) -> Optional[FetchResult]:
+    """
+    Helper function to check if URL is reachable without blocking the event loop.
+    Sends a HEAD request, or a GET request for servers that do not allow HEAD.
+
+    :param path: URL to check.
+    :return FetchResult: Fetched page if its body was downloaded, to be passed on to Scheduler.run, else None.
+    :raises FetchError: If URL is not reachable.
     """
-    Function that processes URL requests of pending statuses.
+    page = await fetcher.probe_async(path, timeout=VALIDATE_URL_TIMEOUT)
+    return page if page.content else None
+
 
-    :param req_id: Integer ID of request
+def process_claimed_request(req_id: int, db: Session = None,
+                            page: Union[FetchResult, Exception] = None, lease: datetime = None) -> bool:
+    """
+    Function that scrapes and extracts entities of URL request claimed for processing.
+    Failed requests are queued again until they run out of attempts, then set to Error.
+    The lease is renewed after the page is fetched and after each chunk of sentences is stored.
+    If the request was claimed again by another worker meanwhile, e.g. because its lease expired,
+    the attempt is abandoned and the request is left to the other worker.
+
+    :param req_id: Integer ID of claimed request
+    :param db: Session object, a new session is used if not provided
+    :param page: web page already fetched for request, or exception raised when fetching it
+    :param lease: expiry of the lease returned by crud.claim_request, read from the request if not provided
+    :return bool: True if request is done (Success or Error) or claimed by another worker,
+    False if it was queued again.
     """
-    db = SessionLocal()
+    own_session = db is None
+    if own_session:
+        db = WriterSessionLocal()
     db_request = crud.get_request(db, req_id=req_id)
-    try:
-        if db_request.status not in [Statuses.Queued.name, Statuses.Error.name]:
-            return
+    path, attempts = db_request.path, db_request.attempts
+    if lease is None:
+        lease = db_request.lease_expires
 
-        db_request = crud.update_request_status(db, models.Statuses.Processing, db_request)
+    def renew() -> None:
+        nonlocal lease
+        lease = crud.renew_lease(db, req_id=req_id, lease=lease, lease_seconds=JOB_LEASE_SECONDS)
+        if lease is None:
+            raise LeaseLostError(f"Request {req_id} was claimed by another worker")
 
-        document = _scrape_web_text_body(db_request.path)
+    try:
+        # Abandon the request before deleting its sentences, if another worker claimed it meanwhile
+        renew()
+        # Discard output of interrupted attempts so retries are idempotent
+        crud.delete_request_sentences(db, req_id=req_id)
+        # End the transaction, so that the writer connection and the SQLite write lock are not held while fetching
+        db.commit()
+
+        if isinstance(page, Exception):
+            raise page
+        document = _scrape_web_text_body(path, page=page)
+        renew()
 
         if document:
-            extract_and_store_entities(req_id=req_id, text=document)
+            content_hash = models.text_fingerprint(document)
+            duplicate = crud.get_request_by_content_hash(db, content_hash, exclude_id=req_id)
+            duplicate_id = duplicate.id if duplicate is not None else None
+            # Commits, so the session does not hold the writer connection while tagging
+            crud.set_request_content_hash(db, db_request, content_hash)
+            if duplicate_id is not None:
+                # Same text as an already processed page, e.g. a mirror or republished article
+                with observe_stage('persist'):
+                    linked = crud.link_request_sentences(db, req_id=req_id, source_req_id=duplicate_id)
+                logging.info(f"Request {req_id} has the content of request {duplicate_id}, "
+                             f"linked {linked} sentences without tagging")
+            else:
+                extract_and_store_entities(req_id=req_id, text=document, renew_lease=renew)
+
+        if not crud.release_request(db, req_id=req_id, lease=lease, status=models.Statuses.Success):
+            raise LeaseLostError(f"Request {req_id} was claimed by another worker")
+        return True
 
-        db_request = crud.update_request_status(db, models.Statuses.Success, db_request)
+    except LeaseLostError as e:
+        db.rollback()
+        logging.warning(f"{e}, abandoned attempt {attempts}")
+        return True
 
     except Exception as e:
         logging.error(traceback.format_exc())
-        crud.update_request_status(db, models.Statuses.Error, db_request)
+        db.rollback()
+        status = models.Statuses.Queued if attempts < JOB_MAX_ATTEMPTS else models.Statuses.Error
+        if not crud.release_request(db, req_id=req_id, lease=lease, status=status):
+            logging.warning(f"Request {req_id} was claimed by another worker, abandoned attempt {attempts}")
+            return True
+        return status != models.Statuses.Queued
     finally:
-        db.close()
+        if own_session:
+            db.close()
 
 
-def _scrape_web_text_body(url: str) -> str:
+def _scrape_web_text_body(url: str, page: FetchResult = None) -> str:
     """
-    Uses BeautifulSoup4 to scrap text body of web pages of URL.
+    Scrap text body of web pages of URL with the configured extraction backend.
 
     :param url: web page link
+    :param page: web page already fetched, fetched from url if not provided
     :return extracted document string
     """
-    res = requests.get(url)
-    html_page = res.content
-    soup = BeautifulSoup(html_page, 'html.parser')
-    text = soup.find_all(text=True)
-
-    document = ''
-
-    linebreaks = ['\n', ]
-
-    for t in text:
-        if t.parent.name not in BLACKLIST:
-            nt = t.strip()
-            if nt and nt not in linebreaks:
-                document += '{} '.format(nt)
-
-    return document
+    if page is None:
+        page = fetcher.fetch_sync(url)
+    with observe_stage('extract'):
+        return extract_text(page.content, encoding=page.charset)
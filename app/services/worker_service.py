@@ -0,0 +1,94 @@
+import logging
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from db.database import WriterSessionLocal, engine, writer_engine
+from services import nlp_service
+from services.scraper_service import process_claimed_request
+from services.scheduler_service import DomainRateLimiter, claim_next_request
+from services.cache_service import register_invalidation
+from config import WORKER_PROCESSES, WORKER_POLL_INTERVAL, JOB_LEASE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Token buckets by domain of requests claimed by this worker
+domain_limiter = DomainRateLimiter()
+
+
+def _init_worker_process() -> None:
+    """
+    Initializer of worker processes. Drops database connections inherited from the parent process,
+    invalidates cached responses of the entities linked by the process and loads the NLP model once per process.
+    """
+    engine.dispose()
+    writer_engine.dispose()
+    register_invalidation()
+    try:
+        nlp_service.get_nlp()
+    except Exception:
+        logger.exception("Failed to load NLP model in worker process.")
+
+
+def _claim_next() -> Optional[Tuple[int, datetime]]:
+    db = WriterSessionLocal()
+    try:
+        return claim_next_request(db, domain_limiter, lease_seconds=JOB_LEASE_SECONDS)
+    finally:
+        db.close()
+
+
+def _run_pool(processes: int, poll_interval: float) -> None:
+    """
+    Dispatch claimed requests to a process pool until the pool breaks, e.g. when a worker process dies.
+
+    :param processes: Number of worker processes.
+    :param poll_interval: Seconds to wait between polls when there is no claimable request.
+    """
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker_process) as pool:
+        in_flight = {}
+        while True:
+            while len(in_flight) < processes:
+                claimed = _claim_next()
+                if claimed is None:
+                    break
+                req_id, lease = claimed
+                logger.info(f"Claimed request {req_id}.")
+                in_flight[pool.submit(process_claimed_request, req_id, lease=lease)] = req_id
+
+            if not in_flight:
+                time.sleep(poll_interval)
+                continue
+
+            done, _ = wait(in_flight, timeout=poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                req_id = in_flight.pop(future)
+                try:
+                    finished = future.result()
+                    logger.info(f"Request {req_id} {'done' if finished else 'queued for retry'}.")
+                except BrokenProcessPool:
+                    logger.error(f"Worker process died on request {req_id}, it is retried once its lease expires.")
+                    raise
+                except Exception:
+                    logger.exception(f"Worker process failed on request {req_id}.")
+
+
+def run_worker(processes: int = WORKER_PROCESSES, poll_interval: float = WORKER_POLL_INTERVAL) -> None:
+    """
+    Pull queued requests from the requests table and process them on a pool of worker processes,
+    highest priority first, with token buckets by domain.
+    Requests are claimed with a lease, so requests of crashed workers are picked up again
+    once their lease expires.
+
+    :param processes: Number of worker processes.
+    :param poll_interval: Seconds to wait between polls when there is no claimable request.
+    """
+    logger.info(f"Starting NER worker with {processes} processes.")
+    register_invalidation()
+    while True:
+        try:
+            _run_pool(processes, poll_interval)
+        except BrokenProcessPool:
+            logger.info("Restarting worker process pool.")
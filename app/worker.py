@@ -0,0 +1,18 @@
+import logging
+import logging.config
+from os import path
+
+from db.database import engine
+from db import models, migrations
+from services.worker_service import run_worker
+
+# setup loggers
+log_file_path = path.join(path.dirname(path.abspath(__file__)), 'logging.conf')
+logging.config.fileConfig(log_file_path, disable_existing_loggers=False)
+
+# create database engine
+models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
+
+if __name__ == "__main__":
+    run_worker()
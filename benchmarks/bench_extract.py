@@ -0,0 +1,78 @@
+"""
+Benchmark comparing HTML text extraction backends over the saved HTML fixtures.
+
+Pages are enlarged by repeating the body of each fixture to compare backends on large pages.
+
+Usage:
+    python benchmarks/bench_extract.py --scale 1 10 50 --rounds 3
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'app'))
+
+from services.extract_service import BACKENDS  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+
+def load_fixtures():
+    """
+    Load HTML fixtures.
+
+    :return: dict of fixture name to page content.
+    """
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, '*.html'))):
+        with open(path, 'rb') as f:
+            fixtures[os.path.basename(path)] = f.read()
+    return fixtures
+
+
+def scale_page(html: bytes, scale: int) -> bytes:
+    """
+    Enlarge page by repeating content of its body element.
+
+    :param html: page content.
+    :param scale: number of times the body content is repeated.
+    :return: enlarged page content.
+    """
+    match = re.search(rb'<body[^>]*>(.*)</body>', html, re.S)
+    if not match or scale <= 1:
+        return html
+    return html[:match.start(1)] + match.group(1) * scale + html[match.end(1):]
+
+
+def best_time(fn, html: bytes, rounds: int) -> float:
+    best = float('inf')
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(html)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--backends', nargs='+', default=list(BACKENDS))
+    args = parser.parse_args()
+
+    print('{:<22} {:>6} {:>10}  {}'.format('fixture', 'scale', 'size (KB)',
+                                            '  '.join('{:>14}'.format(b + ' (ms)') for b in args.backends)))
+    for name, html in load_fixtures().items():
+        for scale in args.scale:
+            page = scale_page(html, scale)
+            timings = [best_time(BACKENDS[backend], page, args.rounds) * 1000 for backend in args.backends]
+            print('{:<22} {:>6} {:>10.0f}  {}'.format(name, scale, len(page) / 1024,
+                                                      '  '.join('{:>14.1f}'.format(t) for t in timings)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark comparing per-document NER tagging with batched nlp.pipe tagging.
+
+Usage:
+    python benchmarks/bench_ner.py --docs 200 --batch-size 32 --n-process 1
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'app'))
+
+from services.nlp_service import get_nlp, extract_sentence_entities  # noqa: E402
+
+SUBJECTS = ['Apple', 'Google', 'Barack Obama', 'The United Nations', 'Microsoft', 'Angela Merkel', 'Tesla']
+VERBS = ['announced', 'visited', 'criticised', 'acquired', 'praised', 'met with']
+OBJECTS = ['Singapore', 'the European Union', 'Amazon', 'Paris', 'the World Cup', 'Python', 'NASA']
+
+
+def make_documents(n_docs: int, n_sents: int, seed: int = 0):
+    """
+    Generate synthetic documents containing named entities.
+
+    :param n_docs: number of documents to generate.
+    :param n_sents: number of sentences per document.
+    :param seed: random seed.
+    :return: list of document strings.
+    """
+    rnd = random.Random(seed)
+    return [' '.join('{} {} {} on Monday.'.format(rnd.choice(SUBJECTS), rnd.choice(VERBS), rnd.choice(OBJECTS))
+                     for _ in range(n_sents))
+            for _ in range(n_docs)]
+
+
+def bench_single(nlp, texts):
+    start = time.perf_counter()
+    for text in texts:
+        extract_sentence_entities(nlp(text))
+    return time.perf_counter() - start
+
+
+def bench_pipe(nlp, texts, batch_size: int, n_process: int):
+    start = time.perf_counter()
+    for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+        extract_sentence_entities(doc)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=200)
+    parser.add_argument('--sentences', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--n-process', type=int, default=1)
+    args = parser.parse_args()
+
+    texts = make_documents(args.docs, args.sentences)
+    nlp = get_nlp()
+    # warm up model
+    nlp(texts[0])
+
+    single = bench_single(nlp, texts)
+    batched = bench_pipe(nlp, texts, args.batch_size, args.n_process)
+    print('single   : {:8.1f} docs/s'.format(len(texts) / single))
+    print('nlp.pipe : {:8.1f} docs/s (batch_size={}, n_process={})'.format(
+        len(texts) / batched, args.batch_size, args.n_process))
+    print('speedup  : {:8.2f}x'.format(single / batched))
+
+
+if __name__ == '__main__':
+    main()
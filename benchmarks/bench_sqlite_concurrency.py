@@ -0,0 +1,158 @@
+"""
+Benchmark of API read latency on SQLite while ingest jobs are writing.
+
+Reads (entity lookup and its sentences) are timed first on an idle database,
+then while writer threads store tagged sentences through the ingest writer session.
+Runs against a throwaway database in a temporary directory.
+
+Usage:
+    python benchmarks/bench_sqlite_concurrency.py --readers 4 --writers 2 --duration 5
+    python benchmarks/bench_sqlite_concurrency.py --journal-mode DELETE --synchronous FULL --no-serialize-writes
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'app')
+
+SUBJECTS = ['Apple', 'Google', 'Barack Obama', 'The United Nations', 'Microsoft', 'Angela Merkel', 'Tesla']
+OBJECTS = ['Singapore', 'the European Union', 'Amazon', 'Paris', 'the World Cup', 'Python', 'NASA']
+
+
+def make_batch(rnd, n_sents: int):
+    """
+    Generate tagged sentences of one chunk of a synthetic document.
+
+    :param rnd: Random object.
+    :param n_sents: number of sentences.
+    :return: list of TaggedSentence.
+    """
+    from db.schemas import EntityCreate, TaggedSentence
+
+    batch = []
+    for _ in range(n_sents):
+        subject, obj = rnd.choice(SUBJECTS), rnd.choice(OBJECTS)
+        batch.append(TaggedSentence(text=f'{subject} met {obj} on day {rnd.randrange(10 ** 6)}.',
+                                    entities=[EntityCreate(name=subject, ent_type='ORG'),
+                                              EntityCreate(name=obj, ent_type='GPE')]))
+    return batch
+
+
+def reader(stop: threading.Event, latencies: list, errors: list, seed: int):
+    from db import crud
+    from db.database import SessionLocal
+
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            db_entity = crud.get_entity_by_name(db, entity_name=rnd.choice(SUBJECTS))
+            crud.get_entity_sentences(db, db_entity, limit=50)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+
+def writer(stop: threading.Event, req_id: int, n_sents: int, written: list, errors: list, seed: int):
+    from db import crud
+    from db.database import WriterSessionLocal
+
+    rnd = random.Random(seed)
+    while not stop.is_set():
+        db = WriterSessionLocal()
+        try:
+            written.append(crud.create_tagged_sentences(db, req_id=req_id, sentences=make_batch(rnd, n_sents)))
+        except Exception as e:
+            db.rollback()
+            errors.append(e)
+        finally:
+            db.close()
+
+
+def run_phase(n_readers: int, n_writers: int, duration: float, req_id: int, n_sents: int):
+    """
+    Run reader and writer threads for duration seconds.
+
+    :return: tuple of (read latencies, read errors, sentences written, write errors).
+    """
+    stop = threading.Event()
+    latencies, read_errors, written, write_errors = [], [], [], []
+    threads = [threading.Thread(target=reader, args=(stop, latencies, read_errors, i)) for i in range(n_readers)]
+    threads += [threading.Thread(target=writer, args=(stop, req_id, n_sents, written, write_errors, 100 + i))
+                for i in range(n_writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return latencies, read_errors, sum(written), write_errors
+
+
+def report(name: str, duration: float, latencies: list, read_errors: list, written: int, write_errors: list):
+    reads = len(latencies)
+    latencies = sorted(latencies) or [0.0]
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print('{:<8} reads {:7.1f}/s  p50 {:7.2f}ms  p99 {:7.2f}ms  max {:7.2f}ms  read errors {:4d}  '
+          'writes {:7.1f} sentences/s  write errors {:4d}'.format(
+              name, reads / duration, statistics.median(latencies) * 1000, p99 * 1000,
+              latencies[-1] * 1000, len(read_errors), written / duration, len(write_errors)))
+    for e in (read_errors + write_errors)[:1]:
+        print('  first error: {!r}'.format(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--sentences', type=int, default=200, help='sentences stored per write transaction')
+    parser.add_argument('--seed-sentences', type=int, default=20000)
+    parser.add_argument('--journal-mode', default=None)
+    parser.add_argument('--synchronous', default=None)
+    parser.add_argument('--no-serialize-writes', action='store_true')
+    args = parser.parse_args()
+
+    # Settings are read when the app modules are imported
+    if args.journal_mode:
+        os.environ['SQLITE_JOURNAL_MODE'] = args.journal_mode
+    if args.synchronous:
+        os.environ['SQLITE_SYNCHRONOUS'] = args.synchronous
+    if args.no_serialize_writes:
+        os.environ['SQLITE_SERIALIZE_WRITES'] = 'false'
+    sys.path.insert(0, APP_DIR)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        from db import crud, migrations, models
+        from db.database import SessionLocal, engine, sqlite_pragmas
+        from db.schemas import RequestCreate
+
+        models.Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+        db = SessionLocal()
+        try:
+            req_id = crud.create_request(db, RequestCreate(path='https://example.com/bench')).id
+            rnd = random.Random(0)
+            for _ in range(0, args.seed_sentences, 1000):
+                crud.create_tagged_sentences(db, req_id=req_id, sentences=make_batch(rnd, 1000))
+        finally:
+            db.close()
+
+        print('pragmas: {}, serialized writes: {}'.format(sqlite_pragmas(), not args.no_serialize_writes))
+        report('idle', args.duration, *run_phase(args.readers, 0, args.duration, req_id, args.sentences))
+        report('ingest', args.duration,
+               *run_phase(args.readers, args.writers, args.duration, req_id, args.sentences))
+        engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,467 @@
+"""
+Offline benchmark suite of the API and ingest hot paths, with machine-readable results.
+
+Runs against a throwaway SQLite database in a temporary directory, or the database of --database-url,
+seeded with a synthetic corpus of requests, sentences and entities. Web pages are served by a local
+fixture server, so no network access is needed and runs with the same arguments are comparable.
+
+Sections:
+    ingest     documents/s of fetching, extracting, tagging and storing generated pages, with seconds per stage
+    entities   cost of crud.create_entities and crud.create_tagged_sentences as the entity table grows
+    endpoints  p50/p99 latency and throughput of read endpoints under concurrent clients
+
+Usage:
+    python benchmarks/bench_suite.py --scale 20000 --output before.json
+    python benchmarks/bench_suite.py --scale 20000 --output after.json --compare before.json
+    python benchmarks/bench_suite.py --sections endpoints --clients 16 --database-url postgresql://localhost/bench
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, 'app')
+FIXTURES_DIR = os.path.join(ROOT_DIR, 'benchmarks', 'fixtures')
+
+SECTIONS = ('ingest', 'entities', 'endpoints')
+ENT_TYPES = ['ORG', 'PERSON', 'GPE']
+SUBJECTS = ['Apple', 'Google', 'Barack Obama', 'The United Nations', 'Microsoft', 'Angela Merkel', 'Tesla']
+VERBS = ['announced', 'visited', 'criticised', 'acquired', 'praised', 'met with']
+OBJECTS = ['Singapore', 'the European Union', 'Amazon', 'Paris', 'the World Cup', 'Python', 'NASA']
+
+
+def log(message: str) -> None:
+    print(message, file=sys.stderr, flush=True)
+
+
+def entity_name(i: int) -> str:
+    return f'Entity {i:07d}'
+
+
+def make_tagged_sentences(rnd, start: int, n_sents: int, n_entities: int):
+    """
+    Generate tagged sentences mentioning entities of the synthetic corpus.
+
+    :param rnd: Random object.
+    :param start: number of the first sentence, sentence texts are unique.
+    :param n_sents: number of sentences.
+    :param n_entities: number of distinct entities mentioned.
+    :return: list of TaggedSentence.
+    """
+    from db.schemas import EntityCreate, TaggedSentence
+
+    batch = []
+    for i in range(start, start + n_sents):
+        ids = rnd.sample(range(n_entities), 2)
+        batch.append(TaggedSentence(
+            text=f'Corpus sentence {i} mentions {entity_name(ids[0])} and {entity_name(ids[1])}.',
+            entities=[EntityCreate(name=entity_name(ent_id), ent_type=ENT_TYPES[ent_id % len(ENT_TYPES)])
+                      for ent_id in ids]))
+    return batch
+
+
+def make_page(doc_id: int, n_sents: int) -> bytes:
+    """
+    Generate HTML page of a document with named entities, the same for the same doc_id.
+
+    :param doc_id: number of document.
+    :param n_sents: number of sentences.
+    :return: HTML bytes.
+    """
+    rnd = random.Random(doc_id)
+    sentences = ' '.join(f'{rnd.choice(SUBJECTS)} {rnd.choice(VERBS)} {rnd.choice(OBJECTS)} '
+                         f'in report {doc_id}-{i}.' for i in range(n_sents))
+    return (f'<html><head><title>Document {doc_id}</title><script>var x = {doc_id};</script></head>'
+            f'<body><nav>Home | News</nav><article><h1>Document {doc_id}</h1><p>{sentences}</p></article>'
+            f'<footer>Copyright</footer></body></html>').encode('utf-8')
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    Serves generated pages on /doc/<id>.html and the HTML fixtures of benchmarks/fixtures on /fixtures/<name>.
+    """
+    doc_sentences = 40
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        body = None
+        if path.startswith('/doc/') and path.endswith('.html'):
+            try:
+                body = make_page(int(path[len('/doc/'):-len('.html')]), self.doc_sentences)
+            except ValueError:
+                pass
+        elif path.startswith('/fixtures/'):
+            fixture = os.path.join(FIXTURES_DIR, os.path.basename(path))
+            if os.path.isfile(fixture):
+                with open(fixture, 'rb') as f:
+                    body = f.read()
+        if body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fixture_server(doc_sentences: int):
+    FixtureHandler.doc_sentences = doc_sentences
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def percentiles(latencies: list) -> dict:
+    """
+    Summarize latencies in seconds.
+
+    :return: dict of count and p50, p90, p99, max and mean in milliseconds.
+    """
+    if not latencies:
+        return {'count': 0}
+    latencies = sorted(latencies)
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {'count': len(latencies), 'p50_ms': pct(0.5), 'p90_ms': pct(0.9), 'p99_ms': pct(0.99),
+            'max_ms': round(latencies[-1] * 1000, 3), 'mean_ms': round(statistics.mean(latencies) * 1000, 3)}
+
+
+def seed_corpus(n_requests: int, n_sentences: int, n_entities: int, seed: int) -> list:
+    """
+    Seed processed requests with sentences and entities.
+
+    :return: list of IDs of seeded requests.
+    """
+    from db import crud, models
+    from db.database import WriterSessionLocal
+
+    rnd = random.Random(seed)
+    db = WriterSessionLocal()
+    try:
+        paths = [f'https://corpus.example/{i}' for i in range(n_requests)]
+        submitted = crud.submit_requests(db, paths)
+        req_ids = [submitted[path][0] for path in paths]
+        crud.update_requests_status(db, [models.Statuses.Queued], models.Statuses.Success)
+        for n, start in enumerate(range(0, n_sentences, 1000)):
+            crud.create_tagged_sentences(db, req_id=req_ids[n % len(req_ids)], sentences=make_tagged_sentences(
+                rnd, start, min(1000, n_sentences - start), n_entities))
+    finally:
+        db.close()
+    return req_ids
+
+
+def bench_ingest(base_url: str, n_docs: int) -> dict:
+    """
+    Ingest generated pages through scheduler_service.Scheduler.run, as background mode does for a batch.
+    Rate limiting by domain is disabled, since all pages are served by the local fixture server.
+    """
+    from db import crud, models
+    from db.database import SessionLocal, WriterSessionLocal
+    from services import nlp_service
+    from services.scheduler_service import DomainRateLimiter, Scheduler
+    from services.metrics_service import STAGE_SECONDS
+
+    # Load the model outside of the timed section
+    nlp_service.get_nlp()
+    db = WriterSessionLocal()
+    try:
+        paths = [f'{base_url}/doc/{i}.html' for i in range(n_docs)]
+        submitted = crud.submit_requests(db, paths)
+        req_ids = [submitted[path][0] for path in paths]
+        requests = [(req_id, path, 0) for req_id, path in zip(req_ids, paths)]
+    finally:
+        db.close()
+
+    stages = ('fetch', 'extract', 'ner', 'persist')
+    before = {stage: STAGE_SECONDS.total(stage) for stage in stages}
+    start = time.perf_counter()
+    Scheduler(limiter=DomainRateLimiter(rate=0)).run(requests)
+    elapsed = time.perf_counter() - start
+
+    db = SessionLocal()
+    try:
+        succeeded = sum(crud.get_request(db, req_id=req_id).status == models.Statuses.Success.name
+                        for req_id in req_ids)
+    finally:
+        db.close()
+    return {'docs': n_docs, 'succeeded': succeeded, 'seconds': round(elapsed, 3),
+            'docs_per_sec': round(n_docs / elapsed, 2),
+            # Stages of concurrent fetches overlap, so stage seconds may add up to more than seconds
+            'stage_seconds': {stage: round(STAGE_SECONDS.total(stage) - before[stage], 3) for stage in stages}}
+
+
+def bench_entity_writes(sizes: list, n_ops: int, req_id: int, n_entities: int, seed: int) -> list:
+    """
+    Time entity writes as the entity table grows to each size, mentioning two existing entities and a new one
+    per sentence. Entity name caches are cleared for every size, so lookups hit the database.
+    """
+    from db import crud, models
+    from db.database import WriterSessionLocal
+    from db.schemas import EntityCreate, TaggedSentence
+
+    rnd = random.Random(seed)
+    existing = [entity_name(i) for i in range(n_entities)]
+    results = []
+    db = WriterSessionLocal()
+    try:
+        for size in sorted(sizes):
+            count = db.query(models.Entity).count()
+            fillers = [f'Filler {i:08d}' for i in range(count, size)]
+            for start in range(0, len(fillers), 5000):
+                db.execute(models.Entity.__table__.insert(), [
+                    {'name': name, 'ent_type': 'ORG', 'name_norm': models.normalize_entity_name(name)}
+                    for name in fillers[start:start + 5000]])
+            db.commit()
+            existing += fillers
+            crud.entity_id_cache.clear()
+            crud.entity_norm_cache.clear()
+
+            def mention(i, kind):
+                return [EntityCreate(name=name, ent_type='ORG')
+                        for name in rnd.sample(existing, 2) + [f'{kind} {size} {i}']]
+
+            # One query per entity, and sentences of existing entities are loaded to check links
+            latencies = []
+            for i in range(n_ops):
+                db_sent = crud.create_sentence(db, req_id=req_id, sentence=f'Legacy write {size} {i}.')
+                entities = mention(i, 'Legacy')
+                start = time.perf_counter()
+                crud.create_entities(db, db_sent, entities)
+                latencies.append(time.perf_counter() - start)
+
+            # Ingest path, one batch of tagged sentences
+            batch = [TaggedSentence(text=f'Batch write {size} {i}.', entities=mention(i, 'Batch'))
+                     for i in range(n_ops)]
+            start = time.perf_counter()
+            crud.create_tagged_sentences(db, req_id=req_id, sentences=batch)
+            batch_seconds = time.perf_counter() - start
+
+            result = {'entities': db.query(models.Entity).count(), 'create_entities': percentiles(latencies),
+                      'create_tagged_sentences_ms_per_sentence': round(batch_seconds * 1000 / n_ops, 4)}
+            results.append(result)
+            log(f"entities={result['entities']} create_entities p50={result['create_entities']['p50_ms']}ms "
+                f"create_tagged_sentences={result['create_tagged_sentences_ms_per_sentence']}ms/sentence")
+    finally:
+        db.close()
+    return results
+
+
+def start_api_server():
+    """
+    Serve the webservice with uvicorn on a free local port, in a daemon thread.
+
+    :return: base URL.
+    """
+    import logging
+    import uvicorn
+    import main
+
+    # Request logging of the middleware would dominate the measured latency
+    logging.getLogger().setLevel(logging.WARNING)
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(main.app, host='127.0.0.1', port=port, log_level='warning',
+                                           access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 60
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError('API server did not start')
+        time.sleep(0.05)
+    return f'http://127.0.0.1:{port}'
+
+
+def bench_endpoints(base_url: str, n_clients: int, n_requests: int, n_entities: int, req_ids: list,
+                    seed: int) -> dict:
+    """
+    Time read endpoints, each with n_clients concurrent clients sending n_requests requests each.
+    """
+    import requests
+
+    endpoints = {
+        'GET /entities': lambda rnd: ('GET', '/v1_0/entities', {'skip': rnd.randrange(n_entities), 'limit': 100},
+                                      None),
+        'GET /requests (summary)': lambda rnd: ('GET', '/v1_0/requests/', {'skip': rnd.randrange(len(req_ids)),
+                                                                           'limit': 100, 'summary': True}, None),
+        'GET /requests (sentences)': lambda rnd: ('GET', '/v1_0/requests/', {'skip': rnd.randrange(len(req_ids)),
+                                                                             'limit': 10}, None),
+        'GET /requests/{id}/sentences': lambda rnd: ('GET', f'/v1_0/requests/{rnd.choice(req_ids)}/sentences',
+                                                     {'limit': 100}, None),
+        'POST /sentences': lambda rnd: ('POST', '/v1_0/sentences', {'limit': 100},
+                                        {'entity_name': entity_name(rnd.randrange(n_entities))}),
+    }
+    results = {}
+    for name, make_request in endpoints.items():
+        latencies, errors = [], []
+
+        def client(client_id):
+            rnd = random.Random(seed * 1000 + client_id)
+            with requests.Session() as session:
+                for i in range(n_requests + 2):
+                    method, path, params, body = make_request(rnd)
+                    start = time.perf_counter()
+                    try:
+                        response = session.request(method, base_url + path, params=params, json=body)
+                        elapsed = time.perf_counter() - start
+                        if response.status_code >= 400:
+                            errors.append(response.status_code)
+                        elif i >= 2:  # warm-up requests
+                            latencies.append(elapsed)
+                    except requests.RequestException as e:
+                        errors.append(repr(e))
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(n_clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results[name] = dict(percentiles(latencies), errors=len(errors),
+                             requests_per_sec=round((len(latencies) + len(errors)) / elapsed, 2))
+        log(f"{name}: p50={results[name].get('p50_ms')}ms p99={results[name].get('p99_ms')}ms "
+            f"{results[name]['requests_per_sec']} req/s errors={len(errors)}")
+    return results
+
+
+def flatten(results, prefix: str = '') -> dict:
+    """
+    Flatten nested results to dotted keys of numeric values.
+    """
+    flat = {}
+    if isinstance(results, dict):
+        items = results.items()
+    elif isinstance(results, list):
+        items = ((str(i), value) for i, value in enumerate(results))
+    else:
+        return {prefix: results} if isinstance(results, (int, float)) and not isinstance(results, bool) else {}
+    for key, value in items:
+        flat.update(flatten(value, f'{prefix}.{key}' if prefix else key))
+    return flat
+
+
+def compare(baseline: dict, current: dict) -> None:
+    """
+    Print relative change of every numeric result of current to baseline results.
+    """
+    before, after = flatten(baseline['results']), flatten(current['results'])
+    width = max((len(key) for key in after), default=10)
+    print('{:<{w}} {:>12} {:>12} {:>9}'.format('metric', 'baseline', 'current', 'change', w=width))
+    for key, value in after.items():
+        if key not in before:
+            continue
+        change = (value - before[key]) / before[key] * 100 if before[key] else float('nan')
+        print('{:<{w}} {:>12.4g} {:>12.4g} {:>+8.1f}%'.format(key, before[key], value, change, w=width))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', default=','.join(SECTIONS), help='comma separated sections to run')
+    parser.add_argument('--scale', type=int, default=20000, help='sentences of the seeded corpus')
+    parser.add_argument('--entities', type=int, default=None, help='distinct entities of corpus, scale / 4 by default')
+    parser.add_argument('--requests', type=int, default=None, help='requests of corpus, scale / 50 by default')
+    parser.add_argument('--docs', type=int, default=50, help='pages ingested')
+    parser.add_argument('--doc-sentences', type=int, default=40, help='sentences per ingested page')
+    parser.add_argument('--entity-sizes', default='1000,10000,50000', help='entity table sizes of entity writes')
+    parser.add_argument('--entity-ops', type=int, default=200, help='timed writes per entity table size')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--client-requests', type=int, default=50, help='requests per client and endpoint')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url', default=None, help='database to run against, must be empty')
+    parser.add_argument('--no-response-cache', action='store_true')
+    parser.add_argument('--output', default=None, help='JSON file to write results to, stdout by default')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    sections = [section.strip() for section in args.sections.split(',') if section.strip()]
+    unknown = set(sections) - set(SECTIONS)
+    if unknown:
+        parser.error(f'unknown sections {sorted(unknown)}, expected some of {list(SECTIONS)}')
+    n_entities = args.entities or max(args.scale // 4, 10)
+    # Paths are relative to the working directory, which is changed to the temporary directory below
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    n_requests = args.requests or max(args.scale // 50, 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Settings are read when the app modules are imported
+        os.environ['DATABASE_URL'] = args.database_url or f'sqlite:///{os.path.join(tmp_dir, "bench.db")}'
+        os.environ['INGEST_MODE'] = 'worker'
+        os.environ['NLP_WARM_ON_STARTUP'] = 'false'
+        if args.no_response_cache:
+            os.environ['RESPONSE_CACHE_BACKEND'] = 'none'
+        os.chdir(tmp_dir)
+        sys.path.insert(0, APP_DIR)
+        from db import migrations, models
+        from db.database import engine
+
+        models.Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+
+        report = {
+            'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'commit': git_commit(),
+                     'python': platform.python_version(), 'platform': platform.platform(),
+                     'database': engine.dialect.name, 'args': vars(args)},
+            'results': {},
+        }
+        start = time.perf_counter()
+        req_ids = seed_corpus(n_requests, args.scale, n_entities, args.seed)
+        report['results']['seed'] = {'requests': n_requests, 'sentences': args.scale, 'entities': n_entities,
+                                     'seconds': round(time.perf_counter() - start, 3)}
+        log(f"seeded {args.scale} sentences in {report['results']['seed']['seconds']}s")
+
+        if 'endpoints' in sections:
+            base_url = start_api_server()
+            report['results']['endpoints'] = bench_endpoints(base_url, args.clients, args.client_requests,
+                                                             n_entities, req_ids, args.seed)
+        if 'ingest' in sections:
+            server, base_url = start_fixture_server(args.doc_sentences)
+            try:
+                report['results']['ingest'] = bench_ingest(base_url, args.docs)
+            finally:
+                server.shutdown()
+            log(f"ingest: {report['results']['ingest']['docs_per_sec']} docs/s")
+        if 'entities' in sections:
+            sizes = [int(size) for size in args.entity_sizes.split(',') if size.strip()]
+            report['results']['entities'] = bench_entity_writes(sizes, args.entity_ops, req_ids[0], n_entities,
+                                                                args.seed)
+
+        engine.dispose()
+
+    if output:
+        with open(output, 'w') as f:
+            f.write(json.dumps(report, indent=2) + '\n')
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline:
+        with open(baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,62 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
 import pytest
 from starlette.testclient import TestClient
 
 from app.main import app
 
+STUB_PAGES = {
+    '/page.html': ('text/html; charset=utf-8',
+                   b'<html><head><title>Stub</title></head><body><p>Barack Obama visited Singapore.</p></body></html>'),
+    '/image.png': ('image/png', b'\x89PNG\r\n'),
+    '/large.html': ('text/html', b'<p>' + b'a' * 1024 * 1024 + b'</p>'),
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves STUB_PAGES, ignoring query strings, and a page that responds after a delay on /slow.html.
+    """
+
+    def _respond(self, with_body: bool):
+        path = self.path.split('?', 1)[0]
+        if path == '/slow.html':
+            time.sleep(2)
+            content_type, body = STUB_PAGES['/page.html']
+        elif path in STUB_PAGES:
+            content_type, body = STUB_PAGES[path]
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self._respond(with_body=True)
+
+    def do_HEAD(self):
+        self._respond(with_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
 
 @pytest.fixture(scope="module")
 def test_app():
     client = TestClient(app)
-    yield client
\ No newline at end of file
+    yield client
+
+
+@pytest.fixture(scope="session")
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
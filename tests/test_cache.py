@@ -0,0 +1,98 @@
+import json
+import sys
+import time
+import uuid
+
+from app.db import crud, schemas
+from app.db.database import SessionLocal
+from app.services import worker_service
+from app.services.cache_service import CachedResponse, MemoryBackend
+from app.services.fetch_service import FetchResult
+
+VER = 'v1_0'
+
+
+def _cache_misses(test_app):
+    return test_app.get(f"{VER}/metrics/cache").json()['misses']
+
+
+def _persist_obama_sentence(test_app):
+    text = f'Barack Obama visited Singapore on day {uuid.uuid4().hex}.'
+    assert test_app.post(f"{VER}/ner", data=json.dumps({'text': text, 'persist': True})).status_code == 200
+    return test_app.get(f"{VER}/search/entities", params={'prefix': 'barack obama'}).json()[0]['id']
+
+
+def test_entity_sentences_etag(test_app):
+    entity_id = _persist_obama_sentence(test_app)
+    response = test_app.get(f"{VER}/entities/{entity_id}/sentences")
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+
+    response = test_app.get(f"{VER}/entities/{entity_id}/sentences", headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+
+    response = test_app.get(f"{VER}/entities/{entity_id}/sentences", headers={'If-None-Match': '"stale"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == etag
+
+
+def test_entity_sentences_invalidated(test_app):
+    entity_id = _persist_obama_sentence(test_app)
+    test_app.get(f"{VER}/entities/{entity_id}/sentences")
+    misses = _cache_misses(test_app)
+    test_app.get(f"{VER}/entities/{entity_id}/sentences")
+    assert _cache_misses(test_app) == misses
+
+    # Linking a new sentence to the entity invalidates its cached responses
+    _persist_obama_sentence(test_app)
+    test_app.get(f"{VER}/entities/{entity_id}/sentences")
+    assert _cache_misses(test_app) == misses + 1
+
+
+def test_entity_not_cached_when_missing(test_app):
+    assert test_app.get(f"{VER}/entities/999999999999999999").status_code == 404
+    assert test_app.get(f"{VER}/entities/999999999999999999").status_code == 404
+
+
+def test_memory_backend_tags_and_ttl():
+    backend = MemoryBackend(maxsize=2)
+    value = CachedResponse(body=b'[]', etag='"x"', headers={}, tag_versions=backend.get_tag_versions(['entity:1']))
+    backend.set('a', value, ttl=60)
+    assert backend.lookup('a', ['entity:1']) == value
+
+    backend.invalidate_tags(['entity:2'])
+    assert backend.lookup('a', ['entity:1']) == value
+    backend.invalidate_tags(['entity:1'])
+    assert backend.lookup('a', ['entity:1']) is None
+
+    backend.set('b', value._replace(tag_versions=()), ttl=0.01)
+    time.sleep(0.02)
+    assert backend.lookup('b', []) is None
+
+
+def test_entity_invalidated_by_worker(test_app, monkeypatch):
+    entity_id = _persist_obama_sentence(test_app)
+    test_app.get(f"{VER}/entities/{entity_id}")
+    misses = _cache_misses(test_app)
+    test_app.get(f"{VER}/entities/{entity_id}")
+    assert _cache_misses(test_app) == misses
+
+    # Worker processes register invalidation at startup, without importing the API routers
+    monkeypatch.setattr(sys.modules['db.crud'], 'entity_link_listeners', [])
+    worker_service._init_worker_process()
+
+    db = SessionLocal()
+    try:
+        token = uuid.uuid4().hex
+        db_request = crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}"))
+        req_id = db_request.id
+        assert crud.claim_request(db, req_id=req_id, lease_seconds=60)
+    finally:
+        db.close()
+    page = FetchResult(url=f"https://example.com/{token}", status_code=200, content_type='text/html',
+                       content=f'<p>Barack Obama spoke in Paris on day {token}.</p>'.encode())
+    assert worker_service.process_claimed_request(req_id, page=page)
+
+    test_app.get(f"{VER}/entities/{entity_id}")
+    assert _cache_misses(test_app) == misses + 1
@@ -0,0 +1,167 @@
+import uuid
+
+from sqlalchemy import event
+
+from app.db import crud, models, schemas
+from app.db.database import SessionLocal, engine
+
+
+class QueryCounter:
+    """
+    Counts SQL statements executed on engine within context.
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.count = 0
+
+    def _count(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.bind, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *args):
+        event.remove(self.bind, 'before_cursor_execute', self._count)
+
+
+def _create_request(db):
+    return crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{uuid.uuid4()}"))
+
+
+def _tagged(text, *entities):
+    return schemas.TaggedSentence(text=text, entities=[schemas.EntityCreate(name=name, ent_type=ent_type)
+                                                       for name, ent_type in entities])
+
+
+def test_create_tagged_sentences():
+    db = SessionLocal()
+    try:
+        db_request = _create_request(db)
+        new_entity = f"Entity {uuid.uuid4()}"
+        sentences = [
+            _tagged(f"{new_entity} visited Singapore.", (new_entity, 'PERSON'), ('Singapore', 'GPE')),
+            _tagged(f"Singapore is in Asia, {new_entity} said.", ('Singapore', 'GPE'), ('Singapore', 'GPE')),
+        ]
+        assert crud.create_tagged_sentences(db, req_id=db_request.id, sentences=sentences) == 2
+
+        db_sents = crud.get_request_sentences(db, req_id=db_request.id)
+        assert [sent.text for sent in db_sents] == [sent.text for sent in sentences]
+        assert sorted(entity.name for entity in db_sents[0].entities) == sorted([new_entity, 'Singapore'])
+        assert [entity.name for entity in db_sents[1].entities] == ['Singapore']
+    finally:
+        db.close()
+
+
+def test_create_tagged_sentences_empty():
+    db = SessionLocal()
+    try:
+        db_request = _create_request(db)
+        assert crud.create_tagged_sentences(db, req_id=db_request.id, sentences=[]) == 0
+    finally:
+        db.close()
+
+
+def test_create_tagged_sentences_dedup():
+    db = SessionLocal()
+    try:
+        text = f"Entity {uuid.uuid4()} visited Singapore."
+        first, second = _create_request(db), _create_request(db)
+        assert crud.create_tagged_sentences(db, req_id=first.id, sentences=[_tagged(text, ('Singapore', 'GPE'))]) == 1
+        assert crud.create_tagged_sentences(db, req_id=second.id, sentences=[
+            _tagged(text, ('Singapore', 'GPE')), _tagged(f"  {text} ", ('Singapore', 'GPE'))]) == 1
+
+        first_sents = crud.get_request_sentences(db, req_id=first.id)
+        second_sents = crud.get_request_sentences(db, req_id=second.id)
+        assert [sent.id for sent in first_sents] == [sent.id for sent in second_sents]
+        assert [entity.name for entity in second_sents[0].entities] == ['Singapore']
+
+        # Shared sentences are only deleted with the last request linked to them
+        sent_id = second_sents[0].id
+        assert crud.delete_request_sentences(db, req_id=first.id) == 1
+        assert crud.get_sentence(db, sent_id=sent_id) is not None
+        assert crud.delete_request_sentences(db, req_id=second.id) == 1
+        assert crud.get_sentence(db, sent_id=sent_id) is None
+    finally:
+        db.close()
+
+
+def test_create_sentences_bulk():
+    db = SessionLocal()
+    try:
+        counts = []
+        for n in (2, 20):
+            db_request = _create_request(db)
+            sentences = [schemas.SentenceCreate(text=f"Sentence {i} {uuid.uuid4()}.") for i in range(n)]
+            with QueryCounter(engine) as counter:
+                assert crud.create_sentences(db, req_id=db_request.id, sentences=sentences) == n
+            counts.append(counter.count)
+            assert [sent.text for sent in crud.get_request_sentences(db, req_id=db_request.id)] == \
+                [sent.text for sent in sentences]
+        # Statements do not grow with the number of sentences
+        assert counts[0] == counts[1]
+    finally:
+        db.close()
+
+
+def test_link_request_sentences():
+    db = SessionLocal()
+    try:
+        source, mirror = _create_request(db), _create_request(db)
+        crud.create_tagged_sentences(db, req_id=source.id, sentences=[
+            _tagged(f"Sentence {uuid.uuid4()}.", ('Singapore', 'GPE')),
+            _tagged(f"Sentence {uuid.uuid4()}.", ('Singapore', 'GPE'))])
+        crud.update_request_status(db, models.Statuses.Success, source)
+        content_hash = models.text_fingerprint(str(uuid.uuid4()))
+        crud.set_request_content_hash(db, source, content_hash)
+
+        assert crud.get_request_by_content_hash(db, content_hash, exclude_id=mirror.id).id == source.id
+        assert crud.link_request_sentences(db, req_id=mirror.id, source_req_id=source.id) == 2
+        assert len(crud.get_request_sentences(db, req_id=mirror.id)) == 2
+    finally:
+        db.close()
+
+
+def test_get_entity_by_name_cached():
+    db = SessionLocal()
+    try:
+        db_request = _create_request(db)
+        name = f"Cached Entity {uuid.uuid4()}"
+        crud.create_tagged_sentences(db, req_id=db_request.id, sentences=[_tagged(f"{name}.", (name, 'ORG'))])
+
+        db_entity = crud.get_entity_by_name(db, entity_name=f"  {name.upper()} ")
+        assert db_entity.name == name
+        hits = crud.entity_norm_cache.stats()['hits']
+        assert crud.get_entity_by_name(db, entity_name=name.lower()).id == db_entity.id
+        assert crud.entity_norm_cache.stats()['hits'] == hits + 1
+    finally:
+        db.close()
+
+
+def test_get_requests_query_count():
+    db = SessionLocal()
+    try:
+        for i in range(3):
+            db_request = _create_request(db)
+            crud.create_tagged_sentences(db, req_id=db_request.id, sentences=[
+                _tagged(f"Sentence {i}.", (f"Entity {uuid.uuid4()}", 'ORG'), ('Singapore', 'GPE')),
+                _tagged(f"Another sentence {i}.", ('Singapore', 'GPE')),
+            ])
+        db.expunge_all()
+
+        with QueryCounter(engine) as counter:
+            db_requests = crud.get_requests(db, skip=0, limit=100)
+            requests = [schemas.Request.from_orm(db_request) for db_request in db_requests]
+        assert any(request.sentences for request in requests)
+        # requests, their sentences and the entities of those sentences
+        assert counter.count == 3
+
+        db.expunge_all()
+        with QueryCounter(engine) as counter:
+            db_requests = crud.get_requests(db, skip=0, limit=100, with_sentences=False)
+            requests = [schemas.Request.from_orm(db_request) for db_request in db_requests]
+        assert not any(request.sentences for request in requests)
+        assert counter.count == 1
+    finally:
+        db.close()
@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.db import crud, models, schemas
+from app.db.database import SessionLocal, WriterSessionLocal, engine, writer_engine
+from app.db.executor import DBExecutor, writer_db_executor
+from app.services.scraper_service import process_claimed_request
+
+sqlite_only = pytest.mark.skipif(engine.dialect.name != 'sqlite', reason="SQLite engine profile")
+postgres_only = pytest.mark.skipif(engine.dialect.name != 'postgresql', reason="PostgreSQL bulk loading")
+
+
+@sqlite_only
+def test_sqlite_pragmas():
+    db = SessionLocal()
+    try:
+        assert db.execute("PRAGMA journal_mode").scalar().lower() == 'wal'
+        assert db.execute("PRAGMA synchronous").scalar() == 1  # NORMAL
+        assert db.execute("PRAGMA busy_timeout").scalar() == 5000
+    finally:
+        db.close()
+
+
+@sqlite_only
+def test_writer_session_serialized():
+    assert writer_engine is not engine
+    assert writer_engine.pool.size() == 1
+
+    db = WriterSessionLocal()
+    try:
+        db.execute("SELECT 1")
+        # Writer transaction holds the write lock from BEGIN IMMEDIATE, readers still see committed data
+        assert db.connection().connection.in_transaction
+        reader = SessionLocal()
+        try:
+            assert reader.execute("SELECT count(*) FROM requests").scalar() >= 0
+        finally:
+            reader.close()
+    finally:
+        db.close()
+
+
+def test_db_executor():
+    executor = DBExecutor(max_workers=2)
+    checked_out = engine.pool.checkedout()
+
+    def work(db, value, offset=0):
+        return value + offset, threading.current_thread().name, db.execute("SELECT 1").scalar()
+
+    loop = asyncio.new_event_loop()
+    try:
+        value, thread_name, one = loop.run_until_complete(executor.run(work, 1, offset=2))
+    finally:
+        loop.close()
+        executor.shutdown()
+    assert (value, one) == (3, 1)
+    assert thread_name.startswith('db')
+    # Session was closed and its connection returned to the pool
+    assert engine.pool.checkedout() == checked_out
+
+
+@sqlite_only
+def test_writer_executor_serialized():
+    assert writer_db_executor.max_workers == 1
+    assert writer_db_executor.session_factory is WriterSessionLocal
+
+    def work(db):
+        db.execute("SELECT 1")
+        return db.bind is writer_engine, threading.current_thread().name
+
+    loop = asyncio.new_event_loop()
+    try:
+        on_writer, thread_name = loop.run_until_complete(writer_db_executor.run(work))
+    finally:
+        loop.close()
+    assert on_writer
+    assert thread_name.startswith('db-writer')
+
+
+def test_writer_not_held_while_fetching(stub_server):
+    db = SessionLocal()
+    try:
+        token = uuid.uuid4().hex
+        slow = crud.create_request(db, schemas.RequestCreate(path=f"{stub_server}/slow.html?run={token}"))
+        other = crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}"))
+        slow_id, other_id = slow.id, other.id
+        assert crud.claim_request(db, req_id=slow_id, lease_seconds=60)
+    finally:
+        db.close()
+
+    job = threading.Thread(target=process_claimed_request, args=(slow_id,))
+    job.start()
+    try:
+        # The slow page responds after 2 seconds, another writer commits while it is fetched
+        time.sleep(0.5)
+        start = time.monotonic()
+        writer = WriterSessionLocal()
+        try:
+            crud.update_request_status(writer, models.Statuses.Error, crud.get_request(writer, req_id=other_id))
+        finally:
+            writer.close()
+        assert time.monotonic() - start < 1.0
+        assert job.is_alive()
+    finally:
+        job.join()
+
+
+def _tagged(text, *names):
+    return schemas.TaggedSentence(text=text, entities=[schemas.EntityCreate(name=name, ent_type='ORG')
+                                                       for name in names])
+
+
+@postgres_only
+def test_insert_sentences_reserves_ids():
+    db = SessionLocal()
+    try:
+        token = uuid.uuid4().hex
+        req_id = crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}")).id
+        sentences = {models.text_fingerprint(sent.text): sent
+                     for sent in [_tagged(f"First {token}."), _tagged(f"Second {token}.")]}
+        sent_ids = crud._insert_sentences(db, req_id, sentences)
+        assert set(sent_ids) == set(sentences)
+        # IDs were reserved from the sequence, so rows inserted with a default ID do not collide
+        last_id = db.execute("SELECT last_value FROM sentences_id_seq").scalar()
+        assert max(sent_ids.values()) <= last_id
+        db_sentence = models.Sentence(text=f"Third {token}.", req_id=req_id)
+        db.add(db_sentence)
+        db.flush()
+        assert db_sentence.id > max(sent_ids.values())
+
+        # Sentences already stored, e.g. by another request concurrently, are skipped and keep their ID
+        again = {**sentences, models.text_fingerprint(db_sentence.text): _tagged(db_sentence.text)}
+        assert crud._insert_sentences(db, req_id, again) == {**sent_ids, db_sentence.text_hash: db_sentence.id}
+        assert db.query(models.Sentence).filter(models.Sentence.text.like(f"% {token}.")).count() == 3
+    finally:
+        db.rollback()
+        db.close()
+
+
+@postgres_only
+def test_copy_rows_skips_conflicts():
+    db = SessionLocal()
+    try:
+        token = uuid.uuid4().hex
+        req_id = crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}")).id
+        sent_ids = crud._insert_sentences(db, req_id, {models.text_fingerprint(f"Copied {token}."):
+                                                       _tagged(f"Copied {token}.")})
+        sent_id = next(iter(sent_ids.values()))
+        db.execute(crud._insert_ignore(db, models.Entity.__table__),
+                   [{'name': f"A {token}", 'ent_type': 'ORG'}, {'name': f"B {token}", 'ent_type': 'ORG'}])
+        entity_ids = crud._query_entity_ids(db, [f"A {token}", f"B {token}"])
+        assert len(entity_ids) == 2
+
+        columns = ['ent_id', 'sent_id']
+        crud._copy_rows(db, models.association_table, columns, [(entity_ids[f"A {token}"], sent_id)])
+        # Rows already loaded and duplicate rows are skipped, the staging table is emptied after each load
+        crud._copy_rows(db, models.association_table, columns,
+                        [(entity_ids[f"A {token}"], sent_id), (entity_ids[f"B {token}"], sent_id),
+                         (entity_ids[f"B {token}"], sent_id)])
+        assert sorted(db.execute("SELECT ent_id FROM association WHERE sent_id = :sent_id",
+                                 {'sent_id': sent_id}).fetchall()) == sorted((ent_id,) for ent_id in entity_ids.values())
+        assert db.execute("SELECT count(*) FROM stage_association").scalar() == 0
+
+        # The staging table is created LIKE the target table, so column types match
+        stage_columns = db.execute("SELECT column_name, data_type FROM information_schema.columns "
+                                   "WHERE table_name = 'stage_association' ORDER BY column_name").fetchall()
+        assert [tuple(row) for row in stage_columns] == [('ent_id', 'integer'), ('sent_id', 'integer')]
+    finally:
+        db.rollback()
+        db.close()
+
+
+@postgres_only
+def test_create_tagged_sentences_on_conflict():
+    db = SessionLocal()
+    try:
+        token = uuid.uuid4().hex
+        first, second = [crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}/{i}")).id
+                         for i in range(2)]
+        sentences = [_tagged(f"Mirrored {token}.", f"Org {token}"), _tagged(f"Other {token}.", f"Org {token}")]
+        assert crud.create_tagged_sentences(db, req_id=first, sentences=sentences) == 2
+        # Same sentences stored again are linked to the second request, without duplicate rows
+        assert crud.create_tagged_sentences(db, req_id=second, sentences=sentences + sentences[:1]) == 2
+        assert db.query(models.Sentence).filter(models.Sentence.text.like(f"% {token}.")).count() == 2
+        assert db.query(models.Entity).filter(models.Entity.name == f"Org {token}").count() == 1
+        assert len(crud.get_request_sentences(db, req_id=first)) == len(crud.get_request_sentences(db, req_id=second))
+    finally:
+        db.close()
@@ -28,3 +28,20 @@ def test_search_entity_sentences(test_app):
 def test_search_entity_sentences_invalid_id(test_app):
     response = test_app.get(f"{VER}/entities/999999999999999999/sentences")
     assert response.status_code == 404
+
+
+def test_read_entities_cursor(test_app):
+    response = test_app.get(f"{VER}/entities/", params={'limit': 1})
+    assert response.status_code == 200
+    cursor = response.headers['X-Next-Cursor']
+    first_page = response.json()
+
+    response = test_app.get(f"{VER}/entities/", params={'limit': 1, 'cursor': cursor})
+    assert response.status_code == 200
+    assert response.json()[0]['id'] > first_page[0]['id']
+    assert response.json() == test_app.get(f"{VER}/entities/", params={'limit': 1, 'skip': 1}).json()
+
+
+def test_read_entities_invalid_cursor(test_app):
+    response = test_app.get(f"{VER}/entities/", params={'cursor': 'abc'})
+    assert response.status_code == 400
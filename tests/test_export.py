@@ -0,0 +1,46 @@
+import gzip
+import json
+import uuid
+
+from app.services.export_service import ndjson_chunks
+
+VER = 'v1_0'
+
+
+def _read_ndjson(content: bytes):
+    return [json.loads(line) for line in content.decode('utf-8').splitlines()]
+
+
+def test_export_entity_sentences(test_app):
+    text = f'Barack Obama visited Singapore on day {uuid.uuid4().hex}.'
+    assert test_app.post(f"{VER}/ner", data=json.dumps({'text': text, 'persist': True})).status_code == 200
+
+    response = test_app.get(f"{VER}/export/entities")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    entities = _read_ndjson(response.content)
+    entity_id = next(entity['id'] for entity in entities if entity['name'] == 'Barack Obama')
+    assert [entity['id'] for entity in entities] == sorted(entity['id'] for entity in entities)
+
+    sentences = _read_ndjson(test_app.get(f"{VER}/export/sentences").content)
+    sent_id = next(sentence['id'] for sentence in sentences if sentence['text'] == text)
+
+    response = test_app.get(f"{VER}/export/entity_sentences", params={'compress': True})
+    assert response.status_code == 200
+    links = _read_ndjson(gzip.decompress(response.content))
+    assert {'ent_id': entity_id, 'sent_id': sent_id} in links
+
+    links = _read_ndjson(test_app.get(f"{VER}/export/entity_sentences", params={'after_id': entity_id}).content)
+    assert all(link['ent_id'] > entity_id for link in links)
+
+
+def test_export_unknown_dataset(test_app):
+    assert test_app.get(f"{VER}/export/requests").status_code == 422
+
+
+def test_ndjson_chunks():
+    rows = [(i, f'name {i}') for i in range(100)]
+    chunks = list(ndjson_chunks(rows, ('id', 'name'), chunk_bytes=256))
+    assert len(chunks) > 1
+    assert all(chunk.endswith(b'\n') for chunk in chunks)
+    assert _read_ndjson(b''.join(chunks)) == [{'id': i, 'name': f'name {i}'} for i in range(100)]
@@ -0,0 +1,44 @@
+import pytest
+
+from app.services.extract_service import BACKENDS, extract_text
+from app.services.fetch_service import FetchResult
+
+HTML = b'''<!DOCTYPE html>
+<html><head><title>Title</title><style>p { color: red; }</style><script>var x = 1;</script></head>
+<body><header>Site name</header>
+<p>Barack Obama visited <b>Singapore</b> &amp; Malaysia.</p><!-- comment -->
+<noscript>Enable JavaScript</noscript><input value="x"><p>Second paragraph</p>
+</body></html>'''
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_extract_text(backend):
+    assert extract_text(HTML, backend=backend) == 'Title Barack Obama visited Singapore & Malaysia. Second paragraph'
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+def test_extract_text_empty(backend):
+    assert extract_text(b'', backend=backend) == ''
+
+
+# Non-ASCII text without meta charset, decoded by the charset of the Content-Type header, or as UTF-8 without one
+NON_ASCII_TEXT = 'Café Zürich — São Paulo'
+NON_ASCII_HTML = '<html><body><p>{}</p></body></html>'.format(NON_ASCII_TEXT)
+
+
+@pytest.mark.parametrize('backend', list(BACKENDS))
+@pytest.mark.parametrize('content_type, encoding', [
+    ('text/html', 'utf-8'),
+    ('text/html; charset=UTF-8', 'utf-8'),
+    ('text/html; charset="windows-1252"', 'windows-1252'),
+    ('text/html; charset=unknown', 'utf-8'),
+])
+def test_extract_text_charset(backend, content_type, encoding):
+    page = FetchResult(url='https://example.com/', status_code=200, content_type=content_type,
+                       content=NON_ASCII_HTML.encode(encoding))
+    assert extract_text(page.content, backend=backend, encoding=page.charset) == NON_ASCII_TEXT
+
+
+def test_extract_text_unknown_backend():
+    with pytest.raises(ValueError):
+        extract_text(HTML, backend='unknown')
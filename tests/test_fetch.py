@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.services.fetch_service import Fetcher, FetchError, ContentTypeError, BodyTooLargeError
+from app.services.scraper_service import check_valid_url, canonicalize_url
+
+
+@pytest.fixture(scope="module")
+def fetcher():
+    fetcher = Fetcher(max_per_host=2, read_timeout=0.5, total_timeout=1.0, max_bytes=64 * 1024,
+                      content_types=['text/html'])
+    yield fetcher
+    fetcher.close()
+
+
+def test_fetch(fetcher, stub_server):
+    page = fetcher.fetch_sync(f"{stub_server}/page.html")
+    assert page.status_code == 200
+    assert b'Barack Obama' in page.content
+
+
+def test_fetch_head(fetcher, stub_server):
+    page = fetcher.fetch_sync(f"{stub_server}/page.html", method='HEAD')
+    assert page.status_code == 200
+    assert page.content == b''
+
+
+def test_fetch_content_type(fetcher, stub_server):
+    with pytest.raises(ContentTypeError):
+        fetcher.fetch_sync(f"{stub_server}/image.png")
+
+
+def test_fetch_body_too_large(fetcher, stub_server):
+    with pytest.raises(BodyTooLargeError):
+        fetcher.fetch_sync(f"{stub_server}/large.html")
+
+
+def test_fetch_timeout(fetcher, stub_server):
+    with pytest.raises(FetchError):
+        fetcher.fetch_sync(f"{stub_server}/slow.html")
+
+
+def test_fetch_not_found(fetcher, stub_server):
+    with pytest.raises(FetchError):
+        fetcher.fetch_sync(f"{stub_server}/missing.html")
+
+
+def test_fetch_many(fetcher, stub_server):
+    urls = [f"{stub_server}/page.html"] * 5 + [f"{stub_server}/image.png"]
+    pages = fetcher.fetch_many_sync(urls)
+    assert [page.status_code for page in pages[:5]] == [200] * 5
+    assert isinstance(pages[5], ContentTypeError)
+
+
+def test_host_limits_dropped(fetcher, stub_server):
+    fetcher.fetch_many_sync([f"{stub_server}/page.html"] * 3 + [f"{stub_server}/missing.html"])
+    assert fetcher._host_limits == {}
+
+    async def hold(url, entered, release):
+        async with fetcher._host_limit(url):
+            entered.append(url)
+            await release.wait()
+
+    async def check():
+        entered, release = [], asyncio.Event()
+        holders = [asyncio.ensure_future(hold(f"https://Example.com/{i}", entered, release)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        # max_per_host of 2 fetches hold the limit, the third waits on it
+        assert len(entered) == 2
+        assert fetcher._host_limits['example.com'].users == 3
+        release.set()
+        await asyncio.gather(*holders)
+        return len(entered), dict(fetcher._host_limits)
+
+    assert fetcher.submit(check()).result() == (3, {})
+
+
+def test_probe(fetcher, stub_server):
+    page = fetcher.submit(fetcher.probe(f"{stub_server}/page.html", timeout=1.0)).result()
+    assert page.status_code == 200
+    assert page.content == b''
+
+
+def test_check_valid_url():
+    assert check_valid_url('https://fastapi.tiangolo.com/')
+    assert check_valid_url('http://127.0.0.1:8000/page.html?q=1')
+    assert not check_valid_url('abc')
+    assert not check_valid_url('ftp://example.com/')
+    assert not check_valid_url('http:///path')
+    assert not check_valid_url('http://exa mple.com/')
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('HTTPS://Example.COM:443/a/b?utm_source=x&b=2&a=1&fbclid=y#top') == \
+        'https://example.com/a/b?a=1&b=2'
+    assert canonicalize_url('http://example.com') == 'http://example.com/'
+    assert canonicalize_url('http://example.com:8080/?q=') == 'http://example.com:8080/?q='
+    # Parameters are not decoded and encoded again
+    assert canonicalize_url('http://example.com/?q') == 'http://example.com/?q'
+    assert canonicalize_url('http://example.com/?q=a%20b&p=c+d&utm_%73ource=x') == \
+        'http://example.com/?p=c+d&q=a%20b'
+    assert canonicalize_url('http://example.com/?b=%2F&a=x=y&a') == 'http://example.com/?a&a=x=y&b=%2F'
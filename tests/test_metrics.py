@@ -0,0 +1,65 @@
+import json
+import uuid
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from app.db.database import engine
+from app.services.metrics_service import Histogram, instrument_engines
+
+VER = 'v1_0'
+
+
+def _samples(text: str):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def test_read_metrics(test_app):
+    text = f'Barack Obama visited Singapore on day {uuid.uuid4().hex}.'
+    assert test_app.post(f"{VER}/ner", data=json.dumps({'text': text, 'persist': True})).status_code == 200
+
+    response = test_app.get(f"{VER}/metrics")
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    samples = _samples(response.text)
+    assert samples['ner_stage_seconds_count{stage="ner"}'] >= 1
+    assert samples['ner_stage_seconds_count{stage="persist"}'] >= 1
+    assert samples['ner_model_characters_total'] >= len(text)
+    assert samples['ner_db_query_seconds_count{statement="SELECT"}'] >= 1
+    assert samples['ner_requests{status="Success"}'] >= 1
+    assert 'ner_requests{status="Queued"}' in samples
+    assert 'ner_response_cache_hits_total' in samples
+    # Entity names of the stored text were looked up in the entity ID cache
+    assert (samples['ner_entity_cache_hits_total{cache="id"}']
+            + samples['ner_entity_cache_misses_total{cache="id"}']) >= 1
+    assert 'ner_entity_cache_misses_total{cache="norm"}' in samples
+    assert 'ner_entity_cache_size{cache="id"}' in samples
+    assert samples['ner_http_request_seconds_count{method="POST",status_code="200"}'] >= 1
+
+
+def test_histogram_samples():
+    histogram = Histogram('test_seconds', 'Test.', ['stage'], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value, 'fetch')
+    samples = _samples('\n'.join(histogram.samples()))
+    assert samples['test_seconds_bucket{stage="fetch",le="0.1"}'] == 1
+    assert samples['test_seconds_bucket{stage="fetch",le="1.0"}'] == 3
+    assert samples['test_seconds_bucket{stage="fetch",le="+Inf"}'] == 4
+    assert samples['test_seconds_count{stage="fetch"}'] == 4
+    assert samples['test_seconds_sum{stage="fetch"}'] == 6.05
+
+
+def test_failed_statement_not_timed():
+    instrument_engines()
+    with engine.connect() as conn:
+        with pytest.raises(DBAPIError):
+            conn.execute("SELECT * FROM missing_table")
+        # Start time of the failed statement is dropped, so it is not taken as the start of the next one
+        assert conn.info.get('query_start') == []
+        assert conn.execute("SELECT 1").scalar() == 1
+        assert conn.info['query_start'] == []
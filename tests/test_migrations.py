@@ -0,0 +1,63 @@
+from sqlalchemy import create_engine, inspect
+
+from app.db import migrations, models
+
+# Schema of the first release: association without primary key, index on sentence text
+OLD_SCHEMA = [
+    'CREATE TABLE requests (id INTEGER NOT NULL, path VARCHAR, status VARCHAR, PRIMARY KEY (id))',
+    'CREATE UNIQUE INDEX ix_requests_path ON requests (path)',
+    'CREATE INDEX ix_requests_status ON requests (status)',
+    'CREATE TABLE sentences (id INTEGER NOT NULL, text VARCHAR, req_id INTEGER, PRIMARY KEY (id), '
+    'FOREIGN KEY(req_id) REFERENCES requests (id))',
+    'CREATE INDEX ix_sentences_text ON sentences (text)',
+    'CREATE TABLE entities (id INTEGER NOT NULL, name VARCHAR, ent_type VARCHAR, PRIMARY KEY (id))',
+    'CREATE UNIQUE INDEX ix_entities_name ON entities (name)',
+    'CREATE TABLE association (sent_id INTEGER, ent_id INTEGER, FOREIGN KEY(sent_id) REFERENCES sentences (id), '
+    'FOREIGN KEY(ent_id) REFERENCES entities (id))',
+]
+
+OLD_ROWS = [
+    "INSERT INTO requests (id, path, status) VALUES (1, 'https://example.com/1', 'Success'), "
+    "(2, 'https://example.com/2', 'Success')",
+    "INSERT INTO sentences (id, text, req_id) VALUES (1, 'Barack Obama visited Singapore.', 1), "
+    "(2, 'Singapore is an island.', 1), (3, 'Barack Obama visited Singapore.', 2)",
+    "INSERT INTO entities (id, name, ent_type) VALUES (1, 'Barack Obama', 'PERSON'), (2, 'Singapore', 'GPE')",
+    # Duplicate links, and links of sentence 3, a duplicate of sentence 1
+    'INSERT INTO association (sent_id, ent_id) VALUES (1, 1), (1, 1), (1, 2), (2, 2), (2, 2), (3, 1), (3, 2)',
+]
+
+
+def test_upgrade_old_schema(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for statement in OLD_SCHEMA + OLD_ROWS:
+            conn.execute(statement)
+
+    # Same steps as webservice startup, run twice to check the upgrade is idempotent
+    for _ in range(2):
+        models.Base.metadata.create_all(bind=engine)
+        migrations.upgrade(engine)
+
+    inspector = inspect(engine)
+    assert sorted(inspector.get_pk_constraint('association')['constrained_columns']) == ['ent_id', 'sent_id']
+    assert 'association_old' not in inspector.get_table_names()
+    sentence_indexes = {index['name']: index for index in inspector.get_indexes('sentences')}
+    assert 'ix_sentences_text' not in sentence_indexes
+    assert sentence_indexes['ix_sentences_text_hash']['column_names'] == ['text_hash']
+    assert sentence_indexes['ix_sentences_text_hash']['unique']
+
+    with engine.connect() as conn:
+        assert conn.execute('SELECT count(*) FROM requests').scalar() == 2
+        assert conn.execute('SELECT count(*) FROM entities').scalar() == 2
+        # Sentence 3 is merged into sentence 1
+        assert conn.execute('SELECT id FROM sentences ORDER BY id').fetchall() == [(1,), (2,)]
+        assert conn.execute('SELECT count(*) FROM sentences WHERE text_hash IS NULL').scalar() == 0
+        assert conn.execute('SELECT text_hash FROM sentences WHERE id = 1').scalar() == \
+            models.text_fingerprint('Barack Obama visited Singapore.')
+        assert conn.execute('SELECT ent_id, sent_id FROM association ORDER BY ent_id, sent_id').fetchall() == \
+            [(1, 1), (2, 1), (2, 2)]
+        assert conn.execute('SELECT req_id, sent_id FROM request_sentences ORDER BY req_id, sent_id').fetchall() == \
+            [(1, 1), (1, 2), (2, 1)]
+        assert conn.execute("SELECT name_norm FROM entities WHERE id = 1").scalar() == \
+            models.normalize_entity_name('Barack Obama')
+    engine.dispose()
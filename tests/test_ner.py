@@ -0,0 +1,75 @@
+import json
+import sys
+import uuid
+
+from app.db import crud, models, schemas
+from app.db.database import SessionLocal, WriterSessionLocal
+from app.services import nlp_service
+
+VER = 'v1_0'
+
+
+def test_extract_entities(test_app):
+    test_request_payload = {'text': 'Barack Obama visited Singapore.', 'texts': ['Apple is based in California.']}
+    response = test_app.post(f"{VER}/ner", data=json.dumps(test_request_payload), )
+    assert response.status_code == 200
+    documents = response.json()['documents']
+    assert len(documents) == 2
+    assert documents[0]['req_id'] is None
+
+
+def test_extract_entities_persist(test_app):
+    test_request_payload = {'text': 'Barack Obama visited Singapore.', 'persist': True}
+    response = test_app.post(f"{VER}/ner", data=json.dumps(test_request_payload), )
+    assert response.status_code == 200
+    req_id = response.json()['documents'][0]['req_id']
+    response = test_app.get(f"{VER}/requests/{req_id}")
+    assert response.status_code == 200
+
+
+def test_extract_entities_no_text(test_app):
+    response = test_app.post(f"{VER}/ner", data=json.dumps({'texts': []}), )
+    assert response.status_code == 422
+
+
+def test_extract_entities_too_large(test_app, monkeypatch):
+    ner_api = sys.modules['api.ner']
+    monkeypatch.setattr(ner_api, 'NER_REQUEST_MAX_TEXTS', 2)
+    monkeypatch.setattr(ner_api, 'NER_REQUEST_MAX_CHARS', 20)
+    response = test_app.post(f"{VER}/ner", data=json.dumps({'texts': ['Paris.', 'Rome.', 'Oslo.']}), )
+    assert response.status_code == 413
+    response = test_app.post(f"{VER}/ner", data=json.dumps({'text': 'Barack Obama visited Singapore.'}), )
+    assert response.status_code == 413
+    response = test_app.post(f"{VER}/ner", data=json.dumps({'texts': ['Paris.', 'Rome.']}), )
+    assert response.status_code == 200
+
+
+def test_stored_text_not_claimable(monkeypatch):
+    db_crud = sys.modules['db.crud']
+    create_tagged_sentences = db_crud.create_tagged_sentences
+    statuses = []
+
+    def create_and_check(db, req_id, sentences):
+        # Status committed with the sentences, e.g. when a worker polls before the sentences are stored
+        statuses.append(db.query(models.Request.status).filter(models.Request.id == req_id).scalar())
+        return create_tagged_sentences(db, req_id=req_id, sentences=sentences)
+
+    monkeypatch.setattr(db_crud, 'create_tagged_sentences', create_and_check)
+    text = f'Barack Obama visited Paris on day {uuid.uuid4().hex}.'
+    tagged_sentences = [sent for chunk in nlp_service.iter_tagged_chunks(text) for sent in chunk]
+    writer = WriterSessionLocal()
+    try:
+        req_id = nlp_service.store_tagged_text(writer, text, tagged_sentences)
+    finally:
+        writer.close()
+    assert statuses == [models.Statuses.Success.name]
+
+    db = SessionLocal()
+    try:
+        assert crud.get_request(db, req_id=req_id).status == models.Statuses.Success.name
+        # Requests of inline text stored before, e.g. left queued by an interrupted call, are not claimed either
+        legacy = crud.create_request(db, schemas.RequestCreate(path=f"text:{uuid.uuid4().hex}"))
+        assert not crud.claim_request(db, req_id=legacy.id, lease_seconds=60)
+        assert legacy.id not in [row.id for row in crud.get_claimable_requests(db)]
+    finally:
+        db.close()
@@ -0,0 +1,27 @@
+from app.services.nlp_service import iter_text_chunks
+
+TEXT = 'Barack Obama visited Singapore. "It was great!" he said. Apple opened a store in Paris. ' * 50
+
+
+def test_iter_text_chunks():
+    chunks = list(iter_text_chunks(TEXT, max_chars=200))
+    assert len(chunks) > 1
+    assert ''.join(chunk for _, chunk in chunks) == TEXT
+    for offset, chunk in chunks:
+        assert len(chunk) <= 200
+        assert TEXT[offset:offset + len(chunk)] == chunk
+    for _, chunk in chunks[:-1]:
+        assert chunk.rstrip()[-1] in '."!'
+
+
+def test_iter_text_chunks_without_sentence_end():
+    text = 'word ' * 100
+    chunks = list(iter_text_chunks(text, max_chars=64))
+    assert ''.join(chunk for _, chunk in chunks) == text
+    assert all(chunk.endswith(' ') for _, chunk in chunks)
+    assert [len(chunk) for _, chunk in iter_text_chunks('a' * 150, max_chars=64)] == [64, 64, 22]
+
+
+def test_iter_text_chunks_short_text():
+    assert list(iter_text_chunks('Short text.', max_chars=64)) == [(0, 'Short text.')]
+    assert list(iter_text_chunks('', max_chars=64)) == []
@@ -1,17 +1,29 @@
 import json
+import sys
+import uuid
 
 from app.db import crud
 
 VER = 'v1_0'
 
 
-def test_create_request(test_app):
-    test_request_payload = {'path': 'https://fastapi.tiangolo.com/'}
+def test_create_request(test_app, stub_server):
+    test_request_payload = {'path': f"{stub_server}/page.html?run={uuid.uuid4().hex}"}
 
     response = test_app.post(f"{VER}/requests/", data=json.dumps(test_request_payload), )
     assert response.status_code == 201
 
 
+def test_create_request_priority(test_app, stub_server):
+    test_request_payload = {'path': f"{stub_server}/page.html?run={uuid.uuid4().hex}", 'priority': 5}
+
+    response = test_app.post(f"{VER}/requests/", data=json.dumps(test_request_payload), )
+    assert response.status_code == 201
+    assert response.json()['priority'] == 5
+    response = test_app.get(f"{VER}/requests/{response.json()['id']}", params={'summary': True})
+    assert response.json()['status'] == 'Success'
+
+
 def test_create_request_invalid_json(test_app):
     test_request_payload = {'path': 'abc'}
     response = test_app.post(f"{VER}/requests/", data=json.dumps(test_request_payload), )
@@ -41,3 +53,66 @@ def test_read_request_sentences(test_app):
 def test_read_request_sentences_invalid_id(test_app):
     response = test_app.get(f"{VER}/requests/9999999999/sentences")
     assert response.status_code == 400
+
+
+def test_create_request_invalid_scheme(test_app):
+    test_request_payload = {'path': 'ftp://example.com/file.txt'}
+    response = test_app.post(f"{VER}/requests/", data=json.dumps(test_request_payload), )
+    assert response.status_code == 422
+
+
+def test_read_requests_cursor(test_app):
+    # Compare with all requests of the database, which grows when tests are run against a persistent database
+    ids = [request['id'] for request in test_app.get(f"{VER}/requests/", params={'summary': True,
+                                                                                 'limit': 10 ** 6}).json()]
+    paged_ids = []
+    params = {'limit': 2, 'summary': True}
+    while True:
+        response = test_app.get(f"{VER}/requests/", params=params)
+        assert response.status_code == 200
+        paged_ids += [request['id'] for request in response.json()]
+        if 'X-Next-Cursor' not in response.headers:
+            break
+        params['cursor'] = response.headers['X-Next-Cursor']
+    assert paged_ids == ids
+
+
+def test_create_requests_batch(test_app, stub_server):
+    path = f"{stub_server}/missing.html?run={uuid.uuid4().hex}"
+    payload = [path, {'path': path + '&utm_source=newsletter'}, 'abc', 42]
+    response = test_app.post(f"{VER}/requests/batch", data=json.dumps(payload))
+    assert response.status_code == 200
+    results = response.json()
+    assert [result['status'] for result in results] == ['created', 'duplicate', 'invalid', 'invalid']
+    assert results[0]['path'] == results[1]['path'] == path
+    assert results[0]['id'] == results[1]['id']
+
+    # The missing page failed in the background task, so it is queued again
+    body = '\n'.join([json.dumps(path), '{"path": "ftp://example.com/file.txt"}', '{not json'])
+    response = test_app.post(f"{VER}/requests/batch", data=body, headers={'Content-Type': 'application/x-ndjson'})
+    assert response.status_code == 200
+    results = response.json()
+    assert [result['status'] for result in results] == ['requeued', 'invalid', 'invalid']
+    assert results[0]['id'] == test_app.get(f"{VER}/requests/{results[0]['id']}").json()['id']
+
+
+def test_create_requests_batch_not_array(test_app):
+    response = test_app.post(f"{VER}/requests/batch", data=json.dumps({'path': 'https://example.com/'}))
+    assert response.status_code == 422
+
+
+def test_read_requests_fast_serialization(test_app, monkeypatch):
+    def read(url, params):
+        response = test_app.get(url, params=params)
+        assert response.status_code == 200
+        requests = response.json()
+        # Entities of sentences are only ordered by id in fast serialization mode
+        for sentence in [sentence for request in requests for sentence in request['sentences']]:
+            sentence['entities'].sort(key=lambda entity: entity['id'])
+        return requests, response.headers.get('X-Next-Cursor')
+
+    params = {'limit': 3}
+    fast = read(f"{VER}/requests/", params)
+    monkeypatch.setattr(sys.modules['api.requests'], 'FAST_SERIALIZATION', False)
+    assert read(f"{VER}/requests/", params) == fast
+    assert any(request['sentences'] for request in fast[0])
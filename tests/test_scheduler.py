@@ -0,0 +1,92 @@
+import threading
+import time
+import uuid
+
+from app.db import crud, models, schemas
+from app.db.database import SessionLocal
+from app.services import scheduler_service
+from app.services.scheduler_service import DomainRateLimiter, Scheduler, claim_next_request, domain_of
+
+# Above priorities of requests created by other tests, so that they are claimed first
+PRIORITY = 10 ** 9
+
+
+def test_domain_rate_limiter():
+    limiter = DomainRateLimiter(rate=0.001, burst=2)
+    assert [limiter.try_acquire('a.example.com') for _ in range(3)] == [True, True, False]
+    assert limiter.try_acquire('b.example.com')
+    assert limiter.wait_time(['a.example.com']) > 0
+    assert DomainRateLimiter(rate=0).try_acquire('a.example.com')
+
+
+def test_scheduler_next_requests():
+    scheduler = Scheduler(max_concurrency=2, limiter=DomainRateLimiter(rate=0.001, burst=1))
+    scheduler.submit([(1, 'https://a.example.com/1', 0), (2, 'https://a.example.com/2', 5),
+                      (3, 'https://b.example.com/3', 1), (4, 'https://c.example.com/4', 0)])
+    batch, throttled = scheduler._next_requests(2)
+    assert [request[0] for request in batch] == [2, 3]
+    batch, throttled = scheduler._next_requests(2)
+    # Request 1 waits for a token of its domain, request 4 of another domain is not held back
+    assert [request[0] for request in batch] == [4]
+    assert throttled == {'a.example.com'}
+    assert scheduler.pending() == 1
+
+
+def test_claim_next_request():
+    db = SessionLocal()
+    token = uuid.uuid4()
+    requests = [crud.create_request(db, schemas.RequestCreate(path=path, priority=priority)) for path, priority in [
+        (f"https://a.example.com/{token}/1", PRIORITY + 2),
+        (f"https://a.example.com/{token}/2", PRIORITY + 1),
+        (f"https://b.example.com/{token}/3", PRIORITY),
+    ]]
+    try:
+        assert domain_of(requests[0].path) == 'a.example.com'
+        limiter = DomainRateLimiter(rate=0.001, burst=1)
+        claimed = [claim_next_request(db, limiter, lease_seconds=60) for _ in range(2)]
+        # The second request of domain a is skipped until its domain has a token
+        assert [req_id for req_id, lease in claimed] == [requests[0].id, requests[2].id]
+    finally:
+        for db_request in requests:
+            db.refresh(db_request)
+            crud.update_request_status(db, models.Statuses.Success, db_request)
+        db.close()
+
+
+def test_scheduler_dispatches_by_priority_between_jobs(monkeypatch):
+    db = SessionLocal()
+    token = uuid.uuid4()
+    requests = [crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}/{i}"))
+                for i in range(5)]
+    scheduled = [(db_request.id, db_request.path, 0) for db_request in requests]
+    urgent = (requests[-1].id, requests[-1].path, 10)
+    scheduler = Scheduler(max_concurrency=2, limiter=DomainRateLimiter(rate=0))
+    started, running, max_running = [], [], []
+    lock = threading.Lock()
+
+    def process(req_id, db=None, page=None, lease=None):
+        with lock:
+            started.append(req_id)
+            running.append(req_id)
+            max_running.append(len(running))
+            first = len(started) == 1
+        if first:
+            # Submitted while the first jobs run, dispatched before the other scheduled requests
+            scheduler.submit([urgent])
+        time.sleep(0.1)
+        with lock:
+            running.remove(req_id)
+        return True
+
+    monkeypatch.setattr(scheduler_service, 'process_claimed_request', process)
+    try:
+        scheduler.run(scheduled[:-1])
+        assert max(max_running) == 2
+        assert started[2] == urgent[0]
+        assert sorted(started) == sorted(req_id for req_id, path, priority in scheduled)
+        assert scheduler.pending() == 0
+    finally:
+        for db_request in requests:
+            db.refresh(db_request)
+            crud.update_request_status(db, models.Statuses.Success, db_request)
+        db.close()
@@ -0,0 +1,70 @@
+import uuid
+
+from app.db import crud, schemas
+from app.db.database import SessionLocal
+
+VER = 'v1_0'
+
+
+def _store(*texts):
+    token = uuid.uuid4().hex[:12]
+    db = SessionLocal()
+    try:
+        db_request = crud.create_request(db, schemas.RequestCreate(path=f"https://example.com/{token}"))
+        sentences = [schemas.TaggedSentence(text=text.format(token=token),
+                                            entities=[schemas.EntityCreate(name=f"Zyx{token} Corp", ent_type='ORG')])
+                     for text in texts]
+        crud.create_tagged_sentences(db, req_id=db_request.id, sentences=sentences)
+    finally:
+        db.close()
+    return token
+
+
+def test_search_sentences_ranked(test_app):
+    token = _store("Apple opened a store in {token}.", "{token} {token} hosts {token} fans.", "Nothing here.")
+    response = test_app.get(f"{VER}/search/sentences", params={'q': token})
+    assert response.status_code == 200
+    results = response.json()
+    assert [result['text'] for result in results] == [f"{token} {token} hosts {token} fans.",
+                                                      f"Apple opened a store in {token}."]
+    assert results[0]['score'] >= results[1]['score']
+
+
+def test_search_sentences_terms_and_prefix(test_app):
+    token = _store("Barack Obama visited {token} on Monday.", "Barack Obama stayed home.")
+    response = test_app.get(f"{VER}/search/sentences", params={'q': f'obama {token[:8]}*'})
+    assert [result['text'] for result in response.json()] == [f"Barack Obama visited {token} on Monday."]
+
+    response = test_app.get(f"{VER}/search/sentences", params={'q': f'"{token}" OR NEAR('})
+    assert response.status_code == 200
+
+
+def test_search_sentences_paginated(test_app):
+    token = _store(*["Sentence {n} about {token}.".replace('{n}', str(n)) for n in range(5)])
+    first = test_app.get(f"{VER}/search/sentences", params={'q': token, 'limit': 3}).json()
+    second = test_app.get(f"{VER}/search/sentences", params={'q': token, 'limit': 3, 'skip': 3}).json()
+    assert len(first) == 3 and len(second) == 2
+    assert not {result['id'] for result in first} & {result['id'] for result in second}
+
+
+def test_search_sentences_deleted(test_app):
+    token = _store("Deleted sentence about {token}.")
+    db = SessionLocal()
+    try:
+        req_id = crud.get_request_by_path(db, f"https://example.com/{token}").id
+        crud.delete_request_sentences(db, req_id=req_id)
+    finally:
+        db.close()
+    assert test_app.get(f"{VER}/search/sentences", params={'q': token}).json() == []
+
+
+def test_search_sentences_invalid(test_app):
+    assert test_app.get(f"{VER}/search/sentences", params={'q': ''}).status_code == 422
+    assert test_app.get(f"{VER}/search/sentences", params={'q': 'a', 'limit': 0}).status_code == 422
+
+
+def test_autocomplete_entities(test_app):
+    token = _store("{token} is a company.")
+    response = test_app.get(f"{VER}/search/entities", params={'prefix': f'ZYX{token[:6]}'})
+    assert response.status_code == 200
+    assert [entity['name'] for entity in response.json()] == [f"Zyx{token} Corp"]
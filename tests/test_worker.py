@@ -0,0 +1,119 @@
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from app.config import JOB_MAX_ATTEMPTS
+from app.db import crud, models, schemas
+from app.db.database import SessionLocal
+from app.services import worker_service
+from app.services.scheduler_service import DomainRateLimiter, Scheduler
+from app.services.scraper_service import process_claimed_request
+
+
+def _create_request(db, path):
+    return crud.create_request(db, schemas.RequestCreate(path=path)).id
+
+
+def test_claim_request():
+    db = SessionLocal()
+    try:
+        req_id = _create_request(db, f"https://example.com/{uuid.uuid4()}")
+        lease = crud.claim_request(db, req_id=req_id, lease_seconds=60)
+        assert lease is not None
+        # Request is leased, so it is not claimed again
+        assert crud.claim_request(db, req_id=req_id, lease_seconds=60) is None
+        db_request = crud.get_request(db, req_id=req_id)
+        assert db_request.status == models.Statuses.Processing.name
+        assert db_request.attempts == 1
+
+        renewed = crud.renew_lease(db, req_id=req_id, lease=lease, lease_seconds=120)
+        assert renewed is not None and renewed > lease
+        assert crud.release_request(db, req_id=req_id, lease=renewed, status=models.Statuses.Success)
+        db_request = crud.get_request(db, req_id=req_id)
+        assert db_request.status == models.Statuses.Success.name
+        assert db_request.lease_expires is None
+    finally:
+        db.close()
+
+
+def test_expired_lease_reclaimed():
+    db = SessionLocal()
+    try:
+        req_id = _create_request(db, f"https://example.com/{uuid.uuid4()}")
+        old_lease = crud.claim_request(db, req_id=req_id, lease_seconds=-1)
+        new_lease = crud.claim_request(db, req_id=req_id, lease_seconds=60)
+        assert new_lease is not None
+        assert crud.get_request(db, req_id=req_id).attempts == 2
+
+        # Updates of the worker that lost its lease are skipped
+        assert crud.renew_lease(db, req_id=req_id, lease=old_lease, lease_seconds=60) is None
+        assert not crud.release_request(db, req_id=req_id, lease=old_lease, status=models.Statuses.Error)
+        db_request = crud.get_request(db, req_id=req_id)
+        assert db_request.status == models.Statuses.Processing.name
+        assert db_request.lease_expires == new_lease
+
+        assert crud.release_request(db, req_id=req_id, lease=new_lease, status=models.Statuses.Success)
+        assert crud.get_request(db, req_id=req_id).status == models.Statuses.Success.name
+    finally:
+        db.close()
+
+
+def test_lost_lease_abandoned(stub_server):
+    db = SessionLocal()
+    try:
+        req_id = _create_request(db, f"{stub_server}/page.html?run={uuid.uuid4()}")
+        old_lease = crud.claim_request(db, req_id=req_id, lease_seconds=-1)
+        new_lease = crud.claim_request(db, req_id=req_id, lease_seconds=60)
+    finally:
+        db.close()
+
+    assert process_claimed_request(req_id, lease=old_lease)
+
+    db = SessionLocal()
+    try:
+        db_request = crud.get_request(db, req_id=req_id)
+        assert db_request.status == models.Statuses.Processing.name
+        assert db_request.lease_expires == new_lease
+        assert crud.get_request_sentences(db, req_id=req_id) == []
+        crud.release_request(db, req_id=req_id, lease=new_lease, status=models.Statuses.Success)
+    finally:
+        db.close()
+
+
+def test_retry_limit(stub_server):
+    db = SessionLocal()
+    try:
+        path = f"{stub_server}/missing.html?run={uuid.uuid4()}"
+        req_id = _create_request(db, path)
+    finally:
+        db.close()
+
+    Scheduler(limiter=DomainRateLimiter(rate=0)).run([(req_id, path, 0)])
+
+    db = SessionLocal()
+    try:
+        db_request = crud.get_request(db, req_id=req_id)
+        assert db_request.status == models.Statuses.Error.name
+        assert db_request.attempts == JOB_MAX_ATTEMPTS
+        assert db_request.lease_expires is None
+    finally:
+        db.close()
+
+
+def test_worker_pool_restarted(monkeypatch):
+    class Stop(Exception):
+        pass
+
+    runs = []
+
+    def run_pool(processes, poll_interval):
+        runs.append(processes)
+        if len(runs) == 1:
+            raise BrokenProcessPool("worker process died")
+        raise Stop()
+
+    monkeypatch.setattr(worker_service, '_run_pool', run_pool)
+    with pytest.raises(Stop):
+        worker_service.run_worker(processes=2, poll_interval=0)
+    assert runs == [2, 2]